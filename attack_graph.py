@@ -0,0 +1,349 @@
+import os
+import re
+from collections import deque
+from typing import Any, Dict, Iterable, List
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+"""
+Attack-path graphs compiled from company profiles.
+
+A profile's adversary_training_brief and key_digital_assets already describe
+an attack graph. compile_profile turns them into nodes ordered like a kill
+chain (initial access, escalation/persistence, lateral movement, assets,
+objectives) and links each node to later ones that share keywords with it.
+Every node also links to the whole next stage when nothing there matches, and
+is entered from the whole previous stage when nothing there links to it, so
+the chain never breaks. Detection opportunities are attached to the nodes
+they mention.
+
+Reachability and shortest paths from every node are computed once at compile
+time, so the queries used per turn (reachable objectives from a foothold,
+detection opportunities on a path, digest, move validation) are lookups.
+
+DASE_ATTACK_GRAPH=0 sends the full adversary_training_brief instead of the
+digest.
+"""
+load_dotenv()
+
+ATTACK_GRAPH = os.getenv("DASE_ATTACK_GRAPH", "1").strip().lower() in ("1", "true", "yes", "on")
+
+BRIEF = "adversary_training_brief"
+
+ACCESS = "access"
+ESCALATION = "escalation"
+LATERAL = "lateral"
+ASSET = "asset"
+OBJECTIVE = "objective"
+# Kill-chain order of the stages and the brief section each one comes from.
+STAGES = (ACCESS, ESCALATION, LATERAL, ASSET, OBJECTIVE)
+TACTICS = (ACCESS, ESCALATION, LATERAL)
+BRIEF_SECTIONS = {
+    ACCESS: "likely_initial_access",
+    ESCALATION: "privilege_escalation_persistence",
+    LATERAL: "lateral_movement",
+    OBJECTIVE: "high_value_objectives",
+}
+DETECTIONS = "detection_opportunities"
+STAGE_LABELS = {
+    ACCESS: "Initial access",
+    ESCALATION: "Escalation/persistence",
+    LATERAL: "Lateral movement",
+    ASSET: "Assets",
+    OBJECTIVE: "Objectives",
+}
+
+# Words that say how something happens rather than what it touches.
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "of", "on", "or",
+    "that", "the", "to", "via", "with", "use", "using", "access", "compromise", "compromised", "change",
+    "changes", "unusual", "unexpected", "anomalous", "pattern", "patterns", "spike", "spikes", "attempt",
+    "attempts", "create", "retrieve", "legacy", "primary", "notes", "high",
+}
+MIN_SUBWORD = 5  # "spearphishing" matches "phishing"
+
+
+def terms(text: str) -> set[str]:
+    """Normalized keywords of a piece of text."""
+    words = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        words.add(word[:-1] if len(word) > 3 and word.endswith("s") else word)
+    return words
+
+
+def _matches(left: set[str], right: set[str]) -> int:
+    """Number of keywords of `left` found in `right`, counting long sub-words."""
+    count = 0
+    for word in left:
+        if word in right or (len(word) >= MIN_SUBWORD and any(
+            len(other) >= MIN_SUBWORD and (word in other or other in word) for other in right
+        )):
+            count += 1
+    return count
+
+
+class Node(BaseModel):
+    id: str
+    stage: str
+    label: str
+    detail: str = ""
+
+
+class PathReport(BaseModel):
+    path: List[Node]
+    detections: List[str]
+
+
+class MoveCheck(BaseModel):
+    valid: bool
+    issues: List[str] = []
+    target: str | None = None  # node id of the target asset
+    technique: str | None = None  # node id of the tactic the technique matched
+    reachable_objectives: List[str] = []
+    detections: List[str] = []
+
+
+class AttackGraph:
+    """In-memory attack graph of one company profile."""
+
+    def __init__(self, company_name: str, nodes: List[Node], edges: Dict[str, List[str]],
+                 detections: List[str], detected_at: Dict[str, List[int]]):
+        self.company_name = company_name
+        self.nodes = {node.id: node for node in nodes}
+        self.edges = edges
+        self.detections = detections
+        self.detected_at = detected_at  # node id -> indexes into detections
+        self._terms = {node.id: terms(f"{node.label} {node.detail}") for node in nodes}
+        # BFS parents from every node: shortest paths and reachability in one pass.
+        self._parents: Dict[str, Dict[str, str | None]] = {node.id: self._bfs(node.id) for node in nodes}
+
+    def _bfs(self, source: str) -> Dict[str, str | None]:
+        parents: Dict[str, str | None] = {source: None}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            for nxt in self.edges.get(current, []):
+                if nxt not in parents:
+                    parents[nxt] = current
+                    queue.append(nxt)
+        return parents
+
+    def stage(self, stage: str) -> List[Node]:
+        return [node for node in self.nodes.values() if node.stage == stage]
+
+    def resolve(self, text: str, stages: Iterable[str] = STAGES) -> Node | None:
+        """
+        Finds the node a piece of text refers to: an id, an exact label, or the
+        best keyword match (None when nothing matches).
+        """
+        if text in self.nodes:
+            return self.nodes[text]
+        allowed = [node for node in self.nodes.values() if node.stage in stages]
+        lowered = text.strip().lower()
+        for node in allowed:
+            if node.label.lower() == lowered:
+                return node
+        words = terms(text)
+        best, best_score = None, 0.0
+        for node in allowed:
+            score = _matches(self._terms[node.id], words) / (len(self._terms[node.id]) or 1)
+            if score > best_score:
+                best, best_score = node, score
+        return best
+
+    def footholds(self, texts: Iterable[str]) -> List[Node]:
+        """Assets named in the given texts (e.g. adversary moves, oldest first); the most recent one last."""
+        found: List[Node] = []
+        for text in texts:
+            lowered = text.lower()
+            for node in self.stage(ASSET):
+                name = node.label.lower().split("(")[0].strip()
+                if name and name in lowered:
+                    if node in found:
+                        found.remove(node)
+                    found.append(node)
+        return found
+
+    def reachable(self, source: str) -> List[Node]:
+        """Every node reachable from `source`, nearest first."""
+        return [self.nodes[node_id] for node_id in self._parents.get(source, {}) if node_id != source]
+
+    def reachable_objectives(self, foothold: str) -> List[Node]:
+        """Objectives reachable from a foothold (node id, label or free text)."""
+        node = self.resolve(foothold)
+        if node is None:
+            return []
+        return [node for node in self.reachable(node.id) if node.stage == OBJECTIVE]
+
+    def shortest_path(self, source: str, target: str) -> List[Node]:
+        """Nodes on the shortest path between two node ids, or [] when there is none."""
+        parents = self._parents.get(source, {})
+        if target not in parents:
+            return []
+        path = [target]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        return [self.nodes[node_id] for node_id in reversed(path)]
+
+    def path_detections(self, path: Iterable[Node]) -> List[str]:
+        """Detection opportunities attached to any node on a path."""
+        indexes: List[int] = []
+        for node in path:
+            for index in self.detected_at.get(node.id, []):
+                if index not in indexes:
+                    indexes.append(index)
+        return [self.detections[index] for index in indexes]
+
+    def path(self, source: str, target: str) -> PathReport:
+        """Shortest path between two nodes (ids, labels or free text) and its detection opportunities."""
+        start, end = self.resolve(source), self.resolve(target)
+        nodes = self.shortest_path(start.id, end.id) if start and end else []
+        return PathReport(path=nodes, detections=self.path_detections(nodes))
+
+    def summary(self) -> str:
+        """The static part of the digest: the brief's stages, one line each."""
+        lines = [f"Attack graph for {self.company_name}:"]
+        for stage in STAGES:
+            nodes = self.stage(stage)
+            if nodes and stage != ASSET:  # assets are listed in the profile itself
+                lines.append(f"{STAGE_LABELS[stage]}: " + "; ".join(node.label for node in nodes) + ".")
+        if self.detections:
+            lines.append("Detection opportunities: " + "; ".join(self.detections) + ".")
+        return "\n".join(lines)
+
+    def state(self, footholds: List[Node]) -> str:
+        """The per-turn part of the digest: current footholds, next steps, reachable objectives and detections."""
+        if not footholds:
+            return "Adversary foothold: none yet (initial access stage)."
+        current = footholds[-1]
+        steps = [self.nodes[node_id] for node_id in self.edges.get(current.id, [])]
+        objectives = [node for node in self.reachable(current.id) if node.stage == OBJECTIVE]
+        paths = [self.shortest_path(current.id, node.id) for node in objectives] or [[current]]
+        detections = self.path_detections(node for path in paths for node in path)
+        lines = ["Adversary footholds so far: " + "; ".join(node.label for node in footholds) + "."]
+        if steps and [node.stage for node in steps] != [OBJECTIVE] * len(steps):
+            lines.append(f"Next steps from {current.label}: " + "; ".join(node.label for node in steps) + ".")
+        lines.append(f"Reachable objectives from {current.label}: " + ("; ".join(node.label for node in objectives) or "none") + ".")
+        if detections:
+            lines.append("Detection opportunities on those paths: " + "; ".join(detections) + ".")
+        return "\n".join(lines)
+
+    def digest(self, footholds: List[Node] | None = None) -> str:
+        """
+        Compact replacement for the adversary_training_brief in prompts: the
+        whole brief before the first foothold, then only the current position.
+        """
+        if not footholds:
+            return f"{self.summary()}\n{self.state([])}"
+        return f"Attack graph for {self.company_name}:\n{self.state(footholds)}"
+
+    def validate_move(self, move: Dict[str, Any], previous_moves: List[Dict[str, Any]] | None = None) -> MoveCheck:
+        """
+        Checks a model-proposed adversary move against the graph.
+
+        Args:
+            move (dict): Fields of an AdversaryMove.
+            previous_moves (list[dict] | None): Moves already played in the session.
+
+        Returns:
+            MoveCheck: Issues found, plus the objectives the target opens up and the
+            detection opportunities on the way there.
+        """
+        previous_moves = previous_moves or []
+        check = MoveCheck(valid=True)
+        target = next(
+            (node for node in self.stage(ASSET) if node.label.lower() == str(move.get("target_asset", "")).strip().lower()),
+            None,
+        )
+        if target is None:
+            check.issues.append(f"Unknown target asset: {move.get('target_asset')!r}.")
+        else:
+            check.target = target.id
+
+        technique = str(move.get("attack_technique", ""))
+        words = terms(technique)
+        tactic = max(
+            (node for stage in TACTICS for node in self.stage(stage)),
+            key=lambda node: _matches(self._terms[node.id], words),
+            default=None,
+        )
+        if tactic is not None and _matches(self._terms[tactic.id], words):
+            check.technique = tactic.id
+            if target is not None and target.id not in self._parents[tactic.id]:
+                check.issues.append(f"{target.label} is not reachable via {tactic.label}.")
+
+        expected = len(previous_moves) + 1
+        if move.get("move_number") != expected:
+            check.issues.append(f"Move number {move.get('move_number')} should be {expected}.")
+        remaining = move.get("reactions_remaining")
+        if isinstance(remaining, int) and remaining < 0:
+            check.issues.append("Reactions remaining is negative.")
+        if previous_moves and isinstance(remaining, int) and remaining > previous_moves[-1].get("reactions_remaining", remaining):
+            check.issues.append("Reactions remaining went up.")
+
+        if target is not None:
+            objectives = [node for node in self.reachable(target.id) if node.stage == OBJECTIVE]
+            check.reachable_objectives = [node.label for node in objectives]
+            start = tactic.id if check.technique else target.id
+            path = self.shortest_path(start, target.id)
+            for node in objectives:
+                path += self.shortest_path(target.id, node.id)[1:]
+            check.detections = self.path_detections(path)
+        check.valid = not check.issues
+        return check
+
+
+def compile_profile(profile: Dict[str, Any]) -> AttackGraph:
+    """
+    Builds the attack graph of a company profile.
+
+    Args:
+        profile (dict): A company profile as loaded from json/.
+
+    Returns:
+        AttackGraph: The compiled graph with precomputed paths.
+    """
+    brief = profile.get(BRIEF) or {}
+    nodes: List[Node] = []
+    for stage in STAGES:
+        if stage == ASSET:
+            for index, asset in enumerate(item for item in profile.get("key_digital_assets", []) if item.get("asset")):
+                detail = " ".join(str(asset.get(key, "")) for key in ("sensitivity", "notes")).strip()
+                nodes.append(Node(id=f"{stage}:{index}", stage=stage, label=asset["asset"], detail=detail))
+            continue
+        for index, entry in enumerate(brief.get(BRIEF_SECTIONS[stage], [])):
+            nodes.append(Node(id=f"{stage}:{index}", stage=stage, label=str(entry)))
+
+    node_terms = {node.id: terms(f"{node.label} {node.detail}") for node in nodes}
+    by_stage = {stage: [node for node in nodes if node.stage == stage] for stage in STAGES}
+    edges: Dict[str, List[str]] = {}
+    for node in nodes:
+        position = STAGES.index(node.stage)
+        later = [other for stage in STAGES[position + 1:] for other in by_stage[stage]]
+        linked = [other.id for other in later if _matches(node_terms[node.id], node_terms[other.id])]
+        following = next((by_stage[stage] for stage in STAGES[position + 1:] if by_stage[stage]), [])
+        if following and not any(other.id in linked for other in following):
+            linked = [other.id for other in following] + linked
+        edges[node.id] = linked
+    for node in nodes:
+        position = STAGES.index(node.stage)
+        previous = next((by_stage[stage] for stage in reversed(STAGES[:position]) if by_stage[stage]), [])
+        if previous and not any(node.id in edges[other.id] for other in previous):
+            for other in previous:
+                edges[other.id].append(node.id)
+
+    detections = [str(entry) for entry in brief.get(DETECTIONS, [])]
+    detected_at: Dict[str, List[int]] = {}
+    for index, detection in enumerate(detections):
+        words = terms(detection)
+        for node in nodes:
+            if _matches(words, node_terms[node.id]):
+                detected_at.setdefault(node.id, []).append(index)
+    return AttackGraph(profile.get("company_name", ""), nodes, edges, detections, detected_at)
+
+
+def without_brief(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The profile minus the adversary_training_brief that the digest replaces."""
+    return {key: value for key, value in profile.items() if key != BRIEF}
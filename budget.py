@@ -0,0 +1,188 @@
+import os
+import threading
+from collections import deque
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+import routing
+"""
+Adaptive thinking-budget controller for DASE turns.
+
+The controller picks a thinking budget (Gemini) or reasoning effort (OpenAI)
+and an output token cap for every turn from the turn type and the session
+difficulty, then scales it down while the recent latency percentile is above
+the configured target. Latencies are tracked per turn type and model, so fast
+setup turns and long debriefs do not skew each other's budgets, and only
+successful turns are recorded.
+"""
+load_dotenv()
+
+LATENCY_TARGET_S = float(os.getenv("DASE_LATENCY_TARGET_S", "15"))
+LATENCY_PERCENTILE = float(os.getenv("DASE_LATENCY_PERCENTILE", "0.9"))
+LATENCY_WINDOW = int(os.getenv("DASE_LATENCY_WINDOW", "20"))
+
+# Thinking tokens before difficulty and latency scaling.
+BASE_THINKING = {
+    routing.SETUP: 512,
+    routing.ADVERSARY_MOVE: 2048,
+    routing.DEBRIEF: 8192,
+}
+
+# Visible output tokens allowed on top of the thinking budget.
+OUTPUT_CAPS = {
+    routing.SETUP: 1024,
+    routing.ADVERSARY_MOVE: 2048,
+    routing.DEBRIEF: 8192,
+}
+
+DIFFICULTY_SCALE = {"low": 0.5, "medium": 1.0, "high": 1.5}
+
+# The debrief is never squeezed below this fraction of its budget.
+DEBRIEF_MIN_SCALE = 0.5
+MIN_SCALE = 0.25
+MIN_SAMPLES = 3
+
+
+class BudgetDecision(BaseModel):
+    thinking_budget: int
+    max_output_tokens: int
+    reasoning_effort: str
+    latency_scale: float
+
+
+def percentile(values: List[float], q: float) -> float | None:
+    """Returns the q-th percentile (0-1) of values by nearest rank, or None when empty."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyWindow:
+    """Rolling window of observed turn latencies in seconds."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency_s: float) -> None:
+        with self._lock:
+            self._samples.append(latency_s)
+
+    def samples(self) -> List[float]:
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        """Returns the q-th percentile (0-1) of the window, or None when empty."""
+        return percentile(self.samples(), q)
+
+
+def _thinking_limits(model: str) -> tuple[int, int]:
+    """Thinking budget bounds for a Gemini model; pro models cannot disable thinking."""
+    if "pro" in model:
+        return 128, 32768
+    return 0, 24576
+
+
+def _reasoning_effort(model: str, thinking_budget: int) -> str:
+    """Maps a thinking budget onto the OpenAI reasoning effort levels."""
+    if thinking_budget <= 256:
+        return "none" if model.startswith("gpt-5.1") else "minimal"
+    if thinking_budget < 1024:
+        return "low"
+    if thinking_budget < 4096:
+        return "medium"
+    return "high"
+
+
+class ThinkingBudgetController:
+    """Chooses per-turn budgets and tracks the latencies they produce."""
+
+    def __init__(
+        self,
+        target_s: float = LATENCY_TARGET_S,
+        percentile: float = LATENCY_PERCENTILE,
+        window: int = LATENCY_WINDOW,
+    ):
+        self.target_s = target_s
+        self.percentile = percentile
+        self.window_size = window
+        self.windows: Dict[tuple[str, str], LatencyWindow] = {}
+        self._lock = threading.Lock()
+
+    def window(self, turn_type: str, model: str) -> LatencyWindow:
+        """Returns the latency window for one turn type on one model."""
+        with self._lock:
+            key = (turn_type, model)
+            if key not in self.windows:
+                self.windows[key] = LatencyWindow(self.window_size)
+            return self.windows[key]
+
+    def latency_scale(self, turn_type: str, model: str) -> float:
+        """Returns the factor applied to budgets given the latency percentile observed for this turn type and model."""
+        window = self.window(turn_type, model)
+        if len(window.samples()) < MIN_SAMPLES:
+            return 1.0
+        observed = window.percentile(self.percentile)
+        if not observed or observed <= self.target_s:
+            return 1.0
+        return max(MIN_SCALE, self.target_s / observed)
+
+    def decide(self, turn_type: str, difficulty: str, model: str, drafted: bool = False) -> BudgetDecision:
+        """
+        Picks the budget for a turn.
+
+        Args:
+            turn_type (str): One of routing.TURN_TYPES.
+            difficulty (str): Session difficulty (low, medium, high).
+            model (str): Model the turn was routed to.
+            drafted (bool): Every earlier move has a drafted debrief note (see debrief.py),
+                so the debrief only refines them and gets the adversary-move budget.
+
+        Returns:
+            BudgetDecision: Thinking budget, output cap and reasoning effort.
+        """
+        scale = self.latency_scale(turn_type, model)
+        if turn_type == routing.DEBRIEF:
+            scale = max(scale, DEBRIEF_MIN_SCALE)
+            if drafted:
+                turn_type = routing.ADVERSARY_MOVE
+        base = BASE_THINKING.get(turn_type, BASE_THINKING[routing.ADVERSARY_MOVE])
+        budget = int(base * DIFFICULTY_SCALE.get(str(difficulty).lower(), 1.0) * scale)
+        low, high = _thinking_limits(model)
+        budget = min(high, max(low, budget))
+        output_cap = OUTPUT_CAPS.get(turn_type, OUTPUT_CAPS[routing.ADVERSARY_MOVE])
+        return BudgetDecision(
+            thinking_budget=budget,
+            max_output_tokens=budget + output_cap,
+            reasoning_effort=_reasoning_effort(model, budget),
+            latency_scale=round(scale, 3),
+        )
+
+    def observe(self, latency_s: float, turn_type: str, model: str) -> None:
+        """
+        Records the latency achieved by a successful turn.
+
+        Args:
+            latency_s (float): Time the turn took.
+            turn_type (str): The routed turn type (as passed to decide).
+            model (str): Model the turn ran on.
+        """
+        self.window(turn_type, model).add(latency_s)
+
+
+CONTROLLERS: Dict[str, ThinkingBudgetController] = {
+    "gemini": ThinkingBudgetController(),
+    "openai": ThinkingBudgetController(),
+}
+
+
+def controller_for(backend: str) -> ThinkingBudgetController:
+    """Returns the shared controller for a backend, creating it on first use."""
+    if backend not in CONTROLLERS:
+        CONTROLLERS[backend] = ThinkingBudgetController()
+    return CONTROLLERS[backend]
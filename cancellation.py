@@ -0,0 +1,97 @@
+import threading
+from typing import Callable, List
+"""
+Cancellation of in-flight DASE turns.
+
+A CancelToken is passed to gemini.generate / openai_cli.run_turn. Cancelling it
+sets a flag checked between streamed chunks and immediately closes whatever was
+registered with on_cancel (the HTTP response of a Gemini stream, the OpenAI
+response stream), which aborts the HTTP request while the shared provider
+clients stay open. The turn then rolls back its conversation history entry,
+logs the partial reply with metadata cancelled=True and raises
+GenerationCancelled.
+"""
+
+
+class GenerationCancelled(Exception):
+    """Raised by generate when its turn was cancelled; carries the partial reply."""
+
+    def __init__(self, partial_text: str = ""):
+        super().__init__("Generation cancelled.")
+        self.partial_text = partial_text
+
+
+class CancelToken:
+    """Cancellation signal for one in-flight turn."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._closers: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Flags the turn as cancelled and closes its registered connections."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            closers, self._closers = self._closers, []
+        for close in closers:
+            try:
+                close()
+            except Exception:
+                # Best effort: the streaming loop still sees the flag at the next chunk.
+                pass
+
+    def on_cancel(self, close: Callable[[], None] | None) -> None:
+        """Registers a callable that aborts the request; runs it now if already cancelled."""
+        if close is None:
+            return
+        with self._lock:
+            if not self._event.is_set():
+                self._closers.append(close)
+                return
+        try:
+            close()
+        except Exception:
+            pass
+
+    def raise_if_cancelled(self, partial_text: str = "") -> None:
+        if self._event.is_set():
+            raise GenerationCancelled(partial_text)
+
+
+def run_interruptible(fn: Callable, *args, **kwargs):
+    """
+    Runs fn(*args, cancel=token, **kwargs) on a worker thread so Ctrl+C cancels
+    the turn instead of ending the CLI session.
+
+    Returns:
+        The value returned by fn.
+
+    Raises:
+        GenerationCancelled: When the trainee pressed Ctrl+C during the turn.
+    """
+    token = CancelToken()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["value"] = fn(*args, cancel=token, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        try:
+            thread.join(0.1)
+        except KeyboardInterrupt:
+            token.cancel()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
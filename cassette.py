@@ -0,0 +1,387 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+"""
+Record/replay cassettes for DASE's LLM calls.
+
+In record mode every request made through providers.py is fingerprinted and
+its full response (every streamed chunk with its time offset) is appended to a
+gzip-compressed JSON-lines cassette. In replay mode the cassette answers the
+same requests with no network access, either at the original chunk timing or
+instantly, which gives deterministic regression runs and offline demos.
+
+Selected with DASE_CASSETTE_MODE (off, record, replay), DASE_CASSETTE (path)
+and DASE_CASSETTE_SPEED (original, instant), the CLIs' --record/--replay
+flags, or the GUI setup screen.
+"""
+load_dotenv()
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (OFF, RECORD, REPLAY)
+
+ORIGINAL = "original"
+INSTANT = "instant"
+
+DEFAULT_PATH = os.path.join("cassettes", "session.jsonl.gz")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class RecordedError(RuntimeError):
+    """Replays an error the provider raised while recording."""
+
+
+def to_data(obj: Any) -> Any:
+    """Converts SDK objects (pydantic models, namespaces) into plain JSON data."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", exclude_none=True)
+    if isinstance(obj, SimpleNamespace):
+        return {key: to_data(value) for key, value in vars(obj).items()}
+    if isinstance(obj, dict):
+        return {str(key): to_data(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_data(value) for value in obj]
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+
+def to_namespace(data: Any) -> Any:
+    """Turns plain data back into attribute-accessible objects."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{key: to_namespace(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return [to_namespace(value) for value in data]
+    return data
+
+
+# Per-turn output budgets chosen by budget.py. They adapt to observed latency,
+# which differs between recording and (instant) replay, so they are left out of
+# the fingerprint.
+BUDGET_FIELDS = ("thinking_config", "max_output_tokens", "reasoning")
+
+
+def _without_budget(request: Dict[str, Any]) -> Dict[str, Any]:
+    request = {key: value for key, value in request.items() if key not in BUDGET_FIELDS}
+    if isinstance(request.get("config"), dict):
+        request["config"] = _without_budget(request["config"])
+    return request
+
+
+def fingerprint(provider: str, method: str, request: Dict[str, Any]) -> str:
+    """Stable hash of a request, ignoring adaptive budgets; identical requests share a fingerprint."""
+    canonical = json.dumps(
+        {"provider": provider, "method": method, "request": _without_budget(to_data(request))},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """A cassette file in record or replay mode."""
+
+    def __init__(self, path: str, mode: str, speed: str = ORIGINAL):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        if mode == REPLAY:
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["fp"], []).append(entry)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _next_entry(self, fp: str) -> Dict[str, Any]:
+        """Returns recordings for a fingerprint in order, repeating the last one."""
+        with self._lock:
+            entries = self._entries.get(fp)
+            if not entries:
+                raise CassetteMiss(f"No recorded response for request {fp[:12]} in {self.path}; re-record the cassette.")
+            index = self._served.get(fp, 0)
+            self._served[fp] = index + 1
+            return entries[min(index, len(entries) - 1)]
+
+    def _replay(self, entry: Dict[str, Any], decode: Callable[[Any], Any]) -> Iterator[Any]:
+        started = time.monotonic()
+        for chunk in entry["chunks"]:
+            if self.speed == ORIGINAL:
+                delay = chunk["t"] - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield decode(chunk["data"])
+        if entry.get("error"):
+            raise RecordedError(entry["error"])
+
+    def stream(
+        self,
+        provider: str,
+        method: str,
+        request: Dict[str, Any],
+        live: Callable[[], Iterator[Any]],
+        decode: Callable[[Any], Any],
+    ) -> Iterator[Any]:
+        """
+        Records or replays a streaming call.
+
+        Args:
+            provider (str): Provider name, part of the fingerprint.
+            method (str): SDK method name, part of the fingerprint.
+            request (dict): The request arguments that identify the call.
+            live (Callable): Starts the real call (record mode only).
+            decode (Callable): Rebuilds an SDK chunk object from recorded data.
+        """
+        fp = fingerprint(provider, method, request)
+        if self.mode == REPLAY:
+            yield from self._replay(self._next_entry(fp), decode)
+            return
+
+        started = time.monotonic()
+        chunks, error, abandoned = [], None, False
+        try:
+            for chunk in live():
+                chunks.append({"t": round(time.monotonic() - started, 4), "data": to_data(chunk)})
+                yield chunk
+        except GeneratorExit:
+            # Abandoned streams (cancelled turns) are not recorded; a replay
+            # would serve the partial reply as if it were complete.
+            abandoned = True
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if not abandoned and (error is not None or chunks):
+                self._append({"fp": fp, "provider": provider, "method": method, "chunks": chunks, "error": error})
+
+    def call(
+        self,
+        provider: str,
+        method: str,
+        request: Dict[str, Any],
+        live: Callable[[], Any],
+        decode: Callable[[Any], Any],
+    ) -> Any:
+        """Records or replays a non-streaming call."""
+        # Exhausted, not abandoned, so the response is recorded.
+        return list(self.stream(provider, method, request, lambda: iter([live()]), decode))[0]
+
+
+# --- SDK proxies ---
+
+def _decode_gemini(data: Any):
+    from google.genai import types
+    # JSON validation so base64-encoded bytes fields (thought signatures) round-trip.
+    return types.GenerateContentResponse.model_validate_json(json.dumps(data))
+
+
+def _decode_openai_response(data: Any):
+    try:
+        from openai.types.responses import Response
+        return Response.model_validate(data)
+    except Exception:
+        return to_namespace(data)
+
+
+def _decode_openai_event(data: Any):
+    try:
+        from openai.types.responses import ResponseStreamEvent
+        from pydantic import TypeAdapter
+        return TypeAdapter(ResponseStreamEvent).validate_python(data)
+    except Exception:
+        return to_namespace(data)
+
+
+class _GeminiModels:
+    def __init__(self, cassette: Cassette, models):
+        self._cassette = cassette
+        self._models = models
+
+    def generate_content_stream(self, model, contents, config=None):
+        request = {"model": model, "contents": contents, "config": config}
+        return self._cassette.stream(
+            "gemini", "generate_content_stream", request,
+            lambda: self._models.generate_content_stream(model=model, contents=contents, config=config),
+            _decode_gemini,
+        )
+
+    def generate_content(self, model, contents, config=None):
+        request = {"model": model, "contents": contents, "config": config}
+        return self._cassette.call(
+            "gemini", "generate_content", request,
+            lambda: self._models.generate_content(model=model, contents=contents, config=config),
+            _decode_gemini,
+        )
+
+
+def _decode_gemini_cache(data: Any):
+    from google.genai import types
+    return types.CachedContent.model_validate_json(json.dumps(data))
+
+
+class _GeminiCaches:
+    def __init__(self, cassette: Cassette, caches):
+        self._cassette = cassette
+        self._caches = caches
+
+    def create(self, model, config=None):
+        request = {"model": model, "config": config}
+        return self._cassette.call(
+            "gemini", "caches.create", request,
+            lambda: self._caches.create(model=model, config=config),
+            _decode_gemini_cache,
+        )
+
+
+class GeminiClient:
+    """Wraps the shared google-genai client (or nothing, in replay mode) with a cassette."""
+
+    def __init__(self, cassette: Cassette, client=None):
+        self.models = _GeminiModels(cassette, client.models if client else None)
+        self.caches = _GeminiCaches(cassette, client.caches if client else None)
+
+
+class _OpenAIResponses:
+    def __init__(self, cassette: Cassette, responses):
+        self._cassette = cassette
+        self._responses = responses
+
+    def create(self, stream: bool = False, **kwargs):
+        request = {"stream": stream, **kwargs}
+        if stream:
+            return self._cassette.stream(
+                "openai", "responses.create", request,
+                lambda: self._responses.create(stream=True, **kwargs),
+                _decode_openai_event,
+            )
+        return self._cassette.call(
+            "openai", "responses.create", request,
+            lambda: self._responses.create(**kwargs),
+            _decode_openai_response,
+        )
+
+
+def _decode_chat_chunk(data: Any):
+    try:
+        from openai.types.chat import ChatCompletionChunk
+        return ChatCompletionChunk.model_validate(data)
+    except Exception:
+        return to_namespace(data)
+
+
+def _decode_chat_completion(data: Any):
+    try:
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(data)
+    except Exception:
+        return to_namespace(data)
+
+
+class _OpenAIChatCompletions:
+    def __init__(self, cassette: Cassette, completions):
+        self._cassette = cassette
+        self._completions = completions
+
+    def create(self, stream: bool = False, **kwargs):
+        request = {"stream": stream, **kwargs}
+        if stream:
+            return self._cassette.stream(
+                "openai", "chat.completions.create", request,
+                lambda: self._completions.create(stream=True, **kwargs),
+                _decode_chat_chunk,
+            )
+        return self._cassette.call(
+            "openai", "chat.completions.create", request,
+            lambda: self._completions.create(**kwargs),
+            _decode_chat_completion,
+        )
+
+
+class OpenAIClient:
+    """Wraps a shared OpenAI client (or nothing, in replay mode) with a cassette."""
+
+    def __init__(self, cassette: Cassette, client=None):
+        self.responses = _OpenAIResponses(cassette, client.responses if client else None)
+        self.chat = SimpleNamespace(completions=_OpenAIChatCompletions(cassette, client.chat.completions if client else None))
+
+
+# --- Active cassette ---
+
+_active: Cassette | None = None
+_configured = False
+
+
+def configure(mode: str = OFF, path: str | None = None, speed: str = ORIGINAL) -> Cassette | None:
+    """
+    Selects the cassette used by every client built through providers.py.
+
+    Args:
+        mode (str): off, record or replay.
+        path (str | None): Cassette file; defaults to DEFAULT_PATH.
+        speed (str): original or instant (replay only).
+
+    Returns:
+        Cassette | None: The active cassette, or None when off.
+    """
+    global _active, _configured
+    _configured = True
+    _active = None if mode == OFF else Cassette(path or DEFAULT_PATH, mode, speed)
+    return _active
+
+
+def active() -> Cassette | None:
+    """Returns the active cassette, configuring it from the environment on first use."""
+    if not _configured:
+        configure(
+            os.getenv("DASE_CASSETTE_MODE", OFF).strip().lower() or OFF,
+            os.getenv("DASE_CASSETTE") or None,
+            os.getenv("DASE_CASSETTE_SPEED", ORIGINAL).strip().lower() or ORIGINAL,
+        )
+    return _active
+
+
+def add_cli_arguments(parser) -> None:
+    """Adds --record/--replay/--instant to an argparse parser."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--record", metavar="CASSETTE", help="Record LLM calls to a cassette file.")
+    group.add_argument("--replay", metavar="CASSETTE", help="Replay LLM calls from a cassette file (no network).")
+    parser.add_argument("--instant", action="store_true", help="Replay without the recorded chunk timing.")
+
+
+def configure_from_args(args) -> Cassette | None:
+    """Applies the CLI cassette flags; leaves the environment setting alone when none are given."""
+    if args.record:
+        return configure(RECORD, args.record)
+    if args.replay:
+        return configure(REPLAY, args.replay, INSTANT if args.instant else ORIGINAL)
+    return active()
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from statistics import mean
+from typing import Any, Callable, Dict, List
+
+from pydantic import BaseModel
+
+import budget
+import cancellation
+import gemini
+import openai_helper
+import utils
+from openai_cli import DASEClient
+"""
+Side-by-side comparison of the Gemini and OpenAI backends.
+
+A ComparisonSession sends every trainee turn to both backends concurrently.
+Each backend keeps its own conversation history and SessionLog, so the two
+branches are independent exercises. After a turn the trainee can keep both
+branches going or continue with one. Every branch log carries the shared
+comparison_id and a per-turn table of latency and token usage, and
+summarize() aggregates saved comparison logs per company profile.
+
+Usage:
+    python comparison.py "session_logs/*.json"
+"""
+GEMINI = "gemini"
+OPENAI = "openai"
+BACKENDS = (GEMINI, OPENAI)
+LABELS = {GEMINI: "Google Gemini", OPENAI: "OpenAI ChatGPT"}
+BOTH = "both"
+
+
+class BranchResult(BaseModel):
+    backend: str
+    text: str = ""
+    latency_s: float | None = None
+    usage: Dict[str, int] = {}
+    error: str | None = None
+    cancelled: bool = False
+
+
+def setup_prompt(user_input: str, difficulty: str, reactions: Any, company_name: str) -> str:
+    """The first Gemini message carries the session settings, as in the GUI and CLI."""
+    return (
+        f"{user_input}\nThe user desires this level of technical difficulty: {difficulty} "
+        f"and this number of reactions {reactions}. The company to perform the exercise on is {company_name}."
+    )
+
+
+class _Branch:
+    def __init__(self, backend: str, log: utils.SessionLog):
+        self.backend = backend
+        self.log = log
+        self.active = True
+        self.history: List[Any] = []  # Gemini conversation
+        self.client: DASEClient | None = None  # OpenAI conversation
+
+
+class ComparisonSession:
+    """One exercise played on both backends at once."""
+
+    def __init__(self, company_name: str, company_profile: str, difficulty: str, reactions: Any):
+        self.company_name = company_name
+        self.company_profile = company_profile
+        self.difficulty = difficulty
+        self.reactions = reactions
+        self.comparison_id = uuid.uuid4().hex
+        self.turns: List[Dict[str, Any]] = []
+        self.branches: Dict[str, _Branch] = {}
+        for backend in BACKENDS:
+            log = utils.SessionLog()
+            log.add_metadata("company_name", company_name)
+            log.add_metadata("difficulty", difficulty)
+            log.add_metadata("reactions", reactions)
+            log.add_metadata("model", LABELS[backend])
+            log.add_metadata("comparison_id", self.comparison_id)
+            log.add_metadata("comparison", self.turns)
+            self.branches[backend] = _Branch(backend, log)
+        self.branches[OPENAI].client = DASEClient(
+            prompt_id=openai_helper.DEFAULT_PROMPT_ID,
+            difficulty=difficulty,
+            reactions=str(reactions),
+            company_profile=company_profile,
+            company_name=company_name,
+        )
+
+    def active_backends(self) -> List[str]:
+        return [backend for backend, branch in self.branches.items() if branch.active]
+
+    def _run(self, branch: _Branch, user_input: str, structured, on_update, cancel) -> BranchResult:
+        result = BranchResult(backend=branch.backend)
+        turns_before = len(branch.log.turns)
+        stream = (lambda text: on_update(branch.backend, text)) if on_update else None
+        try:
+            if branch.backend == GEMINI:
+                answered = any(
+                    turn.role == "model" and not turn.metadata.get("cancelled") for turn in branch.log.turns
+                )
+                prompt = user_input if answered else setup_prompt(
+                    user_input, self.difficulty, self.reactions, self.company_name
+                )
+                result.text, _ = gemini.generate(
+                    prompt, self.company_profile, branch.log,
+                    structured=structured, on_update=stream, cancel=cancel, history=branch.history,
+                )
+            else:
+                result.text, _ = openai_helper.generate(
+                    user_input, self.company_profile, branch.log,
+                    structured=structured, on_update=stream, cancel=cancel, client=branch.client,
+                )
+        except cancellation.GenerationCancelled as e:
+            result.text, result.cancelled = e.partial_text, True
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        if len(branch.log.turns) > turns_before and branch.log.turns[-1].role == "model":
+            metadata = branch.log.turns[-1].metadata
+            result.latency_s = metadata.get("latency_s")
+            result.usage = metadata.get("usage", {})
+            result.error = result.error or metadata.get("error")
+        return result
+
+    def send(
+        self,
+        user_input: str,
+        structured: bool | None = None,
+        on_update: Callable[[str, str], None] | None = None,
+        cancel: cancellation.CancelToken | None = None,
+    ) -> Dict[str, BranchResult]:
+        """
+        Sends a trainee turn to every active branch concurrently.
+
+        Args:
+            user_input (str): The trainee's message.
+            structured (bool | None): Passed to both backends' generate.
+            on_update (Callable[[str, str], None] | None): Called with (backend, reply so far) while streaming.
+            cancel (CancelToken | None): Cancels every branch of the turn.
+
+        Returns:
+            dict[str, BranchResult]: The reply, latency and token usage per backend.
+        """
+        backends = self.active_backends()
+        with ThreadPoolExecutor(max_workers=len(backends)) as pool:
+            futures = {
+                backend: pool.submit(self._run, self.branches[backend], user_input, structured, on_update, cancel)
+                for backend in backends
+            }
+            results = {backend: future.result() for backend, future in futures.items()}
+        self.turns.append({
+            "turn": len(self.turns) + 1,
+            "results": {backend: result.model_dump(exclude={"text"}) for backend, result in results.items()},
+            "chosen": None,
+        })
+        return results
+
+    def choose(self, backend: str) -> None:
+        """Continues with one backend's branch, or with BOTH."""
+        if backend != BOTH:
+            for name, branch in self.branches.items():
+                branch.active = name == backend
+        if self.turns:
+            self.turns[-1]["chosen"] = backend
+
+    def save(self, directory: str = "session_logs") -> List[str]:
+        """Saves every branch log, including branches that were dropped."""
+        return [utils.save_session(branch.log, directory, suffix=f"_{backend}") for backend, branch in self.branches.items()]
+
+
+def summarize(logs: List[utils.SessionLog]) -> Dict[str, Dict[str, Any]]:
+    """
+    Per company profile and backend: latency, token usage, errors and how often
+    the trainee continued with the backend, over comparison session logs.
+    """
+    grouped: Dict[str, Dict[str, Dict[str, list]]] = {}
+    for log in logs:
+        if not log.metadata.get("comparison_id"):
+            continue
+        backend = next((name for name, label in LABELS.items() if label == log.metadata.get("model")), None)
+        if backend is None:
+            continue
+        stats = grouped.setdefault(log.metadata.get("company_name", "Unknown"), {}).setdefault(
+            backend, {"latency_s": [], "input_tokens": [], "output_tokens": [], "errors": [], "chosen": []}
+        )
+        for turn in log.turns:
+            if turn.role != "model":
+                continue
+            if turn.metadata.get("latency_s") is not None:
+                stats["latency_s"].append(turn.metadata["latency_s"])
+            usage = turn.metadata.get("usage", {})
+            stats["input_tokens"].append(usage.get("input_tokens", 0))
+            stats["output_tokens"].append(usage.get("output_tokens", 0) + usage.get("reasoning_tokens", 0))
+            stats["errors"].append(bool(turn.metadata.get("error")))
+        stats["chosen"].extend(1 for row in log.metadata.get("comparison", []) if row.get("chosen") == backend)
+
+    return {
+        company: {
+            backend: {
+                "turns": len(stats["input_tokens"]),
+                "latency_mean_s": mean(stats["latency_s"]) if stats["latency_s"] else None,
+                "latency_p90_s": budget.percentile(stats["latency_s"], 0.9),
+                "input_tokens_mean": mean(stats["input_tokens"]) if stats["input_tokens"] else None,
+                "output_tokens_mean": mean(stats["output_tokens"]) if stats["output_tokens"] else None,
+                "error_rate": sum(stats["errors"]) / len(stats["errors"]) if stats["errors"] else 0.0,
+                "times_chosen": sum(stats["chosen"]),
+            }
+            for backend, stats in backends.items()
+        }
+        for company, backends in grouped.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize comparison-mode session logs per company and backend.")
+    parser.add_argument("patterns", nargs="+", help="Glob patterns of session log files.")
+    args = parser.parse_args()
+    paths = sorted({path for pattern in args.patterns for path in glob.glob(pattern)})
+    print(json.dumps(summarize([utils.load_session(path) for path in paths]), indent=2))
@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from google.genai import types
+from pydantic import BaseModel
+
+import budget
+import providers
+import retrieval
+import routing
+import scheduler
+import utils
+"""
+Background drafting of the closing debrief.
+
+prompt.txt asks for step-by-step reasoning and improvement advice after the
+last reaction, which used to arrive as one long final response. Instead,
+after every adversary move a short note for that move (why the adversary
+chose it, what the defenders could have done better) is drafted on the fast
+model tier at BACKGROUND scheduler priority while the trainee is thinking,
+and stored in SessionLog.debrief_notes.
+
+On the debrief turn the backends call prepare(): it waits briefly for drafts
+still running and returns the notes plus an instruction that asks the model
+for the final move, its reasoning and the overall summary only. With every
+move drafted the debrief also gets a smaller thinking budget. stitch() then
+appends the per-move notes to the model's reply.
+
+Configuration (environment variables):
+    DASE_DEBRIEF_DRAFTS     draft per-move notes in the background (default 1)
+    DASE_DEBRIEF_WORKERS    concurrent drafting requests (default 2)
+    DASE_DEBRIEF_WAIT_S     how long the debrief waits for running drafts (default 20)
+"""
+load_dotenv()
+
+DRAFTS = os.getenv("DASE_DEBRIEF_DRAFTS", "1").strip().lower() in ("1", "true", "yes", "on")
+WORKERS = int(os.getenv("DASE_DEBRIEF_WORKERS", "2"))
+WAIT_S = float(os.getenv("DASE_DEBRIEF_WAIT_S", "20"))
+NOTE_MAX_TOKENS = 400
+
+NOTE_PROMPT = """You are drafting one section of the after-action debrief for a DASE incident response training exercise.
+Company: {company}. Difficulty: {difficulty}.
+Company profile (relevant sections):
+{profile}
+
+Defender action: {defender_action}
+Adversary move {move_number}: {move}
+
+Write two short sections for this move only, tied to the defender's action and the company's profile:
+Reasoning: why the adversary chose this move (2-4 sentences).
+Improvement: 1-3 concrete, company-specific actions the defenders could have taken."""
+
+DEBRIEF_INSTRUCTION = """Reasoning and improvement notes for the earlier adversary moves were drafted during the session:
+{notes}
+These notes will be appended to your reply, so do not repeat them. Write the final adversary move, then the
+debrief: a concise summary of the session, the numbered Attack Steps, the Reasoning and Improvements for the
+final move, and any overall improvements. If a note is wrong given how the session ended, correct it in one line.{missing}"""
+
+MISSING_INSTRUCTION = "\nNo note was drafted for move(s) {moves}; cover their reasoning and improvements yourself."
+
+_executor = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="debrief")
+_pending: Dict[str, List[Future]] = {}
+_lock = threading.Lock()
+
+
+class DebriefPlan(BaseModel):
+    notes: List[utils.DebriefNote]
+    moves: int  # adversary moves before the debrief
+    instruction: str
+    wait_s: float = 0.0  # time spent waiting for running drafts
+
+    @property
+    def complete(self) -> bool:
+        """True when every earlier move has a drafted note."""
+        drafted = {note.move_number for note in self.notes}
+        return all(number in drafted for number in range(1, self.moves + 1))
+
+
+def _complete(backend: str, model: str, prompt: str, difficulty: str) -> str:
+    """One short non-streaming completion on the session's backend."""
+    decision = budget.controller_for(backend).decide(routing.SETUP, difficulty, model)
+    if backend == "gemini":
+        response = providers.gemini_client().models.generate_content(
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                thinking_config=types.ThinkingConfig(thinking_budget=decision.thinking_budget),
+                max_output_tokens=decision.thinking_budget + NOTE_MAX_TOKENS,
+            ),
+        )
+        return response.text or ""
+    if backend == "openai":
+        response = providers.openai_client().responses.create(
+            model=model,
+            input=prompt,
+            reasoning={"effort": decision.reasoning_effort},
+            max_output_tokens=decision.thinking_budget + NOTE_MAX_TOKENS,
+        )
+        return getattr(response, "output_text", "") or ""
+    response = providers.local_client().chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=NOTE_MAX_TOKENS,
+    )
+    return response.choices[0].message.content or ""
+
+
+def _draft(log: utils.SessionLog, backend: str, company_profile: str, move_number: int,
+           turn_index: int, defender_action: str, move: str) -> None:
+    model = routing.MODEL_TIERS[backend]["fast"]
+    profile = retrieval.profile_context(company_profile, f"{defender_action}\n{move}", [move])
+    prompt = NOTE_PROMPT.format(
+        company=log.metadata.get("company_name", ""),
+        difficulty=log.metadata.get("difficulty", "medium"),
+        profile=profile.text,
+        defender_action=defender_action,
+        move_number=move_number,
+        move=move,
+    )
+    note = utils.DebriefNote(move_number=move_number, turn_index=turn_index, defender_action=defender_action, model=model)
+    started = time.perf_counter()
+    try:
+        scheduler.acquire(backend, model, scheduler.estimate_tokens(prompt) + NOTE_MAX_TOKENS,
+                          log.session_id, scheduler.BACKGROUND)
+        note.text = _complete(backend, model, prompt, log.metadata.get("difficulty", "medium")).strip()
+    except Exception as e:
+        if scheduler.is_rate_limit_error(e):
+            scheduler.penalize(backend, model)
+        note.error = f"{type(e).__name__}: {e}"
+    note.latency_s = round(time.perf_counter() - started, 3)
+    log.add_debrief_note(note)
+
+
+def draft_in_background(log: utils.SessionLog, backend: str, company_profile: str) -> None:
+    """
+    Queues a note for the adversary move just logged. Call right after the
+    model turn of an adversary move is added to `log`.
+
+    Args:
+        log (SessionLog): The session; its last two turns are the defender action and the move.
+        backend (str): "gemini", "openai" or "local".
+        company_profile (str): The company profile as a JSON string.
+    """
+    if not DRAFTS or len(log.turns) < 2 or log.turns[-2].role != "user":
+        return
+    move_number = routing.moves_made(log)
+    future = _executor.submit(
+        _draft, log, backend, company_profile, move_number,
+        len(log.turns) - 1, log.turns[-2].text, log.turns[-1].text,
+    )
+    with _lock:
+        futures = _pending.setdefault(log.session_id, [])
+        futures[:] = [item for item in futures if not item.done()] + [future]
+
+
+def prepare(log: utils.SessionLog, turn_type: str) -> DebriefPlan | None:
+    """
+    Collects the drafted notes for a debrief turn, waiting up to WAIT_S for
+    drafts that are still running.
+
+    Returns:
+        DebriefPlan | None: Notes and the extra instruction, or None when this is
+        not a debrief turn or nothing was drafted.
+    """
+    if turn_type != routing.DEBRIEF or not DRAFTS:
+        return None
+    with _lock:
+        futures = _pending.pop(log.session_id, [])
+    started = time.perf_counter()
+    if futures:
+        wait(futures, timeout=WAIT_S)
+    wait_s = time.perf_counter() - started
+    moves = routing.moves_made(log)
+    notes = sorted(
+        (note for note in log.debrief_notes if note.text and not note.error and note.move_number <= moves),
+        key=lambda note: note.move_number,
+    )
+    if not notes:
+        return None
+    drafted = {note.move_number for note in notes}
+    missing = [str(number) for number in range(1, moves + 1) if number not in drafted]
+    return DebriefPlan(
+        notes=notes,
+        moves=moves,
+        instruction=DEBRIEF_INSTRUCTION.format(
+            notes=render_notes(notes),
+            missing=MISSING_INSTRUCTION.format(moves=", ".join(missing)) if missing else "",
+        ),
+        wait_s=round(wait_s, 3),
+    )
+
+
+def render_notes(notes: List[utils.DebriefNote]) -> str:
+    return "\n\n".join(f"Move {note.move_number}\n{note.text}" for note in notes)
+
+
+def summary(plan: DebriefPlan | None) -> Dict[str, object]:
+    """Turn metadata describing how the debrief used the drafts."""
+    if plan is None:
+        return {}
+    return {"notes": len(plan.notes), "complete": plan.complete, "wait_s": plan.wait_s}
+
+
+def stitch(reply: str, plan: DebriefPlan | None) -> str:
+    """The final debrief: the model's reply followed by the drafted per-move notes."""
+    if plan is None:
+        return reply
+    return f"{reply.rstrip()}\n\nReasoning and improvements by move:\n\n{render_notes(plan.notes)}"
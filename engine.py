@@ -0,0 +1,586 @@
+import argparse
+import copy
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+import cancellation
+import forks
+import scheduler
+import utils
+"""
+Long-lived DASE engine daemon and its thin clients.
+
+The daemon keeps the backend modules and SDKs imported, the profile indexes,
+attack graphs and local model warm, and holds every active session: its
+SessionLog plus the conversation state each backend keeps (Gemini and local
+chat histories, the OpenAI DASEClient). The GUI and both CLIs talk to it with
+JSON lines over a Unix socket (localhost TCP on Windows), stream turns from
+it, and can attach to sessions started by any of them.
+
+Each request opens one connection and sends one line {"op": ..., ...}. The
+daemon answers with zero or more {"event": "update", "text": ...} lines while
+a turn streams, then one {"event": "result", "result": ...} or
+{"event": "error", "error": ...} line.
+
+Usage:
+    python engine.py serve              run the daemon in the foreground
+    python engine.py status             show whether it is running
+    python engine.py sessions           list active sessions
+    python engine.py new                start a session in the daemon and chat
+    python engine.py attach SESSION_ID  continue a session started anywhere
+    python engine.py fork SESSION_ID N  replay a session from its turn N
+    python engine.py end SESSION_ID     end a session and free what the daemon holds for it
+    python engine.py stop               shut the daemon down
+
+Clients start the daemon on demand. Configuration (environment variables):
+    DASE_ENGINE           run GUI and CLI sessions in the daemon (default 0)
+    DASE_ENGINE_ADDRESS   socket path, or host:port for TCP
+    DASE_ENGINE_LOG       daemon output when started on demand
+"""
+load_dotenv()
+
+ENGINE = os.getenv("DASE_ENGINE", "").strip().lower() in ("1", "true", "yes", "on")
+USE_TCP = os.name == "nt" or not hasattr(socket, "AF_UNIX")
+DEFAULT_ADDRESS = "127.0.0.1:47655" if USE_TCP else os.path.join(
+    tempfile.gettempdir(), f"dase-engine-{os.getuid()}.sock"
+)
+ADDRESS = os.getenv("DASE_ENGINE_ADDRESS") or DEFAULT_ADDRESS
+LOG_PATH = os.getenv("DASE_ENGINE_LOG") or os.path.join(tempfile.gettempdir(), "dase-engine.log")
+CONNECT_TIMEOUT_S = 2.0
+STARTUP_TIMEOUT_S = 60.0
+
+GEMINI = "gemini"
+OPENAI = "openai"
+LOCAL = "local"
+BACKENDS = (GEMINI, OPENAI, LOCAL)
+# Model labels used in session metadata and the GUI model list.
+LABELS = {GEMINI: "Google Gemini", OPENAI: "OpenAI ChatGPT", LOCAL: "Local model (CPU)"}
+
+
+class EngineError(RuntimeError):
+    """Raised by clients when the daemon reports an error or cannot be reached."""
+
+
+def _is_tcp(address: str) -> bool:
+    host, _, port = address.rpartition(":")
+    return USE_TCP or (bool(host) and port.isdigit() and os.sep not in address)
+
+
+def _split_tcp(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+# --- Daemon ---
+
+class EngineSession:
+    """One exercise held by the daemon."""
+
+    def __init__(self, backend: str, company_name: str, company_profile: str, difficulty: str, reactions: Any):
+        import local_llm
+        import openai_helper
+        from openai_cli import DASEClient
+
+        self.backend = backend
+        self.company_name = company_name
+        self.company_profile = company_profile
+        self.log = utils.SessionLog()
+        self.log.add_metadata("company_name", company_name)
+        self.log.add_metadata("difficulty", difficulty)
+        self.log.add_metadata("reactions", reactions)
+        self.log.add_metadata("model", LABELS[backend])
+        self.created = time.time()
+        self.history = forks.History()  # Gemini Contents or local chat messages
+        self.client = None
+        self.cancel: cancellation.CancelToken | None = None
+        self.lock = threading.Lock()  # one turn at a time
+        if backend == OPENAI:
+            self.client = DASEClient(
+                prompt_id=openai_helper.DEFAULT_PROMPT_ID,
+                difficulty=difficulty,
+                reactions=str(reactions),
+                company_profile=company_profile,
+                company_name=company_name,
+            )
+        elif backend == LOCAL:
+            threading.Thread(target=local_llm.prefill, args=(company_profile, self.log), daemon=True).start()
+
+    def fork(self, turn_index: int) -> "EngineSession":
+        """A session replaying this one from the defender action at `turn_index`, sharing the earlier turns."""
+        child = copy.copy(self)
+        child.log = self.log.fork(turn_index)
+        length = forks.history_length(self.log, turn_index)
+        child.history = self.history.fork(min(length, len(self.history)))
+        child.client = self.client.fork(length) if self.client else None
+        child.cancel = None
+        child.lock = threading.Lock()
+        child.created = time.time()
+        return child
+
+    @property
+    def session_id(self) -> str:
+        return self.log.session_id
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "backend": self.backend,
+            "company_name": self.company_name,
+            "difficulty": self.log.metadata.get("difficulty"),
+            "reactions": self.log.metadata.get("reactions"),
+            "turns": len(self.log.turns),
+            "parent_session_id": self.log.parent_session_id,
+            "busy": self.lock.locked(),
+            "created": self.created,
+        }
+
+    def generate(self, user_input: str, structured: bool | None, on_update, cancel) -> str:
+        import comparison
+        import gemini
+        import local_llm
+        import openai_helper
+
+        if self.backend == GEMINI:
+            # Gemini gets the session settings with the first answered turn, as in the GUI.
+            answered = any(turn.role == "model" and not turn.metadata.get("cancelled") for turn in self.log.turns)
+            prompt = user_input if answered else comparison.setup_prompt(
+                user_input, self.log.metadata.get("difficulty"), self.log.metadata.get("reactions"), self.company_name
+            )
+            text, _ = gemini.generate(prompt, self.company_profile, self.log, structured=structured,
+                                      on_update=on_update, cancel=cancel, history=self.history)
+        elif self.backend == OPENAI:
+            text, _ = openai_helper.generate(user_input, self.company_profile, self.log, structured=structured,
+                                             on_update=on_update, cancel=cancel, client=self.client)
+        else:
+            text, _ = local_llm.generate(user_input, self.company_profile, self.log, structured=structured,
+                                         on_update=on_update, cancel=cancel, history=self.history)
+        return text
+
+
+class Engine:
+    """Daemon state: warm modules and the active sessions."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.sessions: Dict[str, EngineSession] = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    def warm(self) -> None:
+        """Imports the backends and builds the profile indexes before the first client arrives."""
+        import gemini  # noqa: F401  (imports google-genai)
+        import local_llm
+        import openai_helper  # noqa: F401  (imports openai)
+        import retrieval
+
+        for profile in utils.PROFILES:
+            retrieval.index_for(json.dumps(profile, indent=2))
+        if local_llm.WARMUP:
+            threading.Thread(target=local_llm.warm_up, daemon=True).start()
+
+    def _session(self, session_id: str) -> EngineSession:
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Unknown session: {session_id}")
+        return session
+
+    def handle(self, request: Dict[str, Any], send: Callable[[Dict[str, Any]], None]) -> Any:
+        """Runs one request; `send` streams update events back to the caller."""
+        op = request.get("op")
+        if op == "ping":
+            return {"pid": os.getpid(), "uptime_s": round(time.time() - self.started, 3), "sessions": len(self.sessions),
+                    "scheduler": scheduler.metrics()}
+        if op == "start_session":
+            return self.start_session(**{key: request[key] for key in ("backend", "company", "difficulty", "reactions")})
+        if op == "sessions":
+            with self._lock:
+                return [session.summary() for session in self.sessions.values()]
+        if op == "get_session":
+            return self._session(request["session_id"]).log.model_dump()
+        if op == "turn":
+            return self.turn(request["session_id"], request["text"], request.get("structured"), send)
+        if op == "fork":
+            child = self._session(request["session_id"]).fork(request["turn_index"])
+            with self._lock:
+                self.sessions[child.session_id] = child
+            return child.summary()
+        if op == "cancel":
+            cancel = self._session(request["session_id"]).cancel
+            if cancel is not None:
+                cancel.cancel()
+            return {"cancelled": cancel is not None}
+        if op == "save_session":
+            return utils.save_session(self._session(request["session_id"]).log, request.get("directory") or "session_logs")
+        if op == "end_session":
+            with self._lock:
+                session = self.sessions.pop(request["session_id"], None)
+            if session is not None and session.cancel is not None:
+                session.cancel.cancel()
+            return {"ended": session is not None}
+        if op == "shutdown":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {"stopping": True}
+        raise ValueError(f"Unknown op: {op}")
+
+    def start_session(self, backend: str, company: str, difficulty: str, reactions: Any) -> Dict[str, Any]:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        path = utils.COMPANY_MAP.get(company)
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+        else:
+            profile = utils.get_company(company)
+            if profile is None:
+                raise ValueError(f"Unknown company: {company}")
+        session = EngineSession(backend, company, json.dumps(profile, indent=2), difficulty, reactions)
+        with self._lock:
+            self.sessions[session.session_id] = session
+        return session.summary()
+
+    def turn(self, session_id: str, text: str, structured: bool | None, send) -> Dict[str, Any]:
+        session = self._session(session_id)
+        if not session.lock.acquire(blocking=False):
+            raise RuntimeError("The session is already generating a turn.")
+        try:
+            session.cancel = cancellation.CancelToken()
+            cancelled = False
+            try:
+                reply = session.generate(text, structured, lambda partial: send({"event": "update", "text": partial}),
+                                         session.cancel)
+            except cancellation.GenerationCancelled as e:
+                reply, cancelled = e.partial_text, True
+            return {"text": reply, "cancelled": cancelled, "log": session.log.model_dump()}
+        finally:
+            session.cancel = None
+            session.lock.release()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _send(self, event: Dict[str, Any]) -> None:
+        try:
+            self.wfile.write((json.dumps(event, default=str) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except OSError:
+            # The client went away; the turn still completes in the session.
+            pass
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            result = self.server.engine.handle(request, self._send)
+            self._send({"event": "result", "result": result})
+        except Exception as e:
+            self._send({"event": "error", "error": f"{type(e).__name__}: {e}"})
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address: str = ADDRESS) -> None:
+    """Runs the daemon in the foreground until a shutdown request or Ctrl+C."""
+    if EngineClient(address).running():
+        print(f"DASE engine already running at {address}")
+        return
+    engine = Engine()
+    if _is_tcp(address):
+        # Localhost only: the daemon holds API keys and session data.
+        server = _TCPServer(_split_tcp(address), _Handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)  # stale socket from a daemon that did not exit cleanly
+        server = _UnixServer(address, _Handler)
+        os.chmod(address, 0o600)
+    server.engine = engine
+    engine.server = server
+    engine.warm()
+    print(f"DASE engine listening on {address} (pid {os.getpid()})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not _is_tcp(address) and os.path.exists(address):
+            os.unlink(address)
+
+
+# --- Clients ---
+
+class EngineClient:
+    """Connection settings for the daemon; every call is one short-lived connection."""
+
+    def __init__(self, address: str = ADDRESS, autostart: bool = False):
+        self.address = address
+        self.autostart = autostart
+
+    def _connect(self) -> socket.socket:
+        if _is_tcp(self.address):
+            sock = socket.create_connection(_split_tcp(self.address), timeout=CONNECT_TIMEOUT_S)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(CONNECT_TIMEOUT_S)
+            sock.connect(self.address)
+        sock.settimeout(None)  # turns stream for as long as the model takes
+        return sock
+
+    def running(self) -> bool:
+        try:
+            self._connect().close()
+            return True
+        except OSError:
+            return False
+
+    def ensure_running(self) -> None:
+        """Starts the daemon in the background when it is not running, and waits until it answers."""
+        if self.running():
+            return
+        if not self.autostart:
+            raise EngineError(f"The DASE engine is not running at {self.address}. Start it with: python engine.py serve")
+        with open(LOG_PATH, "a", encoding="utf-8") as log_file:
+            options = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS} \
+                if os.name == "nt" else {"start_new_session": True}
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--address", self.address, "serve"],
+                stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                cwd=os.path.dirname(os.path.abspath(__file__)), **options,
+            )
+        deadline = time.monotonic() + STARTUP_TIMEOUT_S
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            if self.running():
+                return
+            if process.poll() is not None:
+                break
+        raise EngineError(f"The DASE engine did not start; see {LOG_PATH}")
+
+    def request(self, op: str, on_update: Callable[[str], None] | None = None, **params) -> Any:
+        """
+        Sends one request and returns its result.
+
+        Args:
+            op (str): Operation name (ping, start_session, sessions, get_session, turn, cancel, ...).
+            on_update (Callable[[str], None] | None): Called with the reply so far while a turn streams.
+
+        Raises:
+            EngineError: When the daemon is unreachable or reports an error.
+        """
+        self.ensure_running()
+        try:
+            with self._connect() as sock, sock.makefile("rwb") as stream:
+                stream.write((json.dumps({"op": op, **params}) + "\n").encode("utf-8"))
+                stream.flush()
+                for line in stream:
+                    event = json.loads(line)
+                    if event["event"] == "update":
+                        if on_update:
+                            on_update(event["text"])
+                    elif event["event"] == "result":
+                        return event["result"]
+                    else:
+                        raise EngineError(event.get("error", "Unknown engine error"))
+        except OSError as e:
+            raise EngineError(f"Lost connection to the DASE engine: {e}") from e
+        raise EngineError("The DASE engine closed the connection without a result.")
+
+    def start_session(self, backend: str, company: str, difficulty: str, reactions: Any) -> str:
+        return self.request("start_session", backend=backend, company=company, difficulty=difficulty,
+                            reactions=reactions)["session_id"]
+
+    def sessions(self) -> List[Dict[str, Any]]:
+        return self.request("sessions")
+
+    def scheduler_metrics(self) -> Dict[str, Any]:
+        """Metrics of the daemon's request scheduler, which all of its sessions share."""
+        return self.request("ping")["scheduler"]
+
+    def session(self, session_id: str) -> utils.SessionLog:
+        return utils.SessionLog.model_validate(self.request("get_session", session_id=session_id))
+
+    def cancel(self, session_id: str) -> None:
+        self.request("cancel", session_id=session_id)
+
+    def end_session(self, session_id: str) -> bool:
+        """Cancels a session's running turn and drops the session from the daemon."""
+        return self.request("end_session", session_id=session_id)["ended"]
+
+    def fork(self, session_id: str, turn_index: int) -> str:
+        """Forks a session before the defender action at `turn_index`; returns the fork's id."""
+        return self.request("fork", session_id=session_id, turn_index=turn_index)["session_id"]
+
+
+class RemoteSession:
+    """
+    A daemon session with the same generate() interface as the backend modules,
+    so the GUI and CLIs can use it in their place.
+    """
+
+    def __init__(self, client: EngineClient, session_id: str):
+        self.client = client
+        self.session_id = session_id
+
+    def generate(self, user_input: str, company_profile: str, log: utils.SessionLog, structured: bool | None = None,
+                 on_update=None, cancel=None, **kwargs) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Runs a turn in the daemon and mirrors the daemon's session into `log`.
+
+        Raises:
+            GenerationCancelled: When `cancel` fired (or another client cancelled the turn).
+        """
+        if cancel:
+            # The turn runs in the daemon, so a cancel is a request of its own.
+            cancel.on_cancel(lambda: threading.Thread(target=self.client.cancel, args=(self.session_id,), daemon=True).start())
+        result = self.client.request("turn", on_update=on_update, session_id=self.session_id,
+                                     text=user_input, structured=structured)
+        mirror(log, result["log"])
+        if result["cancelled"]:
+            raise cancellation.GenerationCancelled(result["text"])
+        return result["text"], []
+
+
+def mirror(log: utils.SessionLog, data: Dict[str, Any]) -> None:
+    """Copies a daemon session into a local SessionLog in place, so existing references stay valid."""
+    remote = utils.SessionLog.model_validate(data)
+    for field in utils.SessionLog.model_fields:
+        setattr(log, field, getattr(remote, field))
+
+
+def start_remote(backend: str, company: str, difficulty: str, reactions: Any) -> Tuple[RemoteSession, utils.SessionLog]:
+    """Starts a session in the daemon (starting the daemon if needed)."""
+    client = EngineClient(autostart=True)
+    session_id = client.start_session(backend, company, difficulty, reactions)
+    return RemoteSession(client, session_id), client.session(session_id)
+
+
+def attach(session_id: str, client: EngineClient | None = None) -> Tuple[RemoteSession, utils.SessionLog]:
+    """Attaches to a running daemon session; a unique prefix of the id is enough."""
+    client = client or EngineClient()
+    matches = [item["session_id"] for item in client.sessions() if item["session_id"].startswith(session_id)]
+    if len(matches) != 1:
+        raise EngineError(f"No unique engine session matches '{session_id}'.")
+    return RemoteSession(client, matches[0]), client.session(matches[0])
+
+
+def print_transcript(log: utils.SessionLog) -> None:
+    for index, turn in enumerate(log.turns):
+        speaker = f"[{index}] User" if turn.role == "user" else "DASE"
+        print(f"{speaker}: {turn.text}\n")
+
+
+def add_cli_arguments(parser) -> None:
+    """Adds --engine/--attach to a backend CLI's argparse parser."""
+    parser.add_argument("--engine", action="store_true", default=ENGINE,
+                        help="Run the session in the DASE engine daemon (started on demand).")
+    parser.add_argument("--attach", metavar="SESSION_ID", help="Continue a session running in the DASE engine.")
+
+
+def chat(remote: RemoteSession, log: utils.SessionLog) -> None:
+    """Thin interactive loop for a daemon session."""
+    print(f"Session {remote.session_id} ({log.metadata.get('model')}, {log.metadata.get('company_name')}). "
+          "Type 'exit' to leave it running, 'end' to end it, 'save' to save it.")
+    while True:
+        try:
+            user_input = input("User: ").strip()
+        except (KeyboardInterrupt, EOFError):
+            print()
+            return
+        if user_input.lower() in ("exit", "quit", "q"):
+            return
+        if user_input.lower() == "end":
+            remote.client.end_session(remote.session_id)
+            print("Session ended.")
+            return
+        if user_input.lower() == "save":
+            print(f"Session saved to {remote.client.request('save_session', session_id=remote.session_id)}")
+            continue
+        if not user_input:
+            continue
+        try:
+            with utils.loading_indicator("Generating response (Ctrl+C to cancel)"):
+                reply, _ = cancellation.run_interruptible(remote.generate, user_input, "", log)
+            print(f"\nDASE:\n{reply}\n")
+        except cancellation.GenerationCancelled:
+            print("\n[Response cancelled. Enter a new action.]\n")
+        except EngineError as e:
+            print(f"\nEngine error: {e}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="DASE engine daemon and thin client.")
+    parser.add_argument("--address", default=ADDRESS, help="Socket path, or host:port for TCP.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="Run the daemon in the foreground.")
+    commands.add_parser("status", help="Show whether the daemon is running.")
+    commands.add_parser("sessions", help="List active sessions.")
+    commands.add_parser("stop", help="Shut the daemon down.")
+    commands.add_parser("new", help="Start a session in the daemon and chat.")
+    attach_parser = commands.add_parser("attach", help="Continue a daemon session.")
+    attach_parser.add_argument("session_id")
+    fork_parser = commands.add_parser("fork", help="Replay a daemon session from one of its defender actions.")
+    fork_parser.add_argument("session_id")
+    fork_parser.add_argument("turn_index", type=int, help="Index of the user turn to replay (see the transcript).")
+    end_parser = commands.add_parser("end", help="End a daemon session and free its state.")
+    end_parser.add_argument("session_id")
+    args = parser.parse_args()
+
+    client = EngineClient(args.address)
+    try:
+        if args.command == "serve":
+            serve(args.address)
+        elif args.command == "status":
+            print(json.dumps(client.request("ping"), indent=2) if client.running() else "DASE engine is not running.")
+        elif args.command == "sessions":
+            utils.pretty_print(client.request("sessions"))
+        elif args.command == "stop":
+            print("DASE engine stopping." if client.running() and client.request("shutdown") else "DASE engine is not running.")
+        elif args.command == "new":
+            backend = input(f"Backend ({', '.join(BACKENDS)}): ").strip().lower() or GEMINI
+            difficulty = input("Select difficulty (low, medium, high): ").strip().lower()
+            reactions = input("Select number of reactions (1, 2, 3): ").strip()
+            company_profile, _ = utils.select_company_from_cli()
+            if not company_profile:
+                return
+            client.autostart = True
+            session_id = client.start_session(backend, company_profile["company_name"], difficulty, reactions)
+            chat(RemoteSession(client, session_id), client.session(session_id))
+        elif args.command == "end":
+            remote, _ = attach(args.session_id, client)
+            client.end_session(remote.session_id)
+            print(f"Session {remote.session_id} ended.")
+        elif args.command == "fork":
+            remote, _ = attach(args.session_id, client)
+            session_id = client.fork(remote.session_id, args.turn_index)
+            remote, log = attach(session_id, client)
+            print_transcript(log)
+            chat(remote, log)
+        else:
+            remote, log = attach(args.session_id, client)
+            print_transcript(log)
+            chat(remote, log)
+    except EngineError as e:
+        print(e)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+import argparse
+import csv
+import glob
+import hashlib
+import html
+import json
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List
+
+from markdown_it import MarkdownIt
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional; CSV is always available.
+    pa = pq = None
+"""
+Bulk export of DASE session logs.
+
+Streams any number of Session_log(...).json files through a process pool into
+per-session Markdown/HTML after-action reports and one columnar dataset of
+turns (Parquet when pyarrow is installed, CSV otherwise). Exports are
+incremental: a manifest of content hashes and written reports lets unchanged
+logs be skipped when all requested outputs are still there, outputs of logs
+that were deleted are removed, and raw model chunks are stripped before
+parsing unless explicitly requested.
+
+Usage:
+    python export.py "session_logs/*.json" --out exports --formats md,html --dataset parquet
+"""
+DEFAULT_OUT_DIR = "exports"
+MANIFEST_NAME = "manifest.json"
+ROWS_DIR = ".rows"
+HASH_BLOCK_SIZE = 1 << 20
+
+DATASET_COLUMNS = [
+    "session_file", "session_id", "turn_index", "role", "text", "chars",
+    "company_name", "difficulty", "reactions", "model",
+    "turn_type", "routed_model", "latency_s", "thinking_budget", "reasoning_effort",
+    "move_number", "attack_technique", "target_asset", "cancelled", "raw_chunks",
+]
+
+# Tokens needed to skip over a JSON value: strings (with escapes) and brackets.
+_JSON_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|[\[\]{}]')
+_RAW_CHUNKS_KEY = re.compile(r'"raw_chunks"\s*:\s*')
+
+
+def file_sha256(path: str) -> str:
+    """Hashes a file in blocks so large logs are never held in memory twice."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def strip_raw_chunks(text: str) -> str:
+    """
+    Replaces every "raw_chunks" value in a session log with an empty list.
+
+    This runs on the raw JSON text so the (often very large) chunk payloads are
+    never turned into Python objects.
+    """
+    out, pos = [], 0
+    for key in _RAW_CHUNKS_KEY.finditer(text):
+        if key.start() < pos:
+            continue
+        start = key.end()
+        if start >= len(text) or text[start] != "[":
+            continue
+        depth, end = 0, None
+        for token in _JSON_TOKEN.finditer(text, start):
+            value = token.group()
+            if value in "[{":
+                depth += 1
+            elif value in "]}":
+                depth -= 1
+                if depth == 0:
+                    end = token.end()
+                    break
+        if end is None:
+            break
+        out.append(text[pos:start])
+        out.append("[]")
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def read_session(path: str, include_raw: bool = False) -> Dict[str, Any]:
+    """Reads a session log as plain data, without raw chunks unless requested."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if not include_raw:
+        text = strip_raw_chunks(text)
+    return json.loads(text)
+
+
+def session_rows(path: str, session: Dict[str, Any], include_raw: bool = False) -> List[Dict[str, Any]]:
+    """Flattens a session into one dataset row per turn."""
+    metadata = session.get("metadata", {})
+    session_moves = session.get("moves", [])
+    session_id = session.get("session_id") or os.path.splitext(os.path.basename(path))[0]
+    rows = []
+    for index, turn in enumerate(session.get("turns", [])):
+        turn_meta = turn.get("metadata", {})
+        routing_info = turn_meta.get("routing", {})
+        budget_info = turn_meta.get("budget", {})
+        move = {}
+        if isinstance(turn_meta.get("move_index"), int) and turn_meta["move_index"] < len(session_moves):
+            move = session_moves[turn_meta["move_index"]]
+        text = turn.get("text", "")
+        rows.append({
+            "session_file": os.path.basename(path),
+            "session_id": session_id,
+            "turn_index": index,
+            "role": turn.get("role"),
+            "text": text,
+            "chars": len(text),
+            "company_name": metadata.get("company_name"),
+            "difficulty": metadata.get("difficulty"),
+            "reactions": str(metadata.get("reactions", "")),
+            "model": metadata.get("model"),
+            "turn_type": routing_info.get("turn_type"),
+            "routed_model": routing_info.get("model"),
+            "latency_s": turn_meta.get("latency_s"),
+            "thinking_budget": budget_info.get("thinking_budget"),
+            "reasoning_effort": budget_info.get("reasoning_effort"),
+            "move_number": move.get("move_number"),
+            "attack_technique": move.get("attack_technique"),
+            "target_asset": move.get("target_asset"),
+            "cancelled": bool(turn_meta.get("cancelled", False)),
+            "raw_chunks": json.dumps(turn.get("raw_chunks", [])) if include_raw else None,
+        })
+    return rows
+
+
+def render_markdown(path: str, session: Dict[str, Any]) -> str:
+    """Renders an after-action report for one session as Markdown."""
+    metadata = session.get("metadata", {})
+    company = metadata.get("company_name", "Unknown company")
+    lines = [f"# DASE After-Action Report: {company}", ""]
+    lines.append(f"Source log: `{os.path.basename(path)}`")
+    lines.append("")
+    lines += ["| Setting | Value |", "| --- | --- |"]
+    for key, value in metadata.items():
+        lines.append(f"| {key} | {str(value).replace('|', '/')} |")
+    lines.append("")
+
+    session_moves = session.get("moves", [])
+    if session_moves:
+        lines += ["## Adversary Moves", "", "| # | Technique | Target | Reactions left |", "| --- | --- | --- | --- |"]
+        for move in session_moves:
+            lines.append(
+                f"| {move.get('move_number')} | {move.get('attack_technique')} | "
+                f"{move.get('target_asset')} | {move.get('reactions_remaining')} |"
+            )
+        lines.append("")
+
+    lines += ["## Transcript", ""]
+    for turn in session.get("turns", []):
+        speaker = "Trainee" if turn.get("role") == "user" else "DASE"
+        turn_meta = turn.get("metadata", {})
+        details = []
+        if turn_meta.get("routing"):
+            details.append(f"{turn_meta['routing'].get('turn_type')} via {turn_meta['routing'].get('model')}")
+        if turn_meta.get("latency_s") is not None:
+            details.append(f"{turn_meta['latency_s']:.1f} s")
+        if turn_meta.get("cancelled"):
+            details.append("cancelled")
+        heading = f"### {speaker}" + (f" ({', '.join(details)})" if details else "")
+        lines += [heading, "", turn.get("text", ""), ""]
+    return "\n".join(lines)
+
+
+def render_html(markdown_text: str, title: str) -> str:
+    """Wraps a Markdown report as a standalone HTML page."""
+    body = MarkdownIt("commonmark", {"html": False}).enable("table").render(markdown_text)
+    return (
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>{html.escape(title)}</title>\n"
+        "<style>body{font-family:sans-serif;max-width:60em;margin:auto;}"
+        "table{border-collapse:collapse;}td,th{border:1px solid #ccc;padding:4px 8px;}</style>\n"
+        f"</head>\n<body>\n{body}</body>\n</html>\n"
+    )
+
+
+def path_key(path: str) -> str:
+    """Short stable key of a log's absolute path, for outputs that belong to that path."""
+    return hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+
+
+def report_paths(path: str, out_dir: str, formats: List[str]) -> Dict[str, str]:
+    """
+    Report file per requested format for a session log. Names carry the path
+    key, so logs with the same file name in different directories do not collide.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return {
+        fmt: os.path.join(out_dir, "reports", f"{stem}-{path_key(path)}.{fmt}")
+        for fmt in formats if fmt in ("md", "html")
+    }
+
+
+def export_one(path: str, out_dir: str, formats: List[str], include_raw: bool, previous: Dict[str, Any] | None) -> Dict[str, Any]:
+    """
+    Exports a single session log. Runs inside a worker process.
+
+    The log is skipped only when its hash matches the manifest entry and its
+    rows file and every requested report were written for that hash and still exist.
+
+    Returns:
+        dict: The source path, its hash, the rows file, the reports and whether it was skipped.
+    """
+    sha = file_sha256(path)
+    # Rows carry the log's file name, so identical copies at other paths get their own file.
+    rows_path = os.path.join(out_dir, ROWS_DIR, f"{path_key(path)}-{sha}.jsonl")
+    reports = report_paths(path, out_dir, formats)
+    previous = previous or {}
+    if (
+        sha == previous.get("sha256")
+        and os.path.exists(rows_path)
+        and all(previous.get("reports", {}).get(fmt) == report and os.path.exists(report) for fmt, report in reports.items())
+    ):
+        return {"path": path, "sha256": sha, "rows": rows_path, "reports": previous["reports"], "skipped": True}
+
+    session = read_session(path, include_raw)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    os.makedirs(os.path.join(out_dir, "reports"), exist_ok=True)
+    markdown_text = render_markdown(path, session)
+    if "md" in reports:
+        with open(reports["md"], "w", encoding="utf-8") as f:
+            f.write(markdown_text)
+    if "html" in reports:
+        with open(reports["html"], "w", encoding="utf-8") as f:
+            f.write(render_html(markdown_text, stem))
+    for fmt, report in previous.get("reports", {}).items():
+        if fmt in reports and report != reports[fmt]:
+            _remove(report)  # written under an earlier naming scheme
+    if sha == previous.get("sha256"):
+        # Reports of other formats written earlier for this hash are still current.
+        reports = {**{fmt: report for fmt, report in previous.get("reports", {}).items() if os.path.exists(report)}, **reports}
+
+    os.makedirs(os.path.dirname(rows_path), exist_ok=True)
+    with open(rows_path, "w", encoding="utf-8") as f:
+        for row in session_rows(path, session, include_raw):
+            f.write(json.dumps(row) + "\n")
+    return {"path": path, "sha256": sha, "rows": rows_path, "reports": reports, "skipped": False}
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_outputs(files: Dict[str, Dict[str, Any]], out_dir: str) -> int:
+    """
+    Drops manifest entries of logs that no longer exist, with their reports,
+    and deletes rows files no remaining entry refers to.
+
+    Returns:
+        int: Number of log entries removed.
+    """
+    gone = [path for path in files if not os.path.exists(path)]
+    for path in gone:
+        for report in files.pop(path).get("reports", {}).values():
+            _remove(report)
+    referenced = {os.path.abspath(entry["rows"]) for entry in files.values() if entry.get("rows")}
+    rows_dir = os.path.join(out_dir, ROWS_DIR)
+    for rows_path in glob.glob(os.path.join(rows_dir, "*.jsonl")):
+        if os.path.abspath(rows_path) not in referenced:
+            _remove(rows_path)
+    return len(gone)
+
+
+def iter_paths(patterns: Iterable[str]) -> Iterator[str]:
+    """Lazily expands paths and glob patterns into unique session log paths."""
+    seen = set()
+    for pattern in patterns:
+        for path in glob.iglob(pattern):
+            path = os.path.abspath(path)
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                yield path
+
+
+def _iter_rows(rows_paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for rows_path in rows_paths:
+        with open(rows_path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def write_dataset(rows_paths: List[str], out_dir: str, dataset_format: str, batch_size: int = 5000) -> str:
+    """
+    Combines per-session row files into one dataset, streaming in batches.
+
+    Returns:
+        str: Path of the written dataset.
+    """
+    if dataset_format == "parquet" and pq is None:
+        print("pyarrow is not installed; writing the dataset as CSV instead.")
+        dataset_format = "csv"
+
+    if dataset_format == "parquet":
+        path = os.path.join(out_dir, "turns.parquet")
+        schema = pa.schema([
+            (name, pa.int64() if name in ("turn_index", "chars", "thinking_budget", "move_number")
+             else pa.float64() if name == "latency_s"
+             else pa.bool_() if name == "cancelled"
+             else pa.string())
+            for name in DATASET_COLUMNS
+        ])
+        with pq.ParquetWriter(path, schema) as writer:
+            batch = []
+            for row in _iter_rows(rows_paths):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        return path
+
+    path = os.path.join(out_dir, "turns.csv")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=DATASET_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for row in _iter_rows(rows_paths):
+            writer.writerow(row)
+    return path
+
+
+def export_sessions(
+    patterns: Iterable[str],
+    out_dir: str = DEFAULT_OUT_DIR,
+    formats: List[str] | None = None,
+    dataset_format: str = "parquet",
+    workers: int | None = None,
+    include_raw: bool = False,
+) -> Dict[str, Any]:
+    """
+    Exports every matching session log and rebuilds the turns dataset.
+
+    Args:
+        patterns (Iterable[str]): Paths or glob patterns of session logs.
+        out_dir (str): Output directory for reports, dataset and manifest.
+        formats (list[str] | None): Report formats, any of "md" and "html".
+        dataset_format (str): "parquet" or "csv".
+        workers (int | None): Process pool size; defaults to the CPU count.
+        include_raw (bool): Load raw chunks and include them in the dataset.
+
+    Returns:
+        dict: Counts of exported, skipped and removed logs and the dataset path.
+    """
+    formats = formats if formats is not None else ["md", "html"]
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    # Raw chunks change the rows, so an include_raw run never reuses plain rows.
+    if manifest.get("include_raw") != include_raw:
+        manifest = {"include_raw": include_raw, "files": {}}
+    files = manifest.setdefault("files", {})
+
+    results = []
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for path in iter_paths(patterns):
+            pending.add(pool.submit(
+                export_one, path, out_dir, formats, include_raw, files.get(path),
+            ))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+        results.extend(future.result() for future in pending)
+
+    for result in results:
+        files[result["path"]] = {"sha256": result["sha256"], "rows": result["rows"], "reports": result["reports"]}
+    removed = prune_outputs(files, out_dir)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    rows_paths = [result["rows"] for result in sorted(results, key=lambda r: r["path"])]
+    dataset_path = write_dataset(rows_paths, out_dir, dataset_format)
+    return {
+        "exported": sum(1 for r in results if not r["skipped"]),
+        "skipped": sum(1 for r in results if r["skipped"]),
+        "removed": removed,
+        "dataset": os.path.abspath(dataset_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export DASE session logs to reports and a turns dataset.")
+    parser.add_argument("patterns", nargs="*", default=[os.path.join("session_logs", "*.json")],
+                        help="Session log paths or glob patterns.")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="Output directory.")
+    parser.add_argument("--formats", default="md,html", help="Comma-separated report formats (md, html) or 'none'.")
+    parser.add_argument("--dataset", choices=("parquet", "csv"), default="parquet", help="Dataset format.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--include-raw", action="store_true", help="Load raw model chunks into the dataset.")
+    args = parser.parse_args()
+
+    formats = [] if args.formats == "none" else [f.strip() for f in args.formats.split(",") if f.strip()]
+    summary = export_sessions(args.patterns, args.out, formats, args.dataset, args.workers, args.include_raw)
+    print(f"Exported {summary['exported']} log(s), skipped {summary['skipped']} unchanged, "
+          f"removed outputs of {summary['removed']} deleted log(s).")
+    print(f"Turns dataset written to {summary['dataset']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+from typing import Any, Dict, Iterable, Iterator, List
+
+from dotenv import load_dotenv
+
+import utils
+"""
+Checkpoint and fork support for DASE sessions.
+
+Facilitators replay an exercise from turn k with a different defender action
+to show how the adversary would have adapted. A fork shares everything before
+turn k with its parent instead of re-sending those turns:
+
+- History is a persistent (copy-on-write) conversation: each entry is a node
+  pointing at the one before it, so forking at any length is O(k) pointer
+  walking with no copies, and parent and fork append independently.
+- SessionLog.fork shares the earlier Turn records and records the fork tree
+  (parent_session_id/fork_turn on the fork, forks on the parent).
+- Provider-side state for the shared prefix is reused. An OpenAI fork chains
+  on previous_response_id from the stored response at the fork point. A
+  forked Gemini history gets an explicit context cache holding the static
+  prompt, the turn's tools and the shared turns (stored on the prefix node, so
+  sibling forks share it, and recreated before its TTL runs out). Local forks
+  send a byte-identical prefix, which the server's prompt cache reuses.
+
+Branching from turn k therefore costs one model call, not k.
+
+Configuration (environment variables):
+    DASE_FORK_CACHE             Gemini context cache for forked prefixes (default 1)
+    DASE_FORK_CACHE_TTL_S       lifetime of those caches (default 3600)
+    DASE_FORK_CACHE_MIN_TOKENS  smallest prefix worth caching (default 1024, the Flash minimum)
+"""
+load_dotenv()
+
+CONTEXT_CACHE = os.getenv("DASE_FORK_CACHE", "1").strip().lower() in ("1", "true", "yes", "on")
+CACHE_TTL_S = int(os.getenv("DASE_FORK_CACHE_TTL_S", "3600"))
+CACHE_MIN_TOKENS = int(os.getenv("DASE_FORK_CACHE_MIN_TOKENS", "1024"))
+# Caches are recreated this long before they expire, so no turn (lookup
+# rounds included) runs on a cache that disappears under it.
+CACHE_RENEW_MARGIN_S = min(300, CACHE_TTL_S // 2)
+
+
+class _Node:
+    __slots__ = ("item", "parent", "length", "state")
+
+    def __init__(self, item: Any, parent: "_Node | None"):
+        self.item = item
+        self.parent = parent
+        self.length = parent.length + 1 if parent else 1
+        self.state: Dict[str, Any] = {}  # provider state for the prefix ending here
+
+
+class History:
+    """
+    A conversation history with list-like access whose forks share entries.
+
+    Entries are treated as immutable: replacing one (history[-1] = ...) rebuilds
+    only the nodes after it, never the shared ones.
+    """
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self._head: _Node | None = None
+        self.fork_point: _Node | None = None  # last shared node when this history is a fork
+        for item in items:
+            self.append(item)
+
+    def _node(self, length: int) -> _Node | None:
+        node = self._head
+        while node is not None and node.length > length:
+            node = node.parent
+        return node
+
+    def append(self, item: Any) -> None:
+        self._head = _Node(item, self._head)
+
+    def extend(self, items: Iterable[Any]) -> None:
+        for item in items:
+            self.append(item)
+
+    def pop(self) -> Any:
+        if self._head is None:
+            raise IndexError("pop from empty history")
+        item = self._head.item
+        self._head = self._head.parent
+        if self.fork_point is not None and self.fork_point.length > len(self):
+            self.fork_point = self._head
+        return item
+
+    def clear(self) -> None:
+        self._head = None
+        self.fork_point = None
+
+    def fork(self, length: int | None = None) -> "History":
+        """
+        Returns a history sharing the first `length` entries (all by default).
+
+        Raises:
+            ValueError: When `length` is longer than the history.
+        """
+        length = len(self) if length is None else length
+        if not 0 <= length <= len(self):
+            raise ValueError(f"Cannot fork a history of {len(self)} entries at {length}.")
+        child = History()
+        child._head = child.fork_point = self._node(length)
+        return child
+
+    def __len__(self) -> int:
+        return self._head.length if self._head else 0
+
+    def __bool__(self) -> bool:
+        return self._head is not None
+
+    def __iter__(self) -> Iterator[Any]:
+        items: List[Any] = []
+        node = self._head
+        while node is not None:
+            items.append(node.item)
+            node = node.parent
+        return reversed(items)
+
+    def _index(self, index: int) -> int:
+        length = len(self)
+        position = index + length if index < 0 else index
+        if not 0 <= position < length:
+            raise IndexError("history index out of range")
+        return position
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self._node(self._index(index) + 1).item
+
+    def __setitem__(self, index: int, item: Any) -> None:
+        position = self._index(index)
+        tail = list(self)[position + 1:]
+        self._head = _Node(item, self._node(position))
+        if self.fork_point is not None and self.fork_point.length > position:
+            self.fork_point = self._head.parent
+        self.extend(tail)
+
+    def __repr__(self) -> str:
+        return f"History({list(self)!r})"
+
+
+def history_length(log: utils.SessionLog, turn_index: int) -> int:
+    """
+    Number of backend history entries covering the log's turns before `turn_index`.
+
+    Backends keep one user and one model entry per answered turn; cancelled
+    turns are logged but rolled back from the history.
+    """
+    answered = sum(
+        1 for turn in log.turns[:turn_index] if turn.role == "model" and not turn.metadata.get("cancelled")
+    )
+    return 2 * answered
+
+
+def fork(log: utils.SessionLog, history: History, turn_index: int):
+    """
+    Forks a Gemini or local session before the defender action at `turn_index`.
+
+    Returns:
+        tuple[SessionLog, History]: The fork's log and conversation history.
+    """
+    child = log.fork(turn_index)
+    return child, history.fork(history_length(log, turn_index))
@@ -1,12 +1,28 @@
+import argparse
 import utils, os
+import time
+import budget
+import cancellation
+import cassette
+import debrief
+import engine
+import forks
+import grounding
+import moves
+import perf
+import providers
+import retrieval
+import routing
+import scheduler
 import json
-from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 """
 DASE Client for interacting with OpenAI's API using a predefined prompt. 
 """
-conversation_history = []
+PROMPT_PATH = os.path.join(utils.DATA_DIR, "text", "prompt.txt")
+
+conversation_history = forks.History()
 session_log = utils.SessionLog()
 load_dotenv()
 
@@ -16,64 +32,322 @@ def _sanitize_chunk(chunk_dict):
         return {}
     allowed_keys = {"candidates", "text"}
     sanitized = {key: chunk_dict[key] for key in allowed_keys if key in chunk_dict}
+    # Grounding payloads (sources, supports, search widgets) are large and are
+    # summarised in the turn metadata instead.
+    if isinstance(sanitized.get("candidates"), list):
+        sanitized["candidates"] = [
+            {k: v for k, v in candidate.items() if k != "grounding_metadata"}
+            for candidate in sanitized["candidates"]
+            if isinstance(candidate, dict)
+        ]
     return sanitized
 
-def generate(user_input, company_profile, log: utils.SessionLog):
+def _contents_text(contents):
+    """Text of every part in a list of Contents, for token estimates."""
+    return [part.text for content in contents for part in content.parts or [] if part.text]
+
+def _usage(usage_metadata):
+    """Token counts from a chunk's usage metadata, named like the OpenAI usage fields."""
+    counts = {
+        "input_tokens": usage_metadata.prompt_token_count,
+        "output_tokens": usage_metadata.candidates_token_count,
+        "reasoning_tokens": usage_metadata.thoughts_token_count,
+    }
+    return {key: value for key, value in counts.items() if value}
+
+def _stream_with_backoff(client, model, contents, config, cancel=None):
+    """
+    Streams a response, backing off the shared scheduler on rate-limit errors.
+    Cancelling `cancel` closes the stream; the shared client stays open.
+    """
+    try:
+        with providers.closing_streams(cancel):
+            yield from client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=config,
+            )
+    except Exception as e:
+        if scheduler.is_rate_limit_error(e):
+            scheduler.penalize("gemini", model)
+        raise
+
+def _fork_cache(client, model, history, system_prompt, tools, session_id=""):
+    """
+    Name of the context cache holding a forked history's shared prefix and the
+    turn's tools, creating it on first use and again shortly before it expires.
+    Returns None when the history is not a fork, the prefix is too small to
+    cache, or caching failed (forks then send the full request).
+    """
+    node = getattr(history, "fork_point", None)
+    if not forks.CONTEXT_CACHE or node is None:
+        return None
+    # Requests on a cache cannot add tools, so each tool set gets its own cache.
+    key = (model, tuple(tool.model_dump_json(exclude_none=True) for tool in tools))
+    entry = node.state.get(key)  # (cache name or None, expiry as a time.time() value)
+    if entry is None or time.time() >= entry[1] - forks.CACHE_RENEW_MARGIN_S:
+        prefix = list(history)[:node.length]
+        name = None
+        prefix_tokens = scheduler.estimate_tokens(system_prompt, *_contents_text(prefix))
+        if prefix_tokens >= forks.CACHE_MIN_TOKENS:
+            # Creating the cache bills the whole prefix, so it is scheduled like a request.
+            scheduler.acquire("gemini", model, prefix_tokens, session_id)
+            try:
+                cache = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=system_prompt,
+                        contents=prefix,
+                        tools=tools or None,
+                        ttl=f"{forks.CACHE_TTL_S}s",
+                    ),
+                )
+                name = cache.name
+            except Exception as e:
+                if scheduler.is_rate_limit_error(e):
+                    scheduler.penalize("gemini", model)
+                print(f"Gemini context cache for the forked prefix failed: {e}")
+        entry = node.state[key] = (name, time.time() + forks.CACHE_TTL_S)
+    return entry[0]
 
-    conversation_history.append(types.Content(
+def generate(user_input, company_profile, log: utils.SessionLog, grounding_mode=None, structured=None, on_update=None, cancel=None, history=None):
+    """
+    Send one turn to Gemini and record it in the session log.
+
+    Args:
+        user_input (str): The trainee's message.
+        company_profile (str): The company profile as a JSON string.
+        log (SessionLog): Session log receiving the turns.
+        grounding_mode (str | None): Overrides grounding.GROUNDING_MODE for this turn.
+        structured (bool | None): Overrides moves.STRUCTURED_MOVES; only adversary moves are structured.
+        on_update (Callable[[str], None] | None): Called with the reply rendered so far while streaming.
+        cancel (CancelToken | None): Aborts the request when cancelled.
+        history (History | list[Content] | None): Conversation to continue; defaults to the module's
+            conversation_history. Forked histories reuse a context cache for the shared turns.
+
+    Returns:
+        tuple[str, list]: The reply text and the sanitized raw chunks.
+
+    Raises:
+        GenerationCancelled: When `cancel` fired; the partial turn is logged as cancelled.
+    """
+    if history is None:
+        history = conversation_history
+    decision = routing.route_turn(log, "gemini", user_input)
+    if structured is None:
+        structured = moves.STRUCTURED_MOVES
+    structured = structured and decision.turn_type == routing.ADVERSARY_MOVE
+    mode = grounding.OFF if structured else grounding_mode or grounding.GROUNDING_MODE
+    # The first turn after setup; with a single reaction it is already the debrief.
+    first_move = decision.turn_type in (routing.ADVERSARY_MOVE, routing.DEBRIEF) and routing.moves_made(log) == 0
+    controller = budget.controller_for("gemini")
+    plan = debrief.prepare(log, decision.turn_type)
+    turn_budget = controller.decide(
+        decision.turn_type, log.metadata.get("difficulty", "medium"), decision.model, drafted=bool(plan and plan.complete)
+    )
+    history.append(types.Content(
         role="user",
         parts=[types.Part.from_text(text=user_input)]
     ))
     log.add_turn("user", user_input)
-    client = genai.Client(
-        api_key=os.getenv("GEMINI_API_KEY"),
-    )
+    client = providers.gemini_client()
 
-    model = "gemini-2.5-pro" # or "gemini-2.5-flash/pro", flash for faster responses
-    tools = [
-        types.Tool(googleSearch=types.GoogleSearch(
-        )),
-    ]
+    model = decision.model # flash for setup/adversary moves, pro for the debrief
+    tools = grounding.tools_for_turn(mode, first_move)
 
-    # Combine the base prompt with the company profile
-    base_prompt = utils.read_from_file(".\\text\\prompt.txt")
+    # Combine the base prompt with the company profile sections relevant to this turn
+    base_prompt = utils.read_from_file(PROMPT_PATH)
+    recent_replies = [turn.text for turn in log.turns if turn.role == "model" and not turn.metadata.get("cancelled")]
+    profile_context = retrieval.profile_context(company_profile, user_input, recent_replies)
         
-    final_prompt = company_profile + "\n" + base_prompt
+    turn_instructions = [plan.instruction] if plan else []
+
+    # Structured moves use a JSON response schema, which Gemini cannot combine
+    # with tools, so grounding is off for those turns.
+    parser = None
+    response_format = {}
+    if structured:
+        parser = moves.IncrementalJSONParser()
+        turn_instructions.append(moves.STRUCTURED_INSTRUCTION)
+        try:
+            profile = json.loads(company_profile)
+        except json.JSONDecodeError:
+            profile = {}
+        response_format = {
+            "response_mime_type": "application/json",
+            "response_json_schema": moves.json_schema(profile),
+        }
+
+    final_prompt = "\n".join([profile_context.text, base_prompt, *turn_instructions])
+    contents = list(history)
+    prompt_setup = {"system_instruction": [types.Part.from_text(text=final_prompt)]}
+    # A fork reuses the cached prompt, tools and shared turns. The cache holds
+    # the static profile, so the per-turn extras move into the trainee's message.
+    index = retrieval.index_for(company_profile)
+    static_prompt = (index.static_text() if index and index.graph else company_profile) + "\n" + base_prompt
+    cache_name = _fork_cache(client, model, history, static_prompt, tools, log.session_id)
+    if cache_name:
+        state = index.graph.state(index.graph.footholds(recent_replies)) if index and index.graph else ""
+        contents = contents[history.fork_point.length:]
+        contents[-1] = types.Content(role="user", parts=[types.Part.from_text(
+            text="\n\n".join(part for part in [user_input, state, *turn_instructions] if part)
+        )])
+        prompt_setup = {"cached_content": cache_name}
 
     generate_content_config = types.GenerateContentConfig(
         thinking_config = types.ThinkingConfig(
-            thinking_budget=-1,
+            thinking_budget=turn_budget.thinking_budget,
         ),
-        tools=tools,
-        system_instruction=[types.Part.from_text(text=final_prompt)]
+        max_output_tokens=turn_budget.max_output_tokens,
+        tools=None if cache_name else tools or None,
+        **prompt_setup,
+        **response_format,
     )
     full_response = ""
     raw_chunks = []
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=conversation_history,
-        config=generate_content_config,
-    ):
-        chunk_dict = chunk.to_dict() if hasattr(chunk, "to_dict") else {}
-        if not chunk_dict and hasattr(chunk, "model_dump"):
-            chunk_dict = chunk.model_dump()
-        sanitized = _sanitize_chunk(chunk_dict)
-        if sanitized:
-            raw_chunks.append(sanitized)
-        chunk_text = getattr(chunk, "text", "")
-        if chunk_text:
-            full_response += chunk_text
+    lookups = []
+    search_queries = []
+    usage = {}
+    company_name = log.metadata.get("company_name", "")
+    scheduler_wait_s = 0.0
+    started = time.perf_counter()
+    try:
+        round_config = generate_content_config
+        for lookup_round in range(grounding.MAX_LOOKUP_ROUNDS + 1):
+            call_parts = []
+            round_usage = {}
+            est_tokens = scheduler.estimate_tokens(final_prompt, *_contents_text(contents)) + turn_budget.max_output_tokens
+            scheduler_wait_s += scheduler.acquire("gemini", model, est_tokens, log.session_id)
+            perf.mark(perf.WAITING)
+            if cancel:
+                cancel.raise_if_cancelled()
+            for chunk in _stream_with_backoff(client, model, contents, round_config, cancel):
+                if cancel:
+                    cancel.raise_if_cancelled()
+                perf.mark(perf.STREAMING)
+                chunk_dict = chunk.to_dict() if hasattr(chunk, "to_dict") else {}
+                if not chunk_dict and hasattr(chunk, "model_dump"):
+                    chunk_dict = chunk.model_dump()
+                sanitized = _sanitize_chunk(chunk_dict)
+                if sanitized:
+                    raw_chunks.append(sanitized)
+                search_queries.extend(grounding.search_queries(chunk))
+                if chunk.usage_metadata:
+                    round_usage = _usage(chunk.usage_metadata)
+                for candidate in chunk.candidates or []:
+                    parts = candidate.content.parts if candidate.content else None
+                    call_parts.extend(part for part in parts or [] if part.function_call)
+                chunk_text = getattr(chunk, "text", "")
+                if chunk_text:
+                    full_response += chunk_text
+                    if parser:
+                        parser.feed(chunk_text)
+                    if on_update:
+                        on_update(moves.render(parser.fields) if parser else full_response)
+
+            # Usage is cumulative within a stream; each lookup round is a new request.
+            for key, value in round_usage.items():
+                usage[key] = usage.get(key, 0) + value
+            if not call_parts or lookup_round == grounding.MAX_LOOKUP_ROUNDS:
+                break
+            # The model asked for a search: answer it (from cache when possible)
+            # and let it continue the same turn with the results.
+            responses = []
+            for part in call_parts:
+                query = (part.function_call.args or {}).get("query", "")
+                result = grounding.lookup(client, company_name, query, log.session_id)
+                lookups.append(result.model_dump(exclude={"text"}))
+                responses.append(types.Part.from_function_response(
+                    name=part.function_call.name,
+                    response={"result": result.text or "No results."},
+                ))
+            if lookup_round == grounding.MAX_LOOKUP_ROUNDS - 1:
+                # Last lookups: the next request must answer instead of searching again.
+                responses.append(types.Part.from_text(text=grounding.NO_MORE_SEARCHES))
+                round_config = grounding.final_round_config(generate_content_config)
+            contents.append(types.Content(role="model", parts=call_parts))
+            contents.append(types.Content(role="user", parts=responses))
+    except Exception:
+        # Roll back the trainee's entry on any failure so the next turn (and
+        # forks, which count two entries per answered turn) never see a
+        # dangling message. A cancel keeps what arrived as a cancelled turn.
+        if history and history[-1].role == "user":
+            history.pop()
+        if not (cancel and cancel.cancelled):
+            raise
+        log.add_turn("model", full_response, raw_chunks, {
+            "cancelled": True,
+            "usage": usage,
+            "routing": decision.model_dump(),
+            "budget": turn_budget.model_dump(),
+            "latency_s": round(time.perf_counter() - started, 3),
+            "scheduler_wait_s": round(scheduler_wait_s, 3),
+        })
+        raise cancellation.GenerationCancelled(full_response)
     
-    conversation_history.append(
+    perf.mark(perf.FINISHING)
+    latency_s = time.perf_counter() - started
+    controller.observe(latency_s, decision.turn_type, model)
+
+    turn_metadata = {}
+    if parser:
+        # Store the move as a typed record; the rendered text is what the
+        # conversation history and the turn carry, without raw chunks.
+        move = moves.parse_move(full_response)
+        if move:
+            full_response = moves.render(move.model_dump())
+            raw_chunks = []
+            turn_metadata["move_check"] = moves.check_move(move, profile, log.moves)
+            turn_metadata["move_index"] = log.add_move(move)
+        else:
+            turn_metadata["structured_error"] = "Reply did not match the adversary move schema."
+    if plan:
+        full_response = debrief.stitch(full_response, plan)
+        turn_metadata["debrief"] = debrief.summary(plan)
+    if cache_name:
+        turn_metadata["context_cache"] = cache_name
+
+    history.append(
         types.Content(
             role="model",
             parts=[types.Part.from_text(text=full_response)]
         )
     )
-    log.add_turn("model", full_response, raw_chunks)
+    log.add_turn("model", full_response, raw_chunks, {
+        **turn_metadata,
+        "routing": decision.model_dump(),
+        "budget": turn_budget.model_dump(),
+        "latency_s": round(latency_s, 3),
+        "scheduler_wait_s": round(scheduler_wait_s, 3),
+        "usage": usage,
+        "retrieval": profile_context.model_dump(exclude={"text"}),
+        "grounding": {
+            "mode": mode,
+            "search_queries": search_queries,
+            "lookups": lookups,
+            "lookup_latency_s": round(sum(item["latency_s"] for item in lookups), 3),
+        },
+    })
+    if decision.turn_type == routing.ADVERSARY_MOVE:
+        debrief.draft_in_background(log, "gemini", company_profile)
     return full_response, raw_chunks
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DASE Gemini command-line interface.")
+    cassette.add_cli_arguments(parser)
+    engine.add_cli_arguments(parser)
+    args = parser.parse_args()
+    cassette.configure_from_args(args)
+    if args.attach:
+        try:
+            remote, session_log = engine.attach(args.attach)
+        except engine.EngineError as e:
+            print(e)
+            exit()
+        engine.print_transcript(session_log)
+        engine.chat(remote, session_log)
+        exit()
+
     print("=========DASE Gemini Interface============")
     difficulty = input("Select difficulty (low, medium, high): ").strip().lower()
     reactions = input("Select number of reactions (1, 2, 3): ").strip()
@@ -83,6 +357,14 @@ if __name__ == "__main__":
     if not company_profile:
         # Error message is handled in the utility function
         exit()
+    elif args.engine:
+        # The engine adds the session settings to the first message itself.
+        try:
+            remote, session_log = engine.start_remote(engine.GEMINI, company_profile["company_name"], difficulty, reactions)
+        except engine.EngineError as e:
+            print(e)
+            exit()
+        engine.chat(remote, session_log)
     else:
         session_log.add_metadata("company_name", company_profile.get("company_name"))
         session_log.add_metadata("difficulty", difficulty)
@@ -108,9 +390,15 @@ if __name__ == "__main__":
                     f"and this number of reactions {reactions}. The company to perform the exercise on is "
                     f"{company_profile['company_name']}."
                 )
-                step += 1
             
-            with utils.loading_indicator():
-                response_text, _ = generate(final_prompt, company_profile_str, session_log)
+            try:
+                with utils.loading_indicator("Generating response (Ctrl+C to cancel)"):
+                    response_text, _ = cancellation.run_interruptible(
+                        generate, final_prompt, company_profile_str, session_log
+                    )
+            except cancellation.GenerationCancelled:
+                print("\n[Response cancelled. Enter a new action.]\n")
+                continue
+            step += 1
 
             print("\nGemini:\n" + response_text)
@@ -0,0 +1,264 @@
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from statistics import mean
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from google.genai import types
+from pydantic import BaseModel
+
+import cassette
+import scheduler
+import utils
+"""
+Google Search grounding for the Gemini backend.
+
+Grounding is an explicit mode instead of a tool attached to every turn:
+  - off:        never search.
+  - first_turn: attach Google Search to the first adversary move only (the
+                opening turn just asks for the attack type). With a single
+                reaction that move is the debrief, which is grounded instead.
+  - on_demand:  expose a search function the model may call; each lookup is
+                answered by a separate grounded request and cached per
+                (company, query) on disk so repeated lookups are served locally.
+                While a cassette is recording or replaying, the disk cache is
+                bypassed so every lookup is in the cassette and replays do not
+                depend on the machine's cache.
+"""
+load_dotenv()
+
+OFF = "off"
+FIRST_TURN = "first_turn"
+ON_DEMAND = "on_demand"
+MODES = (OFF, FIRST_TURN, ON_DEMAND)
+
+GROUNDING_MODE = os.getenv("DASE_GROUNDING_MODE", ON_DEMAND)
+GROUNDING_MODEL = os.getenv("DASE_GROUNDING_MODEL", "gemini-2.5-flash")
+CACHE_TTL_S = float(os.getenv("DASE_GROUNDING_TTL_S", str(7 * 24 * 3600)))
+CACHE_PATH = os.path.join(utils.DATA_DIR, "cache", "grounding.json")
+
+# Maximum number of model-requested lookup rounds within a single turn. The
+# request after the last round may not search again and must answer.
+MAX_LOOKUP_ROUNDS = 2
+NO_MORE_SEARCHES = "No more searches are available for this turn. Answer now with what you have."
+
+SEARCH_FUNCTION_NAME = "search_threat_intel"
+
+SEARCH_FUNCTION = types.FunctionDeclaration(
+    name=SEARCH_FUNCTION_NAME,
+    description=(
+        "Look up current, publicly reported attacker techniques, tooling or "
+        "vulnerabilities for a technology in the company's stack. Only call this "
+        "when the company profile does not already contain what you need."
+    ),
+    parameters_json_schema={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "Short search query, e.g. 'current TTPs against Okta SSO'.",
+            },
+        },
+        "required": ["query"],
+    },
+)
+
+
+class Lookup(BaseModel):
+    query: str
+    text: str
+    cached: bool
+    latency_s: float
+
+
+class GroundingCache:
+    """JSON-backed cache of grounded lookups keyed by (company, query) with a TTL."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl_s: float = CACHE_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] | None = None
+
+    @staticmethod
+    def key(company: str, query: str) -> str:
+        return f"{company.strip().lower()}|{' '.join(query.lower().split())}"
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def get(self, company: str, query: str) -> str | None:
+        """Returns the cached text for a lookup, or None when missing or expired."""
+        with self._lock:
+            entry = self._load().get(self.key(company, query))
+        if not entry or time.time() - entry.get("stored_at", 0) > self.ttl_s:
+            return None
+        return entry.get("text")
+
+    def put(self, company: str, query: str, text: str) -> None:
+        """
+        Stores a lookup result and persists the cache.
+
+        Other processes (GUI, CLIs, load test workers) share the file, so their
+        entries are merged in first (the newest entry per key wins) and the file
+        is replaced atomically rather than rewritten in place.
+        """
+        with self._lock:
+            entries = self._read()
+            for key, entry in self._load().items():
+                if entry.get("stored_at", 0) >= entries.get(key, {}).get("stored_at", 0):
+                    entries[key] = entry
+            entries[self.key(company, query)] = {"text": text, "stored_at": time.time()}
+            now = time.time()
+            for key in [k for k, v in entries.items() if now - v.get("stored_at", 0) > self.ttl_s]:
+                del entries[key]
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".grounding-", suffix=".json", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self._entries = entries
+
+
+cache = GroundingCache()
+
+
+def tools_for_turn(mode: str, first_move: bool) -> List[types.Tool]:
+    """
+    Returns the tools to attach to a turn for the given grounding mode.
+
+    Args:
+        mode (str): One of MODES.
+        first_move (bool): The turn is the first one after setup (an adversary
+            move, or the debrief when only one reaction was requested).
+    """
+    if mode == FIRST_TURN and first_move:
+        return [types.Tool(google_search=types.GoogleSearch())]
+    if mode == ON_DEMAND:
+        return [types.Tool(function_declarations=[SEARCH_FUNCTION])]
+    return []
+
+
+def final_round_config(config: types.GenerateContentConfig) -> types.GenerateContentConfig:
+    """
+    Config for the request after the last lookup round: function calling is
+    switched off so the model answers. Requests on a context cache cannot set
+    a tool config and rely on NO_MORE_SEARCHES in the function responses.
+    """
+    if not config.tools or config.cached_content:
+        return config
+    return config.model_copy(update={"tool_config": types.ToolConfig(
+        function_calling_config=types.FunctionCallingConfig(mode=types.FunctionCallingConfigMode.NONE)
+    )})
+
+
+def lookup(client, company: str, query: str, session_id: str = "") -> Lookup:
+    """
+    Answers a model-requested search, serving it from the cache when possible.
+
+    Args:
+        client (genai.Client): Client used for the grounded request on a cache miss.
+        company (str): Company the exercise runs against; part of the cache key.
+        query (str): The model's search query.
+        session_id (str): Session the lookup belongs to, for request scheduling.
+
+    Returns:
+        Lookup: The result text, whether it came from the cache, and the time spent.
+    """
+    started = time.perf_counter()
+    on_cassette = cassette.active() is not None
+    text = None if on_cassette else cache.get(company, query)
+    if text is not None:
+        return Lookup(query=query, text=text, cached=True, latency_s=round(time.perf_counter() - started, 3))
+
+    prompt = (
+        f"For an incident response training exercise against {company}, answer briefly: {query}\n"
+        "Summarise current, publicly reported attacker techniques in under 200 words."
+    )
+    scheduler.acquire("gemini", GROUNDING_MODEL, scheduler.estimate_tokens(prompt) + 400, session_id)
+    response = client.models.generate_content(
+        model=GROUNDING_MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            tools=[types.Tool(google_search=types.GoogleSearch())],
+        ),
+    )
+    text = (response.text or "").strip()
+    if text and not on_cassette:
+        cache.put(company, query, text)
+    return Lookup(query=query, text=text, cached=False, latency_s=round(time.perf_counter() - started, 3))
+
+
+def search_queries(chunk) -> List[str]:
+    """Extracts the web search queries Gemini ran for a streamed chunk, if any."""
+    queries = []
+    for candidate in getattr(chunk, "candidates", None) or []:
+        metadata = getattr(candidate, "grounding_metadata", None)
+        if metadata and metadata.web_search_queries:
+            queries.extend(metadata.web_search_queries)
+    return queries
+
+
+def latency_report(logs: List[utils.SessionLog]) -> Dict[str, Any]:
+    """
+    Summarises how much latency grounding adds per turn.
+
+    Compares the mean latency of grounded and ungrounded model turns of the same
+    turn type, and totals the time spent in model-requested lookups.
+    """
+    by_type: Dict[str, Dict[str, List[float]]] = {}
+    lookup_latencies, cache_hits = [], 0
+    for log in logs:
+        for turn in log.turns:
+            if turn.role != "model" or "latency_s" not in turn.metadata:
+                continue
+            info = turn.metadata.get("grounding", {})
+            grounded = bool(info.get("lookups") or info.get("search_queries"))
+            turn_type = turn.metadata.get("routing", {}).get("turn_type", "unknown")
+            bucket = by_type.setdefault(turn_type, {"grounded": [], "ungrounded": []})
+            bucket["grounded" if grounded else "ungrounded"].append(turn.metadata["latency_s"])
+            for item in info.get("lookups", []):
+                lookup_latencies.append(item["latency_s"])
+                cache_hits += 1 if item["cached"] else 0
+
+    report: Dict[str, Any] = {"turn_types": {}}
+    for turn_type, bucket in by_type.items():
+        grounded = mean(bucket["grounded"]) if bucket["grounded"] else None
+        ungrounded = mean(bucket["ungrounded"]) if bucket["ungrounded"] else None
+        report["turn_types"][turn_type] = {
+            "grounded_turns": len(bucket["grounded"]),
+            "ungrounded_turns": len(bucket["ungrounded"]),
+            "mean_grounded_s": grounded,
+            "mean_ungrounded_s": ungrounded,
+            "added_s": grounded - ungrounded if grounded is not None and ungrounded is not None else None,
+        }
+    report["lookups"] = len(lookup_latencies)
+    report["lookup_cache_hits"] = cache_hits
+    report["mean_lookup_s"] = mean(lookup_latencies) if lookup_latencies else None
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python grounding.py [session log paths or globs...]
+    patterns = sys.argv[1:] or [os.path.join("session_logs", "*.json")]
+    paths = [path for pattern in patterns for path in glob.glob(pattern)]
+    utils.pretty_print(latency_report([utils.load_session(path) for path in paths]))
@@ -2,11 +2,21 @@ import dearpygui.dearpygui as dpg
 import gemini
 import json
 import threading
+import time
 import os
 import platform
 import ctypes
 import utils
 import openai_helper
+import local_llm
+import moves
+import cassette
+import cancellation
+import comparison
+import engine
+import forks
+import perf
+import scheduler
 
 """
 GUI for DASE Training Interface using Dear PyGui.
@@ -183,22 +193,89 @@ company_profile_str = ""
 difficulty = "low"
 reactions = 1
 step = 0
+structured_moves = moves.STRUCTURED_MOVES
 
-MODEL_OPTIONS = ["Google Gemini", "OpenAI ChatGPT"] # This is fine here as it's GUI-specific
+COMPARE_OPTION = "Compare Gemini + OpenAI"
+MODEL_OPTIONS = ["Google Gemini", "OpenAI ChatGPT", local_llm.LABEL, COMPARE_OPTION] # This is fine here as it's GUI-specific
 active_model = MODEL_OPTIONS[0]
 active_session_log = gemini.session_log
+active_cancel = None  # CancelToken of the turn being generated, if any
+comparison_session = None  # comparison.ComparisonSession in comparison mode
+remote_session = None  # engine.RemoteSession when the session runs in the engine daemon
+engine_owned = []  # engine sessions started or forked from this screen, ended when leaving it
+ENGINE_BACKENDS = {label: backend for backend, label in engine.LABELS.items()}
+engine_sessions = {}  # session combo label -> engine session id
+fork_parents = []  # logs of the sessions the active one was forked from, saved with it
+FORK_BUTTON_PAD = 70
+current_timeline = None  # perf.RequestTimeline of the latest turn
+frame_stats = perf.FrameStats()
+profiler = perf.SessionProfiler()
+HUD_REFRESH_S = 0.25
+_hud_refreshed = 0.0
+_engine_scheduler = {"metrics": None, "pending": False}  # daemon scheduler metrics, fetched off the render thread
 
 # --- Callbacks ---
+def _add_user_message(text, turn_index=None):
+    """
+    Shows a defender action in the chat, with a Fork button that replays the
+    exercise from it when `turn_index` (its index in the session log) is given.
+    """
+    if turn_index is None:
+        dpg.add_text(f"User: {text}", parent="chat_display", color=USER_COLOR, wrap=wrap_width("chat_display"))
+        return
+    with dpg.group(horizontal=True, parent="chat_display"):
+        dpg.add_button(label="Fork", small=True, callback=fork_session_callback, user_data=turn_index)
+        dpg.add_text(f"User: {text}", color=USER_COLOR, wrap=wrap_width("chat_display", WRAP_PAD + FORK_BUTTON_PAD))
+
+
+def _render_session(intro):
+    """Redraws the chat from the active session log, e.g. after attaching or forking."""
+    dpg.delete_item("chat_display", children_only=True)
+    dpg.add_text(intro, parent="chat_display", color=SYSTEM_COLOR, wrap=wrap_width("chat_display"))
+    for index, turn in enumerate(active_session_log.turns):
+        if turn.role == "user":
+            _add_user_message(turn.text, index)
+        else:
+            dpg.add_text(
+                f"DASE: {_decode_unicode(turn.text)}",
+                parent="chat_display",
+                color=MODEL_COLOR,
+                wrap=wrap_width("chat_display")
+            )
+
+
+def _end_engine_sessions():
+    """
+    Ends the engine sessions this GUI started or forked, off the render thread,
+    so the daemon frees their histories and logs. Sessions attached from a CLI
+    are left running.
+    """
+    if not engine_owned:
+        return
+    client, session_ids = remote_session.client if remote_session else engine.EngineClient(), list(engine_owned)
+    engine_owned.clear()
+
+    def end_all():
+        for session_id in session_ids:
+            try:
+                client.end_session(session_id)
+            except engine.EngineError as e:
+                print(e)
+
+    threading.Thread(target=end_all, daemon=True).start()
+
+
 def start_session_callback():
     """
     Loads company profile, sets up chat parameters, and switches to the chat window.
     """
-    global company_profile_str, difficulty, reactions, step, active_model, active_session_log
+    global company_profile_str, difficulty, reactions, step, active_model, active_session_log, structured_moves, comparison_session, remote_session
 
     # Get values from setup window
     company_name = dpg.get_value("company_combo")
     difficulty = dpg.get_value("difficulty_combo")
     reactions = dpg.get_value("reactions_input")
+    structured_moves = dpg.get_value("structured_checkbox")
     model_choice = dpg.get_value("model_combo") or MODEL_OPTIONS[0]
     active_model = model_choice
 
@@ -206,12 +283,43 @@ def start_session_callback():
     if not company_file:
         print("Invalid company selection.")
         return
+    # Clients are built when the session resets, so the cassette is chosen first.
+    try:
+        cassette.configure(
+            dpg.get_value("cassette_combo"),
+            dpg.get_value("cassette_path").strip() or None,
+            cassette.INSTANT if dpg.get_value("cassette_instant") else cassette.ORIGINAL,
+        )
+    except FileNotFoundError as e:
+        print(e)
+        return
     with open(company_file, 'r', encoding='utf-8') as f:
         company_profile = json.load(f)
     company_profile_str = json.dumps(company_profile, indent=2)
 
     # Reset conversation state based on selected model
-    if model_choice == "Google Gemini":
+    comparison_session = None
+    _end_engine_sessions()
+    remote_session = None
+    fork_parents.clear()
+    if dpg.get_value("engine_checkbox") and model_choice in ENGINE_BACKENDS:
+        # The daemon holds the history and log; the GUI keeps a mirror of the log.
+        try:
+            remote_session, active_session_log = engine.start_remote(
+                ENGINE_BACKENDS[model_choice], company_name, difficulty, reactions
+            )
+            engine_owned.append(remote_session.session_id)
+        except engine.EngineError as e:
+            print(e)
+            return
+    elif model_choice == COMPARE_OPTION:
+        # Each backend gets its own history and log inside the comparison session.
+        comparison_session = comparison.ComparisonSession(company_name, company_profile_str, difficulty, reactions)
+        active_session_log = comparison_session.branches[comparison.GEMINI].log
+    elif model_choice == local_llm.LABEL:
+        local_llm.reset_session(difficulty, reactions, company_profile_str, company_name)
+        active_session_log = local_llm.session_log
+    elif model_choice == "Google Gemini":
         gemini.conversation_history.clear()
         gemini.session_log = utils.SessionLog()
         gemini.session_log.add_metadata("company_name", company_name)
@@ -249,22 +357,24 @@ def send_message_callback():
     """
     Sends user input to the selected model and displays the streaming response.
     """
-    global step
+    global step, active_cancel, current_timeline
     user_input = dpg.get_value("user_input")
-    if not user_input:
+    if not user_input or active_cancel is not None:
         return
 
     # Show the loading indicator immediately
     dpg.configure_item("loading_indicator", show=True)
 
-    dpg.add_text(
-        f"User: {user_input}",
-        parent="chat_display",
-        color=USER_COLOR,
-        wrap=wrap_width("chat_display")
-    )
+    # The new turn's index in the log, for its Fork button (comparison turns have none).
+    _add_user_message(user_input, None if comparison_session is not None else len(active_session_log.turns))
     dpg.set_value("user_input", "") 
-    if step == 0 and active_model == "Google Gemini":
+    if comparison_session is not None:
+        send_comparison_turn(user_input)
+        return
+    # The setup details go with the first turn that was answered, so a
+    # cancelled first turn does not lose them.
+    answered = any(turn.role == "model" and not turn.metadata.get("cancelled") for turn in active_session_log.turns)
+    if not answered and active_model == "Google Gemini" and remote_session is None:
         company_name = dpg.get_value("company_combo")
         full_prompt = (
             f"{user_input}\nThe user desires this level of technical difficulty: {difficulty} "
@@ -285,28 +395,322 @@ def send_message_callback():
         wrap=wrap_width("chat_display")
     )
 
+    timeline = perf.RequestTimeline()
+    current_timeline = timeline
+
+    def on_update(partial_text):
+        # Render the reply (or the structured move fields) as they stream in.
+        callback_started = time.perf_counter()
+        if dpg.does_item_exist(model_response_tag):
+            dpg.set_value(model_response_tag, f"DASE: {_decode_unicode(partial_text)}")
+        timeline.add_callback_time(time.perf_counter() - callback_started)
+
+    cancel = cancellation.CancelToken()
+    active_cancel = cancel
+    dpg.configure_item("stop_button", enabled=True)
+
     def stream_response():
+        global active_cancel
         model_name = active_model
         log = active_session_log
-        model_handler = gemini if model_name == "Google Gemini" else openai_helper
+        model_handler = remote_session or {"Google Gemini": gemini, local_llm.LABEL: local_llm}.get(model_name, openai_helper)
         try:
             # The openai_helper already decodes, so we only need to decode for gemini
-            response_text, _ = model_handler.generate(full_prompt, company_profile_str, log)
-            if model_name == "Google Gemini":
+            with perf.track(timeline):
+                response_text, _ = profiler.run(
+                    model_handler.generate,
+                    full_prompt,
+                    company_profile_str,
+                    log,
+                    structured=structured_moves,
+                    on_update=on_update,
+                    cancel=cancel,
+                )
+            if model_name != "OpenAI ChatGPT":
                 response_text = _decode_unicode(response_text)
+        except cancellation.GenerationCancelled as e:
+            response_text = f"{_decode_unicode(e.partial_text)} [stopped]"
         except Exception as e:
             response_text = f"Error: {e}"
         finally:
+            timeline.finish(cancelled=cancel.cancelled)
+            active_cancel = None
+            dpg.configure_item("stop_button", enabled=False)
             dpg.configure_item("loading_indicator", show=False)
             if dpg.does_item_exist(model_response_tag):
                 dpg.set_value(model_response_tag, f"DASE: {response_text}")
     threading.Thread(target=stream_response, daemon=True).start()
 
 
+def _result_stats(result) -> str:
+    usage = result.usage
+    latency = "-" if result.latency_s is None else f"{result.latency_s:.1f} s"
+    tokens = f"{usage.get('input_tokens', 0)} in / {usage.get('output_tokens', 0) + usage.get('reasoning_tokens', 0)} out tokens"
+    return f"{latency} | {tokens}"
+
+
+def send_comparison_turn(user_input):
+    """
+    Sends a turn to both backends and streams the replies into two columns.
+    """
+    global step, active_cancel
+    step += 1
+    backends = comparison_session.active_backends()
+    column_wrap = max(0, wrap_width("chat_display") // len(backends) - WRAP_PAD)
+    tags = {backend: f"model_response_{step}_{backend}" for backend in backends}
+
+    with dpg.table(parent="chat_display", header_row=True, borders_innerV=True):
+        for backend in backends:
+            dpg.add_table_column(label=comparison.LABELS[backend])
+        with dpg.table_row():
+            for backend in backends:
+                dpg.add_text("DASE: ", tag=tags[backend], color=MODEL_COLOR, wrap=column_wrap)
+        with dpg.table_row():
+            for backend in backends:
+                dpg.add_text("", tag=f"{tags[backend]}_stats", color=SYSTEM_COLOR, wrap=column_wrap)
+
+    def on_update(backend, partial_text):
+        if dpg.does_item_exist(tags[backend]):
+            dpg.set_value(tags[backend], f"DASE: {_decode_unicode(partial_text)}")
+
+    cancel = cancellation.CancelToken()
+    active_cancel = cancel
+    dpg.configure_item("stop_button", enabled=True)
+
+    def run_comparison():
+        global active_cancel
+        try:
+            results = comparison_session.send(user_input, structured_moves, on_update, cancel)
+            for backend, result in results.items():
+                text = f"Error: {result.error}" if result.error and not result.text else _decode_unicode(result.text)
+                if result.cancelled:
+                    text += " [stopped]"
+                dpg.set_value(tags[backend], f"DASE: {text}")
+                dpg.set_value(f"{tags[backend]}_stats", _result_stats(result))
+            if len(results) > 1 and not cancel.cancelled:
+                group = f"branch_choice_{step}"
+                with dpg.group(horizontal=True, parent="chat_display", tag=group):
+                    for backend in results:
+                        dpg.add_button(label=f"Continue with {comparison.LABELS[backend]}",
+                                       callback=choose_branch_callback, user_data=(backend, group))
+                    dpg.add_button(label="Continue with both", callback=choose_branch_callback,
+                                   user_data=(comparison.BOTH, group))
+        finally:
+            active_cancel = None
+            dpg.configure_item("stop_button", enabled=False)
+            dpg.configure_item("loading_indicator", show=False)
+    threading.Thread(target=run_comparison, daemon=True).start()
+
+
+def choose_branch_callback(sender, app_data, user_data):
+    """
+    Keeps the chosen comparison branch (or both) for the following turns.
+    """
+    backend, group = user_data
+    comparison_session.choose(backend)
+    dpg.delete_item(group)
+    label = "both backends" if backend == comparison.BOTH else comparison.LABELS[backend]
+    dpg.add_text(f"Continuing with {label}.", parent="chat_display", color=SYSTEM_COLOR,
+                 wrap=wrap_width("chat_display"))
+
+
+def stop_generation_callback():
+    """
+    Cancels the response being generated, closing its connection.
+    """
+    if active_cancel is not None:
+        active_cancel.cancel()
+
+
+def toggle_perf_hud_callback(sender, app_data):
+    """
+    Shows or hides the performance HUD.
+    """
+    dpg.configure_item("perf_window", show=bool(app_data))
+
+
+def toggle_profiling_callback():
+    """
+    Starts a cProfile recording, or stops it and writes it to disk.
+    """
+    if not profiler.active:
+        profiler.start()
+        dpg.configure_item("profile_button", label="Stop and dump profile")
+        dpg.set_value("perf_profile_status", "Profiling the GUI and generation threads...")
+        return
+    path = profiler.dump()
+    dpg.configure_item("profile_button", label="Start profiling")
+    dpg.set_value("perf_profile_status", f"Profile written to {path}")
+
+
+def _format_seconds(value) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def _fetch_engine_scheduler(client):
+    try:
+        _engine_scheduler["metrics"] = client.scheduler_metrics()
+    except engine.EngineError:
+        _engine_scheduler["metrics"] = None
+    finally:
+        _engine_scheduler["pending"] = False
+
+
+def _scheduler_text() -> str:
+    """
+    Summarises the request scheduler the active session uses: the daemon's when
+    it runs in the engine, otherwise this process's.
+    """
+    if remote_session is not None:
+        if not _engine_scheduler["pending"]:
+            _engine_scheduler["pending"] = True
+            threading.Thread(target=_fetch_engine_scheduler, args=(remote_session.client,), daemon=True).start()
+        metrics, source = _engine_scheduler["metrics"], "engine"
+    else:
+        metrics, source = scheduler.metrics(), "this process"
+    if not metrics:
+        return f"Scheduler ({source}): -"
+    waits = metrics["wait_s"]
+    return (
+        f"Scheduler ({source}): queue {metrics['queue_depth']} | admitted {metrics['admitted']}, "
+        f"throttled {metrics['throttled']}, 429s {metrics['penalties']}\n"
+        f"wait p90 interactive {_format_seconds(waits.get('interactive', {}).get('p90'))} | "
+        f"background {_format_seconds(waits.get('background', {}).get('p90'))}"
+    )
+
+
+def update_perf_hud():
+    """
+    Records the last frame time and refreshes the HUD a few times per second.
+    """
+    global _hud_refreshed
+    frame_stats.add(dpg.get_delta_time())
+    now = time.perf_counter()
+    if not dpg.is_item_shown("perf_window") or now - _hud_refreshed < HUD_REFRESH_S:
+        return
+    _hud_refreshed = now
+
+    frames = frame_stats.summary()
+    dpg.set_value("perf_frame", (
+        f"Frame: {frames['mean_ms'] or 0:.1f} ms mean, {frames['p95_ms'] or 0:.1f} ms p95, "
+        f"{frames['max_ms'] or 0:.1f} ms max ({dpg.get_frame_rate():.0f} fps)"
+    ))
+    items = dpg.get_item_children("chat_display", 1) or []
+    dpg.set_value("perf_items", f"chat_display items: {len(items)}")
+    dpg.set_value("perf_scheduler", _scheduler_text())
+
+    timeline = current_timeline
+    if timeline is None:
+        dpg.set_value("perf_request", f"Request: {perf.IDLE}")
+        dpg.set_value("perf_stages", "")
+        return
+    stages = timeline.stages()
+    dpg.set_value("perf_request", f"Request: {timeline.state} ({timeline.chunks} chunks)")
+    dpg.set_value("perf_stages", (
+        f"queued {_format_seconds(stages['queued_s'])} | first token {_format_seconds(stages['first_token_s'])}\n"
+        f"streaming {_format_seconds(stages['streaming_s'])} | post-processing {_format_seconds(stages['post_processing_s'])}\n"
+        f"UI callbacks {_format_seconds(stages['ui_callbacks_s'])} | total {_format_seconds(stages['total_s'])}"
+    ))
+
+
+def refresh_engine_sessions_callback():
+    """
+    Lists the sessions held by the engine daemon in the setup screen.
+    """
+    engine_sessions.clear()
+    client = engine.EngineClient()
+    try:
+        items = client.sessions() if client.running() else []
+    except engine.EngineError as e:
+        print(e)
+        items = []
+    for item in items:
+        label = f"{item['session_id'][:8]} | {item['company_name']} | {engine.LABELS[item['backend']]} | {item['turns']} turns"
+        engine_sessions[label] = item["session_id"]
+    dpg.configure_item("engine_sessions_combo", items=list(engine_sessions))
+    dpg.set_value("engine_sessions_combo", next(iter(engine_sessions), ""))
+
+
+def attach_session_callback():
+    """
+    Continues a session held by the engine daemon, started from the GUI or a CLI.
+    """
+    global difficulty, reactions, step, active_model, active_session_log, structured_moves, comparison_session, remote_session
+    session_id = engine_sessions.get(dpg.get_value("engine_sessions_combo"))
+    if not session_id:
+        return
+    try:
+        remote_session, active_session_log = engine.attach(session_id)
+    except engine.EngineError as e:
+        print(e)
+        return
+    comparison_session = None
+    fork_parents.clear()
+    metadata = active_session_log.metadata
+    active_model = metadata.get("model", MODEL_OPTIONS[0])
+    difficulty = metadata.get("difficulty", difficulty)
+    reactions = metadata.get("reactions", reactions)
+    structured_moves = dpg.get_value("structured_checkbox")
+    step = sum(1 for turn in active_session_log.turns if turn.role == "model")
+
+    dpg.configure_item("setup_window", show=False)
+    dpg.configure_item("chat_window", show=True)
+    dpg.set_primary_window("chat_window", True)
+
+    _render_session(f"Attached to session {session_id[:8]} for {metadata.get('company_name')} using {active_model}.")
+
+
+def fork_session_callback(sender, app_data, user_data):
+    """
+    Forks the session before the chosen defender action, so the exercise can be
+    replayed from there with a different action. The earlier turns and the
+    provider-side state for them are shared, so the next turn is a single call.
+    """
+    global step, active_session_log, remote_session
+    turn_index = user_data
+    if active_cancel is not None or comparison_session is not None:
+        return
+    parent = active_session_log
+    original_action = parent.turns[turn_index].text if turn_index < len(parent.turns) else ""
+    try:
+        if remote_session is not None:
+            session_id = remote_session.client.fork(remote_session.session_id, turn_index)
+            remote_session = engine.RemoteSession(remote_session.client, session_id)
+            engine_owned.append(session_id)
+            active_session_log = remote_session.client.session(session_id)
+        elif active_model == "Google Gemini":
+            gemini.session_log, gemini.conversation_history = forks.fork(parent, gemini.conversation_history, turn_index)
+            active_session_log = gemini.session_log
+        elif active_model == local_llm.LABEL:
+            local_llm.session_log, local_llm.conversation_history = forks.fork(parent, local_llm.conversation_history, turn_index)
+            active_session_log = local_llm.session_log
+        else:
+            openai_helper.session_log = parent.fork(turn_index)
+            openai_helper.dase_client = openai_helper.dase_client.fork(forks.history_length(parent, turn_index))
+            active_session_log = openai_helper.session_log
+    except (ValueError, engine.EngineError) as e:
+        print(e)
+        return
+    if remote_session is None:
+        fork_parents.append(parent)
+    step = sum(1 for turn in active_session_log.turns if turn.role == "model")
+    _render_session(
+        f"Forked from turn {turn_index} of session {parent.session_id[:8]}. "
+        "Enter a different defender action to see how the adversary adapts."
+    )
+    # Gemini's first message carries the session settings; offer only the trainee's words.
+    if active_model == "Google Gemini" and not any(turn.role == "model" for turn in active_session_log.turns):
+        original_action = original_action.split("\nThe user desires this level of technical difficulty")[0]
+    dpg.set_value("user_input", original_action)
+
+
 def back_to_setup_callback():
     """
-    Returns to the setup screen from the chat window.
+    Returns to the setup screen from the chat window, ending the engine
+    sessions started from it.
     """
+    stop_generation_callback()
+    _end_engine_sessions()
     dpg.configure_item("chat_window", show=False)
     dpg.configure_item("setup_window", show=True)
     dpg.set_primary_window("setup_window", True)
@@ -316,6 +720,23 @@ def save_session_callback():
     """
     Saves the current session log to disk.
     """
+    if comparison_session is not None:
+        try:
+            paths = comparison_session.save()
+            dpg.add_text(
+                "Comparison logs saved to " + ", ".join(paths),
+                parent="chat_display",
+                color=SYSTEM_COLOR,
+                wrap=wrap_width("chat_display")
+            )
+        except Exception as e:
+            dpg.add_text(
+                f"Failed to save session: {e}",
+                parent="chat_display",
+                color=(255, 99, 71, 255),
+                wrap=wrap_width("chat_display")
+            )
+        return
     if active_session_log is None:
         dpg.add_text(
             "No active session to save.",
@@ -326,6 +747,10 @@ def save_session_callback():
         return
     try:
         file_path = utils.save_session(active_session_log)
+        # Sessions this one was forked from are saved with it, so the fork tree is on disk.
+        parent_paths = [utils.save_session(log, suffix=f"_{log.session_id[:8]}") for log in fork_parents]
+        if parent_paths:
+            file_path += " (forked from " + ", ".join(parent_paths) + ")"
         dpg.add_text(
             f"Session saved to {file_path}",
             parent="chat_display",
@@ -360,6 +785,27 @@ with dpg.window(label="Setup", tag="setup_window", width=800, height=700):
 
     dpg.add_text("Select Number of Reactions:")
     dpg.add_input_int(default_value=3, tag="reactions_input", width=250, min_value=1, max_value=10)
+    dpg.add_spacer(height=10)
+
+    dpg.add_checkbox(label="Structured adversary moves", default_value=moves.STRUCTURED_MOVES, tag="structured_checkbox")
+    dpg.add_spacer(height=10)
+
+    dpg.add_text("Cassette (record/replay LLM calls):")
+    active_cassette = cassette.active()
+    with dpg.group(horizontal=True):
+        dpg.add_combo(list(cassette.MODES), default_value=active_cassette.mode if active_cassette else cassette.OFF,
+                      tag="cassette_combo", width=100)
+        dpg.add_input_text(default_value=active_cassette.path if active_cassette else cassette.DEFAULT_PATH,
+                           tag="cassette_path", width=300)
+        dpg.add_checkbox(label="Instant replay", default_value=bool(active_cassette and active_cassette.speed == cassette.INSTANT),
+                         tag="cassette_instant")
+    dpg.add_spacer(height=10)
+
+    dpg.add_checkbox(label="Run in the DASE engine (shared with the CLIs)", default_value=engine.ENGINE, tag="engine_checkbox")
+    with dpg.group(horizontal=True):
+        dpg.add_combo([], tag="engine_sessions_combo", width=400)
+        dpg.add_button(label="Refresh", callback=refresh_engine_sessions_callback)
+        dpg.add_button(label="Attach", callback=attach_session_callback)
     dpg.add_spacer(height=20)
 
     dpg.add_button(label="Start Session", callback=start_session_callback)
@@ -374,17 +820,37 @@ with dpg.window(label="Chat", tag="chat_window", show=False, width=800, height=7
             hint="Type your message here...",
             on_enter=True,
             callback=send_message_callback,
-            width=-220
+            width=-290
         )
         dpg.add_button(label="Send", callback=send_message_callback, width=60)
+        dpg.add_button(label="Stop", tag="stop_button", callback=stop_generation_callback, width=60, enabled=False)
         dpg.add_button(label="End", callback=back_to_setup_callback, width=60)
         with dpg.group(horizontal=True):
             dpg.add_loading_indicator(tag="loading_indicator", show=False, style=1, radius=1.5)
 
     dpg.add_spacer(height=6)
-    dpg.add_button(label="Save Session", callback=save_session_callback, width=140)
+    with dpg.group(horizontal=True):
+        dpg.add_button(label="Save Session", callback=save_session_callback, width=140)
+        dpg.add_checkbox(label="Perf HUD", default_value=perf.PERF_HUD, callback=toggle_perf_hud_callback)
+
+with dpg.window(label="Performance", tag="perf_window", show=perf.PERF_HUD, width=420, height=260, pos=(360, 20)):
+    dpg.add_text("", tag="perf_frame")
+    dpg.add_text("", tag="perf_items")
+    dpg.add_text("", tag="perf_scheduler")
+    dpg.add_text("", tag="perf_request")
+    dpg.add_text("", tag="perf_stages")
+    dpg.add_separator()
+    dpg.add_button(label="Start profiling", tag="profile_button", callback=toggle_profiling_callback)
+    dpg.add_text("", tag="perf_profile_status", wrap=400)
 
 dpg.set_primary_window("setup_window", True)
+refresh_engine_sessions_callback()
+if local_llm.WARMUP:
+    # Load the local model while the trainee fills in the setup screen.
+    threading.Thread(target=local_llm.warm_up, daemon=True).start()
 dpg.show_viewport()
-dpg.start_dearpygui()
+# Manual render loop so every frame's time reaches the performance HUD.
+while dpg.is_dearpygui_running():
+    update_perf_hud()
+    dpg.render_dearpygui_frame()
 dpg.destroy_context()
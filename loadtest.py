@@ -0,0 +1,461 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import mean
+from typing import Any, Dict, List, Tuple
+
+import budget
+import routing
+import utils
+"""
+Synthetic trainee load generator for DASE.
+
+Runs scripted or rule-based defender personas against N concurrent sessions
+through the same generate() code paths the GUI uses, on a process pool (each
+worker process owns its backend module state). Works against the local mock
+provider (DASE_PROVIDER=mock) or the real APIs and writes a machine-readable
+report with throughput, latency percentiles, error rates and scenario checks.
+
+Each worker process has its own request scheduler (scheduler.py), so rate
+limits apply per worker, not across the run; the report's "scheduler" section
+lists every worker's scheduler metrics and their totals.
+
+Usage:
+    python loadtest.py --sessions 20 --concurrency 5 --backend gemini --provider mock --out report.json
+
+Fork check (each Gemini session is also replayed from its first defender action):
+    python loadtest.py --sessions 5 --backend gemini --provider mock --fork --out forks.json
+
+Backend benchmark (same scripted sessions on the cloud APIs and the local server):
+    python loadtest.py --sessions 5 --concurrency 1 --backend all --provider real --persona scripted --out bench.json
+"""
+BACKENDS = ("gemini", "openai", "local")
+
+OPENING = "I want to practice a credential theft scenario."
+FORK_ACTION = "We leave the account active and only increase monitoring on it."
+
+SCRIPTED_ACTIONS = [
+    "We reset the affected user's password, revoke active sessions and enforce MFA on the account.",
+    "We isolate the affected host from the network and collect memory and disk images.",
+    "We review SIEM and cloud audit logs for lateral movement and block the suspicious IPs.",
+    "We rotate service account secrets and escalate to the incident response lead.",
+    "We notify leadership, preserve evidence and monitor for re-entry attempts.",
+]
+
+# (keywords in the adversary's last reply, defender action)
+PERSONA_RULES = [
+    (("phish", "email", "pretext"), "We quarantine the email, block the sender domain and reset credentials for anyone who clicked."),
+    (("credential", "password", "token", "sso", "okta", "mfa"), "We revoke all sessions and tokens for the account and enforce phishing-resistant MFA."),
+    (("lateral", "pivot", "service account", "kafka", "lambda", "host"), "We isolate the affected hosts and disable the compromised service account."),
+    (("exfil", "s3", "database", "ledger", "backup"), "We restrict egress, snapshot the database and review access logs for data transfer."),
+    (("ci", "github", "pipeline", "repo"), "We freeze deployments, review recent CI changes and rotate repository secrets."),
+]
+
+
+class ScriptedPersona:
+    """Defender that plays a fixed list of actions in order."""
+
+    def __init__(self, actions: List[str] | None = None):
+        self.actions = actions or SCRIPTED_ACTIONS
+        self._index = 0
+
+    def next_action(self, last_reply: str) -> str:
+        action = self.actions[self._index % len(self.actions)]
+        self._index += 1
+        return action
+
+
+class RuleBasedPersona:
+    """Defender that reacts to keywords in the adversary's last move."""
+
+    def __init__(self):
+        self._used: set[str] = set()
+        self._fallback = ScriptedPersona()
+
+    def next_action(self, last_reply: str) -> str:
+        reply = last_reply.lower()
+        for keywords, action in PERSONA_RULES:
+            if action not in self._used and any(keyword in reply for keyword in keywords):
+                self._used.add(action)
+                return action
+        return self._fallback.next_action(last_reply)
+
+
+PERSONAS = {"scripted": ScriptedPersona, "rules": RuleBasedPersona}
+
+
+def _asset_names(profile: Dict[str, Any]) -> List[str]:
+    return [asset.get("asset", "") for asset in profile.get("key_digital_assets", []) if asset.get("asset")]
+
+
+# Sections the prompt requires in the closing debrief (text/prompt.txt, Output Format).
+DEBRIEF_SECTIONS = ("attack steps", "improvements")
+
+
+def _reactions_respected(log: utils.SessionLog, reactions: int) -> bool:
+    """
+    Checks the adversary's own output against the reaction budget, independently
+    of the router (which decides turn types from the same counter).
+
+    Structured moves must be numbered upwards from 1 without exceeding the
+    budget, with reactions_remaining never negative and never rising. When a
+    reply presents the debrief, it must not answer more than `reactions`
+    defender actions, and no later reply may make another structured move.
+    """
+    numbers = [move.move_number for move in log.moves]
+    remaining = [move.reactions_remaining for move in log.moves]
+    if numbers and (
+        numbers[0] < 1 or max(numbers) > reactions or any(b <= a for a, b in zip(numbers, numbers[1:]))
+        or min(remaining) < 0 or any(b > a for a, b in zip(remaining, remaining[1:]))
+    ):
+        return False
+    replies = [
+        turn for turn in log.turns
+        if turn.role == "model" and not turn.metadata.get("cancelled") and not turn.metadata.get("error")
+    ]
+    for position, turn in enumerate(replies):
+        if all(section in turn.text.lower() for section in DEBRIEF_SECTIONS):
+            # The first reply sets up the scenario; each later one answers a defender action.
+            answered = position
+            later_moves = any("move_index" in later.metadata for later in replies[position + 1:])
+            return answered <= reactions and not later_moves
+    return True
+
+
+def scenario_checks(log: utils.SessionLog, profile: Dict[str, Any], reactions: int) -> Dict[str, Any]:
+    """
+    Basic coherence checks on a finished session.
+
+    - reactions_respected: the adversary's moves and debrief stay within the
+      requested reactions (see _reactions_respected).
+    - debrief_reached: the session produced a debrief turn.
+    - profile_assets_only: no asset from another company profile is referenced,
+      and every structured move targets an asset of this profile.
+    - moves_on_graph: every structured move passed the attack-graph check.
+
+    With --fork, Gemini sessions add fork_context_cache (see fork_check).
+    """
+    own_assets = set(_asset_names(profile))
+    foreign_assets = {
+        name for other in utils.PROFILES if other.get("company_name") != profile.get("company_name")
+        for name in _asset_names(other) if name not in own_assets
+    }
+    model_text = "\n".join(turn.text for turn in log.turns if turn.role == "model").lower()
+    foreign_refs = sorted(name for name in foreign_assets if name.lower() in model_text)
+    bad_targets = sorted({move.target_asset for move in log.moves if move.target_asset not in own_assets})
+    return {
+        "reactions_respected": _reactions_respected(log, reactions),
+        "debrief_reached": any(
+            turn.metadata.get("routing", {}).get("turn_type") == routing.DEBRIEF for turn in log.turns
+        ),
+        "profile_assets_only": not foreign_refs and not bad_targets,
+        "profile_assets_referenced": sorted(name for name in own_assets if name.lower() in model_text),
+        "foreign_assets_referenced": foreign_refs + bad_targets,
+        "moves_on_graph": all(
+            turn.metadata["move_check"]["valid"] for turn in log.turns if turn.metadata.get("move_check")
+        ),
+    }
+
+
+def fork_check(log: utils.SessionLog, company_profile: str, structured: bool) -> Tuple[bool, float]:
+    """
+    Forks a finished Gemini session before its first defender action and plays
+    FORK_ACTION there instead, with the default grounding mode.
+
+    Returns:
+        tuple[bool, float]: Whether the fork's turn ran on a context cache, and its latency.
+    """
+    import forks
+    import gemini
+
+    turn_index = [index for index, turn in enumerate(log.turns) if turn.role == "user"][1]
+    child, history = forks.fork(log, gemini.conversation_history, turn_index)
+    started = time.perf_counter()
+    gemini.generate(FORK_ACTION, company_profile, child, structured=structured, history=history)
+    return bool(child.turns[-1].metadata.get("context_cache")), time.perf_counter() - started
+
+
+def run_session(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Plays one synthetic session. Runs inside a worker process.
+
+    Args:
+        spec (dict): backend, provider, company, difficulty, reactions, persona, structured and fork.
+
+    Returns:
+        dict: Per-turn latencies, errors and scenario check results.
+    """
+    os.environ["DASE_PROVIDER"] = spec["provider"]
+    # Imported here so each worker process builds its own backend state.
+    import gemini
+    import local_llm
+    import openai_helper
+    import scheduler
+
+    company_name = spec["company"]
+    with open(utils.COMPANY_MAP[company_name], "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    profile_str = json.dumps(profile, indent=2)
+    difficulty, reactions = spec["difficulty"], spec["reactions"]
+
+    if spec["backend"] == "gemini":
+        handler = gemini
+        gemini.conversation_history.clear()
+        log = utils.SessionLog()
+        log.add_metadata("company_name", company_name)
+        log.add_metadata("difficulty", difficulty)
+        log.add_metadata("reactions", reactions)
+        log.add_metadata("model", "Google Gemini")
+        opening = (
+            f"{OPENING}\nThe user desires this level of technical difficulty: {difficulty} "
+            f"and this number of reactions {reactions}. The company to perform the exercise on is {company_name}."
+        )
+    elif spec["backend"] == "local":
+        handler = local_llm
+        # No background prefill, so every backend starts its sessions cold.
+        local_llm.reset_session(difficulty, reactions, profile_str, company_name, warm=False)
+        log = local_llm.session_log
+        opening = OPENING
+    else:
+        handler = openai_helper
+        openai_helper.reset_session(difficulty, reactions, profile_str, company_name)
+        log = openai_helper.session_log
+        opening = OPENING
+
+    persona = PERSONAS[spec["persona"]]()
+    latencies, errors = [], []
+    message, last_reply = opening, ""
+    started = time.perf_counter()
+    # One setup turn, then one defender action per reaction (the last yields the debrief).
+    for _ in range(reactions + 1):
+        turn_started = time.perf_counter()
+        try:
+            last_reply, _ = handler.generate(message, profile_str, log, structured=spec["structured"])
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            break
+        # The OpenAI client reports API failures in the reply; the turn metadata flags them.
+        if log.turns[-1].metadata.get("error"):
+            errors.append(log.turns[-1].metadata["error"])
+            break
+        latencies.append(time.perf_counter() - turn_started)
+        message = persona.next_action(last_reply)
+
+    checks = scenario_checks(log, profile, reactions)
+    fork_latencies = []
+    if spec.get("fork") and spec["backend"] == "gemini" and not errors and len(latencies) > 1:
+        try:
+            checks["fork_context_cache"], fork_latency_s = fork_check(log, profile_str, spec["structured"])
+            fork_latencies.append(round(fork_latency_s, 4))
+        except Exception as e:
+            errors.append(f"fork: {type(e).__name__}: {e}")
+            checks["fork_context_cache"] = False
+
+    return {
+        "index": spec["index"],
+        "backend": spec["backend"],
+        "company": company_name,
+        "turns": len(latencies),
+        "attempted_turns": len(latencies) + len(errors),
+        "latencies_s": [round(value, 4) for value in latencies],
+        "errors": errors,
+        "duration_s": round(time.perf_counter() - started, 4),
+        "scheduler_wait_s": [
+            turn.metadata["scheduler_wait_s"] for turn in log.turns if "scheduler_wait_s" in turn.metadata
+        ],
+        "output_tokens": [
+            turn.metadata.get("usage", {}).get("output_tokens", 0) + turn.metadata.get("usage", {}).get("reasoning_tokens", 0)
+            for turn in log.turns if turn.role == "model"
+        ],
+        "decode_tokens_per_s": [
+            turn.metadata["local"]["tokens_per_s"] for turn in log.turns if turn.metadata.get("local", {}).get("tokens_per_s")
+        ],
+        "debrief_latency_s": [
+            turn.metadata["latency_s"] for turn in log.turns
+            if turn.metadata.get("routing", {}).get("turn_type") == routing.DEBRIEF and "latency_s" in turn.metadata
+        ],
+        "fork_latency_s": fork_latencies,
+        "checks": checks,
+        "worker_pid": os.getpid(),
+        "scheduler": scheduler.metrics(),  # cumulative for the worker process
+    }
+
+
+def summarize(results: List[Dict[str, Any]], wall_time_s: float) -> Dict[str, Any]:
+    """Aggregates session results into throughput, latency, error and check metrics."""
+    latencies = [value for result in results for value in result["latencies_s"]]
+    waits = [value for result in results for value in result.get("scheduler_wait_s", [])]
+    output_tokens = sum(value for result in results for value in result.get("output_tokens", []))
+    decode_rates = [value for result in results for value in result.get("decode_tokens_per_s", [])]
+    debriefs = [value for result in results for value in result.get("debrief_latency_s", [])]
+    fork_latencies = [value for result in results for value in result.get("fork_latency_s", [])]
+    turns = sum(result["turns"] for result in results)
+    attempted = sum(result["attempted_turns"] for result in results)
+    errors = sum(len(result["errors"]) for result in results)
+    check_names = ("reactions_respected", "debrief_reached", "profile_assets_only", "moves_on_graph", "fork_context_cache")
+    return {
+        "sessions": len(results),
+        "turns": turns,
+        "errors": errors,
+        "error_rate": errors / attempted if attempted else 0.0,
+        "wall_time_s": round(wall_time_s, 3),
+        "turns_per_s": turns / wall_time_s if wall_time_s else 0.0,
+        "latency_s": {
+            "mean": mean(latencies) if latencies else None,
+            "p50": budget.percentile(latencies, 0.5),
+            "p90": budget.percentile(latencies, 0.9),
+            "p99": budget.percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        # Output tokens per second of turn latency, comparable across backends.
+        "output_tokens_per_s": output_tokens / sum(latencies) if latencies else None,
+        "decode_tokens_per_s": mean(decode_rates) if decode_rates else None,
+        # The closing turn, which background debrief drafts (debrief.py) shorten.
+        "debrief_latency_s": {
+            "mean": mean(debriefs) if debriefs else None,
+            "p90": budget.percentile(debriefs, 0.9),
+        },
+        "fork_latency_s": {
+            "mean": mean(fork_latencies) if fork_latencies else None,
+            "p90": budget.percentile(fork_latencies, 0.9),
+        },
+        "scheduler_wait_s": {
+            "mean": mean(waits) if waits else None,
+            "p90": budget.percentile(waits, 0.9),
+            "max": max(waits) if waits else None,
+        },
+        "checks": {
+            name: {
+                "passed": sum(1 for result in results if result["checks"].get(name) is True),
+                "failed": sum(1 for result in results if result["checks"].get(name) is False),
+            }
+            for name in check_names
+            if any(name in result["checks"] for result in results)
+        },
+    }
+
+
+def scheduler_report(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Collects the workers' scheduler metrics from session results (removing them
+    from the results). Metrics are cumulative per worker, so each worker's
+    latest snapshot is kept.
+    """
+    workers: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        metrics, pid = result.pop("scheduler", None), str(result.pop("worker_pid", ""))
+        if metrics and metrics["admitted"] >= workers.get(pid, {}).get("admitted", -1):
+            workers[pid] = metrics
+    return {
+        "scope": "per worker process",
+        "admitted": sum(metrics["admitted"] for metrics in workers.values()),
+        "throttled": sum(metrics["throttled"] for metrics in workers.values()),
+        "penalties": sum(metrics["penalties"] for metrics in workers.values()),
+        "workers": workers,
+    }
+
+
+def run_load(
+    sessions: int,
+    concurrency: int,
+    backends: List[str],
+    provider: str = "mock",
+    persona: str = "rules",
+    companies: List[str] | None = None,
+    difficulty: str = "medium",
+    reactions: int = 3,
+    structured: bool = False,
+    fork: bool = False,
+) -> Dict[str, Any]:
+    """
+    Runs `sessions` synthetic sessions per backend with `concurrency` worker processes.
+
+    Returns:
+        dict: The report, overall and per backend, the workers' scheduler metrics and per-session results.
+    """
+    companies = companies or list(utils.COMPANY_MAP)
+    specs = [
+        {
+            "index": index,
+            "backend": backend,
+            "provider": provider,
+            "company": companies[index % len(companies)],
+            "difficulty": difficulty,
+            "reactions": reactions,
+            "persona": persona,
+            "structured": structured,
+            "fork": fork,
+        }
+        for backend in backends
+        for index in range(sessions)
+    ]
+    results = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_session, spec) for spec in specs]
+        for future in as_completed(futures):
+            results.append(future.result())
+    wall_time_s = time.perf_counter() - started
+
+    results.sort(key=lambda result: (result["backend"], result["index"]))
+    scheduler_metrics = scheduler_report(results)
+    return {
+        "config": {
+            "sessions": sessions,
+            "concurrency": concurrency,
+            "backends": backends,
+            "provider": provider,
+            "persona": persona,
+            "companies": companies,
+            "difficulty": difficulty,
+            "reactions": reactions,
+            "structured": structured,
+            "fork": fork,
+        },
+        "overall": summarize(results, wall_time_s),
+        "by_backend": {
+            backend: summarize([r for r in results if r["backend"] == backend], wall_time_s)
+            for backend in backends
+        },
+        "scheduler": scheduler_metrics,
+        "session_results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run synthetic trainee sessions against DASE backends.")
+    parser.add_argument("--sessions", type=int, default=10, help="Sessions per backend.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent sessions (worker processes).")
+    parser.add_argument("--backend", choices=BACKENDS + ("all",), default="gemini")
+    parser.add_argument("--provider", choices=("mock", "real"), default="mock")
+    parser.add_argument("--persona", choices=tuple(PERSONAS), default="rules")
+    parser.add_argument("--company", action="append", choices=list(utils.COMPANY_MAP),
+                        help="Company to use (repeatable); defaults to cycling through all.")
+    parser.add_argument("--difficulty", choices=("low", "medium", "high"), default="medium")
+    parser.add_argument("--reactions", type=int, default=3)
+    parser.add_argument("--structured", action="store_true", help="Request structured adversary moves.")
+    parser.add_argument("--fork", action="store_true",
+                        help="Also fork each Gemini session at its first defender action and check it reuses a context cache.")
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args()
+
+    backends = list(BACKENDS) if args.backend == "all" else [args.backend]
+    report = run_load(
+        args.sessions, args.concurrency, backends, args.provider, args.persona,
+        args.company, args.difficulty, args.reactions, args.structured, args.fork,
+    )
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        overall = report["overall"]
+        print(f"{overall['turns']} turns in {overall['wall_time_s']} s "
+              f"({overall['turns_per_s']:.2f} turns/s), error rate {overall['error_rate']:.1%}. "
+              f"Report written to {args.out}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+import budget
+import cancellation
+import debrief
+import forks
+import moves
+import perf
+import providers
+import retrieval
+import routing
+import scheduler
+import utils
+"""
+Local CPU model backend for DASE.
+
+Talks to an OpenAI-compatible chat completions server on localhost (for
+example llama.cpp's llama-server with a quantized GGUF model), so sessions run
+on air-gapped ranges and without a cloud round trip. The interface matches
+gemini.generate and openai_helper.generate.
+
+The system message (base prompt, session settings and the full company
+profile) is identical on every turn and the conversation only grows, so each
+request extends the previous one and the server can reuse its KV cache
+(cache_prompt). reset_session prefills that prefix in the background and
+warm_up loads the model at application start. With the attack graph on, the
+prefix carries the graph summary instead of the adversary_training_brief and
+the adversary's current position goes with each user message.
+
+Every turn records time to first token, decode tokens/sec and the number of
+prompt tokens served from the cache.
+
+Configuration (environment variables):
+    DASE_LOCAL_BASE_URL     server URL (default http://127.0.0.1:8080/v1)
+    DASE_LOCAL_MODEL        model name sent to the server
+    DASE_LOCAL_WARMUP       load the model at startup (default 1 when DASE_LOCAL_BASE_URL
+                            is set, otherwise 0, so cloud-only setups never probe localhost)
+    DASE_LOCAL_CACHE_PROMPT ask the server to reuse the prompt KV cache (default 1)
+"""
+load_dotenv()
+
+LABEL = "Local model (CPU)"
+WARMUP = os.getenv("DASE_LOCAL_WARMUP", "1" if os.getenv("DASE_LOCAL_BASE_URL") else "0").strip().lower() in ("1", "true", "yes", "on")
+CACHE_PROMPT = os.getenv("DASE_LOCAL_CACHE_PROMPT", "1").strip().lower() in ("1", "true", "yes", "on")
+PROMPT_PATH = os.path.join(utils.DATA_DIR, "text", "prompt.txt")
+
+conversation_history = forks.History()  # chat messages after the system message
+session_log = utils.SessionLog()
+
+def client():
+    """Returns the shared client for the local server (see providers.py)."""
+    return providers.local_client()
+
+
+def system_prompt(company_profile: str, log: utils.SessionLog) -> str:
+    """The static per-session prefix: base prompt, session settings and the full profile."""
+    index = retrieval.index_for(company_profile)
+    profile_text = index.static_text() if index and index.graph else company_profile
+    return (
+        f"{utils.read_from_file(PROMPT_PATH)}\n"
+        f"The user desires this level of technical difficulty: {log.metadata.get('difficulty', 'medium')}. "
+        f"The number of requested reactions is {log.metadata.get('reactions', 1)}. "
+        f"The company to perform the exercise on is {log.metadata.get('company_name', '')}.\n"
+        f"Company profile:\n{profile_text}"
+    )
+
+
+def _graph_state(company_profile: str, history: List[Dict[str, str]]) -> str:
+    """The adversary's current position in the attack graph, for the next user message."""
+    index = retrieval.index_for(company_profile)
+    if index is None or index.graph is None:
+        return ""
+    replies = [message["content"] for message in history if message["role"] == "assistant"]
+    return index.graph.state(index.graph.footholds(replies))
+
+
+def _extra_body() -> Dict[str, Any]:
+    return {"cache_prompt": True} if CACHE_PROMPT else {}
+
+
+def _extra(chunk, name: str):
+    """Non-standard fields such as llama.cpp's `timings`, on SDK objects or namespaces."""
+    value = getattr(chunk, name, None)
+    if value is None:
+        value = (getattr(chunk, "model_extra", None) or {}).get(name)
+    return value
+
+
+def _field(value, name: str):
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+
+def warm_up() -> bool:
+    """
+    Loads the model on the local server with a one-token request.
+
+    Returns:
+        bool: True when the server answered.
+    """
+    model = routing.MODEL_TIERS["local"]["full"]
+    scheduler.acquire("local", model, scheduler.estimate_tokens("Ready?") + 1, priority=scheduler.BACKGROUND)
+    try:
+        client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "Ready?"}],
+            max_tokens=1,
+        )
+        return True
+    except Exception as e:
+        if scheduler.is_rate_limit_error(e):
+            scheduler.penalize("local", model)
+        print(f"Local model server not reachable; skipping warm-up ({e}).")
+        return False
+
+
+def prefill(company_profile: str, log: utils.SessionLog) -> None:
+    """Processes the session's system prompt once so later turns start from the cached prefix."""
+    model = routing.MODEL_TIERS["local"]["full"]
+    prompt = system_prompt(company_profile, log)
+    scheduler.acquire("local", model, scheduler.estimate_tokens(prompt) + 1, log.session_id, scheduler.BACKGROUND)
+    try:
+        client().chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=1,
+            extra_body=_extra_body(),
+        )
+    except Exception as e:
+        if scheduler.is_rate_limit_error(e):
+            scheduler.penalize("local", model)
+        print(f"Local prompt prefill failed: {e}")
+
+
+def reset_session(difficulty: str, reactions: int, company_profile: str, company_name: str, warm: bool = True) -> None:
+    """
+    Prepare a new local session and initialize metadata for logging.
+
+    Args:
+        warm (bool): Prefill the session prefix on the server in the background.
+    """
+    global session_log
+    conversation_history.clear()
+    session_log = utils.SessionLog()
+    session_log.add_metadata("company_name", company_name)
+    session_log.add_metadata("difficulty", difficulty)
+    session_log.add_metadata("reactions", reactions)
+    session_log.add_metadata("model", LABEL)
+    if warm:
+        threading.Thread(target=prefill, args=(company_profile, session_log), daemon=True).start()
+
+
+def generate(
+    user_input: str,
+    company_profile: str,
+    log: utils.SessionLog,
+    structured: bool | None = None,
+    on_update=None,
+    cancel=None,
+    history: List[Dict[str, str]] | None = None,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Send one turn to the local model and record it in the session log.
+
+    Args:
+        user_input (str): The trainee's message.
+        company_profile (str): The company profile as a JSON string.
+        log (SessionLog): Session log receiving the turns.
+        structured (bool | None): Overrides moves.STRUCTURED_MOVES; only adversary moves are structured.
+        on_update (Callable[[str], None] | None): Called with the reply rendered so far while streaming.
+        cancel (CancelToken | None): Aborts the request when cancelled.
+        history (History | list[dict] | None): Conversation to continue; defaults to the module's
+            conversation_history. A fork sends its parent's prefix unchanged, so the server reuses its cache.
+
+    Returns:
+        tuple[str, list]: The reply text and an empty list (no raw chunks are kept).
+
+    Raises:
+        GenerationCancelled: When `cancel` fired; the partial turn is logged as cancelled.
+    """
+    if history is None:
+        history = conversation_history
+    decision = routing.route_turn(log, "local", user_input)
+    if structured is None:
+        structured = moves.STRUCTURED_MOVES
+    structured = structured and decision.turn_type == routing.ADVERSARY_MOVE
+    plan = debrief.prepare(log, decision.turn_type)
+    max_tokens = budget.OUTPUT_CAPS.get(
+        routing.ADVERSARY_MOVE if plan and plan.complete else decision.turn_type, budget.OUTPUT_CAPS[routing.ADVERSARY_MOVE]
+    )
+
+    # The graph state and the structured instruction go with the user message
+    # so the system prefix stays byte-identical and cacheable across turns.
+    parser = None
+    state = _graph_state(company_profile, history)
+    content = f"{user_input}\n\n{state}" if state else user_input
+    if plan:
+        content = f"{content}\n\n{plan.instruction}"
+    request: Dict[str, Any] = {}
+    if structured:
+        parser = moves.IncrementalJSONParser()
+        content = f"{content}\n\n{moves.STRUCTURED_INSTRUCTION}"
+        try:
+            profile = json.loads(company_profile)
+        except json.JSONDecodeError:
+            profile = {}
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": moves.SCHEMA_NAME, "schema": moves.json_schema(profile), "strict": True},
+        }
+
+    system = system_prompt(company_profile, log)
+    history.append({"role": "user", "content": content})
+    log.add_turn("user", user_input)
+    messages = [{"role": "system", "content": system}, *history]
+
+    full_response = ""
+    usage, timings = None, None
+    first_token_at = None
+    started = time.perf_counter()
+    scheduler_wait_s = scheduler.acquire(
+        "local", decision.model,
+        scheduler.estimate_tokens(*(message["content"] for message in messages)) + max_tokens,
+        log.session_id,
+    )
+    perf.mark(perf.WAITING)
+    try:
+        if cancel:
+            cancel.raise_if_cancelled()
+        stream = client().chat.completions.create(
+            model=decision.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_body=_extra_body(),
+            **request,
+        )
+        if cancel:
+            cancel.on_cancel(getattr(stream, "close", None))
+        for chunk in stream:
+            if cancel:
+                cancel.raise_if_cancelled()
+            usage = getattr(chunk, "usage", None) or usage
+            timings = _extra(chunk, "timings") or timings
+            for choice in chunk.choices or []:
+                text = getattr(choice.delta, "content", None)
+                if not text:
+                    continue
+                perf.mark(perf.STREAMING)
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                full_response += text
+                if parser:
+                    parser.feed(text)
+                if on_update:
+                    on_update(moves.render(parser.fields) if parser else full_response)
+    except Exception:
+        # Roll back the trainee's message so the next turn does not see it twice.
+        if history and history[-1]["role"] == "user":
+            history.pop()
+        if not (cancel and cancel.cancelled):
+            raise
+        log.add_turn("model", full_response, [], {
+            "cancelled": True,
+            "routing": decision.model_dump(),
+            "latency_s": round(time.perf_counter() - started, 3),
+            "scheduler_wait_s": round(scheduler_wait_s, 3),
+        })
+        raise cancellation.GenerationCancelled(full_response)
+    perf.mark(perf.FINISHING)
+    finished = time.perf_counter()
+    latency_s = finished - started
+
+    output_tokens = _field(usage, "completion_tokens") or _field(timings, "predicted_n") or scheduler.estimate_tokens(full_response)
+    decode_s = finished - first_token_at if first_token_at else None
+    details = _field(usage, "prompt_tokens_details")
+    local_stats = {
+        "time_to_first_token_s": round(first_token_at - started - scheduler_wait_s, 3) if first_token_at else None,
+        "tokens_per_s": round(_field(timings, "predicted_per_second") or (output_tokens / decode_s if decode_s else 0.0), 2),
+        "prompt_tokens_per_s": round(_field(timings, "prompt_per_second") or 0.0, 2) or None,
+        "prompt_cached_tokens": _field(timings, "cache_n") or _field(details, "cached_tokens"),
+    }
+
+    turn_metadata = {}
+    if parser:
+        move = moves.parse_move(full_response)
+        if move:
+            full_response = moves.render(move.model_dump())
+            turn_metadata["move_check"] = moves.check_move(move, profile, log.moves)
+            turn_metadata["move_index"] = log.add_move(move)
+        else:
+            turn_metadata["structured_error"] = "Reply did not match the adversary move schema."
+    if plan:
+        full_response = debrief.stitch(full_response, plan)
+        turn_metadata["debrief"] = debrief.summary(plan)
+
+    history.append({"role": "assistant", "content": full_response})
+    log.add_turn("model", full_response, [], {
+        **turn_metadata,
+        "routing": decision.model_dump(),
+        "max_output_tokens": max_tokens,
+        "latency_s": round(latency_s, 3),
+        "scheduler_wait_s": round(scheduler_wait_s, 3),
+        "usage": {
+            key: value for key, value in {
+                "input_tokens": _field(usage, "prompt_tokens"),
+                "output_tokens": output_tokens,
+            }.items() if value
+        },
+        "local": local_stats,
+    })
+    if decision.turn_type == routing.ADVERSARY_MOVE:
+        debrief.draft_in_background(log, "local", company_profile)
+    return full_response, []
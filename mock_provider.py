@@ -0,0 +1,250 @@
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List
+
+from google.genai import types
+"""
+Local mock LLM provider for offline and load testing.
+
+The mock clients expose the small subset of the google-genai and OpenAI SDK
+surface that DASE uses (including the chat completions API of the local
+backend), so gemini.generate, openai_helper.generate and local_llm.generate
+run their normal code paths without network access. Replies are rule-based
+adversary moves that reference assets from the exercise's company profile.
+
+Tuning (environment variables):
+    DASE_MOCK_FIRST_TOKEN_S   delay before the first chunk (default 0.2)
+    DASE_MOCK_CHUNK_S         delay between chunks (default 0.02)
+    DASE_MOCK_ERROR_RATE      probability that a request fails (default 0)
+"""
+
+CHUNK_CHARS = 40
+
+
+def _settings() -> Dict[str, float]:
+    return {
+        "first_token_s": float(os.getenv("DASE_MOCK_FIRST_TOKEN_S", "0.2")),
+        "chunk_s": float(os.getenv("DASE_MOCK_CHUNK_S", "0.02")),
+        "error_rate": float(os.getenv("DASE_MOCK_ERROR_RATE", "0")),
+    }
+
+
+class MockProviderError(RuntimeError):
+    """Raised when the mock injects a provider failure or rejects a request the real API would."""
+
+
+def _find_profile(text: str) -> Dict[str, Any]:
+    """Finds the first JSON object containing a company_name in a prompt."""
+    decoder = json.JSONDecoder()
+    index = text.find("{")
+    while index != -1:
+        try:
+            value, _ = decoder.raw_decode(text, index)
+            if isinstance(value, dict) and "company_name" in value:
+                return value
+        except json.JSONDecodeError:
+            pass
+        index = text.find("{", index + 1)
+    return {}
+
+
+def compose_reply(
+    profile: Dict[str, Any],
+    turn_number: int,
+    schema: Dict[str, Any] | None = None,
+    reactions_remaining: int = 0,
+) -> str:
+    """
+    Builds a deterministic adversary reply for a turn.
+
+    Args:
+        profile (dict): The company profile found in the prompt.
+        turn_number (int): 1-based number of the user turn being answered.
+        schema (dict | None): Response JSON schema when a structured move is requested.
+        reactions_remaining (int): Value reported in structured moves.
+
+    Returns:
+        str: Reply text, or JSON when a schema is given.
+    """
+    assets = [a.get("asset") for a in profile.get("key_digital_assets", []) if a.get("asset")] or ["the corporate network"]
+    brief = profile.get("adversary_training_brief", {})
+    vectors = brief.get("likely_initial_access") or ["phishing"]
+    company = profile.get("company_name", "the company")
+    asset = assets[turn_number % len(assets)]
+    vector = vectors[turn_number % len(vectors)]
+
+    if schema is not None:
+        return json.dumps({
+            "move_number": max(1, turn_number - 1),
+            "attack_technique": "T1566.002 Spearphishing Link",
+            "target_asset": asset,
+            "narrative": f"Using {vector.lower()}, the adversary moves against {asset} at {company}.",
+            "reactions_remaining": reactions_remaining,
+        })
+    if turn_number == 1:
+        return (
+            f"Welcome to DASE. The exercise will target {company}. "
+            "What type of attack would you like to simulate?"
+        )
+    return (
+        f"Adversary move {turn_number - 1}: using {vector.lower()}, the attacker probes {asset}. "
+        f"Defenders at {company} notice unusual activity around {asset}."
+    )
+
+
+def _pace(text: str) -> Iterator[str]:
+    """Yields the reply in chunks with the configured delays, or fails on purpose."""
+    settings = _settings()
+    time.sleep(settings["first_token_s"])
+    if random.random() < settings["error_rate"]:
+        raise MockProviderError("429 RESOURCE_EXHAUSTED (mock)")
+    for start in range(0, len(text), CHUNK_CHARS):
+        if start:
+            time.sleep(settings["chunk_s"])
+        yield text[start:start + CHUNK_CHARS]
+
+
+def _usage(prompt: str, reply: str) -> Dict[str, int]:
+    return {"input_tokens": len(prompt) // 4, "output_tokens": len(reply) // 4}
+
+
+# --- Gemini ---
+
+_gemini_caches: Dict[str, types.CreateCachedContentConfig] = {}  # context caches by name
+
+def _gemini_chunk(text: str) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]))]
+    )
+
+
+class _MockGeminiModels:
+    def _reply(self, contents: List[types.Content], config: types.GenerateContentConfig | None) -> str:
+        system = ""
+        schema = getattr(config, "response_json_schema", None) if config else None
+        cached = _gemini_caches.get(config.cached_content) if config and config.cached_content else None
+        if cached:
+            if config.system_instruction or config.tools or config.tool_config:
+                # Same restriction as the real API: the cache owns these.
+                raise MockProviderError(
+                    "CachedContent can not be used with GenerateContent request setting system_instruction, tools or tool_config."
+                )
+            # Requests on a cache continue its prompt and turns.
+            contents = list(cached.contents or []) + contents
+            config = cached
+        if config and config.system_instruction:
+            parts = config.system_instruction if isinstance(config.system_instruction, list) else [config.system_instruction]
+            system = "".join(getattr(part, "text", str(part)) or "" for part in parts)
+        turn_number = sum(1 for content in contents if getattr(content, "role", "user") == "user"
+                          and any(part.text for part in content.parts or []))
+        return compose_reply(_find_profile(system), turn_number, schema)
+
+    def generate_content_stream(self, model: str, contents, config=None) -> Iterator[types.GenerateContentResponse]:
+        reply = self._reply(list(contents), config)
+        for piece in _pace(reply):
+            yield _gemini_chunk(piece)
+        prompt = "".join(part.text or "" for content in contents for part in getattr(content, "parts", None) or [])
+        counts = _usage(prompt, reply)
+        yield types.GenerateContentResponse(usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=counts["input_tokens"],
+            candidates_token_count=counts["output_tokens"],
+        ))
+
+    def generate_content(self, model: str, contents, config=None) -> types.GenerateContentResponse:
+        if isinstance(contents, str):
+            return _gemini_chunk("".join(_pace(f"Mock search results for: {contents[:80]}")))
+        reply = self._reply(list(contents), config)
+        return _gemini_chunk("".join(_pace(reply)))
+
+
+class _MockGeminiCaches:
+    def create(self, model: str, config: types.CreateCachedContentConfig | None = None) -> types.CachedContent:
+        name = f"cachedContents/mock-{random.getrandbits(48):012x}"
+        _gemini_caches[name] = config or types.CreateCachedContentConfig()
+        return types.CachedContent(name=name, model=model)
+
+
+class MockGeminiClient:
+    """Stands in for google.genai.Client."""
+
+    def __init__(self, **kwargs):
+        self.models = _MockGeminiModels()
+        self.caches = _MockGeminiCaches()
+
+    def close(self) -> None:
+        pass
+
+
+# --- OpenAI ---
+
+_openai_responses: Dict[str, tuple] = {}  # response id -> (profile, turn number), for previous_response_id
+
+class _MockResponses:
+    def create(self, stream: bool = False, input: str = "", text: Dict[str, Any] | None = None,
+               previous_response_id: str | None = None, **kwargs):
+        previous = _openai_responses.get(previous_response_id)
+        if previous:
+            # A chained request carries only the new turn.
+            profile, turn_number = previous[0], previous[1] + 1
+        else:
+            profile, turn_number = _find_profile(input), input.count("\nUser: ")
+        schema = (text or {}).get("format", {}).get("schema")
+        reply = compose_reply(profile, turn_number, schema)
+        usage = SimpleNamespace(**_usage(input, reply))
+        response_id = f"mock_{random.getrandbits(48):012x}"
+        _openai_responses[response_id] = (profile, turn_number)
+        if not stream:
+            return SimpleNamespace(id=response_id, output_text="".join(_pace(reply)), usage=usage)
+        return self._stream(reply, usage, response_id)
+
+    @staticmethod
+    def _stream(reply: str, usage, response_id: str):
+        for piece in _pace(reply):
+            yield SimpleNamespace(type="response.output_text.delta", delta=piece)
+        yield SimpleNamespace(
+            type="response.completed",
+            response=SimpleNamespace(id=response_id, output_text=reply, usage=usage),
+        )
+
+
+class _MockChatCompletions:
+    """Chat completions as served by an OpenAI-compatible local server."""
+
+    def create(self, messages: List[Dict[str, str]], stream: bool = False, response_format=None,
+               max_tokens: int | None = None, **kwargs):
+        system = "".join(message["content"] for message in messages if message["role"] == "system")
+        prompt = "".join(message["content"] for message in messages)
+        turn_number = sum(1 for message in messages if message["role"] == "user")
+        schema = ((response_format or {}).get("json_schema") or {}).get("schema")
+        reply = compose_reply(_find_profile(system), turn_number, schema)
+        if max_tokens is not None and max_tokens <= 1:
+            reply = reply[:4]
+        counts = _usage(prompt, reply)
+        usage = SimpleNamespace(prompt_tokens=counts["input_tokens"], completion_tokens=counts["output_tokens"])
+        if not stream:
+            message = SimpleNamespace(role="assistant", content="".join(_pace(reply)))
+            return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")], usage=usage)
+        return self._stream(reply, usage)
+
+    @staticmethod
+    def _stream(reply: str, usage):
+        for piece in _pace(reply):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=piece), finish_reason=None)],
+                usage=None,
+            )
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class MockOpenAIClient:
+    """Stands in for openai.OpenAI (Responses API and chat completions)."""
+
+    def __init__(self, **kwargs):
+        self.responses = _MockResponses()
+        self.chat = SimpleNamespace(completions=_MockChatCompletions())
+
+    def close(self) -> None:
+        pass
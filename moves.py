@@ -0,0 +1,253 @@
+import json
+import os
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+import attack_graph
+import utils
+"""
+Structured adversary-move output for DASE.
+
+When enabled, adversary-move turns are requested as JSON matching a schema
+built from the company profile, streamed through an incremental parser so the
+GUI can render each field as it arrives, and stored in the SessionLog as typed
+AdversaryMove records.
+"""
+load_dotenv()
+
+STRUCTURED_MOVES = os.getenv("DASE_STRUCTURED_MOVES", "").strip().lower() in ("1", "true", "yes", "on")
+
+SCHEMA_NAME = "adversary_move"
+
+STRUCTURED_INSTRUCTION = (
+    "For this turn, reply only with a JSON object describing your next adversary move: "
+    "the move number, the MITRE ATT&CK technique used (ID and name), the targeted asset "
+    "exactly as named in key_digital_assets, the narrative shown to the defenders, and "
+    "the number of reactions remaining after this move."
+)
+
+# Field order matters: models emit properties in schema order, so the short
+# fields render before the narrative.
+FIELD_LABELS = {
+    "move_number": "Move",
+    "attack_technique": "Technique",
+    "target_asset": "Target",
+    "narrative": "",
+    "reactions_remaining": "Reactions remaining",
+}
+
+
+def asset_names(profile: Dict[str, Any]) -> List[str]:
+    """Returns the asset names listed in a profile's key_digital_assets."""
+    return [asset.get("asset", "") for asset in profile.get("key_digital_assets", []) if asset.get("asset")]
+
+
+def json_schema(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the JSON schema for one adversary move against a company profile.
+
+    Args:
+        profile (dict): The company profile; its assets become the allowed targets.
+
+    Returns:
+        dict: A strict JSON schema usable by both OpenAI and Gemini.
+    """
+    target = {"type": "string", "description": "Asset from key_digital_assets targeted by this move."}
+    names = asset_names(profile)
+    if names:
+        target["enum"] = names
+    return {
+        "type": "object",
+        "properties": {
+            "move_number": {"type": "integer", "description": "1-based number of this adversary move."},
+            "attack_technique": {
+                "type": "string",
+                "description": "MITRE ATT&CK technique ID and name, e.g. 'T1566.002 Spearphishing Link'.",
+            },
+            "target_asset": target,
+            "narrative": {"type": "string", "description": "What the defenders observe and what the adversary attempts."},
+            "reactions_remaining": {"type": "integer", "description": "Reactions left after this move."},
+        },
+        "required": list(FIELD_LABELS),
+        "additionalProperties": False,
+    }
+
+
+def render(fields: Dict[str, Any]) -> str:
+    """Renders (possibly partial) move fields as display text."""
+    lines = []
+    for name, label in FIELD_LABELS.items():
+        if name not in fields:
+            continue
+        value = fields[name]
+        lines.append(f"{label}: {value}" if label else f"\n{value}\n")
+    return "\n".join(lines).strip()
+
+
+def parse_move(text: str) -> utils.AdversaryMove | None:
+    """Parses a complete JSON reply into an AdversaryMove, or None if it is invalid."""
+    try:
+        return utils.AdversaryMove.model_validate_json(text)
+    except ValidationError:
+        return None
+
+
+def check_move(move: utils.AdversaryMove, profile: Dict[str, Any], previous_moves: List[utils.AdversaryMove]) -> Dict[str, Any] | None:
+    """
+    Validates a parsed move against the company's attack graph, without another model call.
+
+    Args:
+        move (AdversaryMove): The move the model proposed.
+        profile (dict): The company profile of the session.
+        previous_moves (list[AdversaryMove]): Moves already in the session log.
+
+    Returns:
+        dict | None: The MoveCheck as a dict, or None for an empty profile.
+    """
+    if not profile:
+        return None
+    graph = utils.get_attack_graph(profile.get("company_name", "")) or attack_graph.compile_profile(profile)
+    check = graph.validate_move(move.model_dump(), [previous.model_dump() for previous in previous_moves])
+    return check.model_dump()
+
+
+class IncrementalJSONParser:
+    """
+    Streaming parser for a single flat JSON object.
+
+    Text is fed in arbitrary pieces. String values are exposed while they are
+    still arriving; numbers, booleans and nested values once they are complete.
+    The parser never raises on malformed input, it simply stops updating.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.completed: set[str] = set()
+        self.done = False
+        self._state = "start"
+        self._key = ""
+        self._buffer = ""
+        self._escape = ""
+        self._depth = 0
+        self._in_nested_string = False
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Consumes the next piece of text.
+
+        Returns:
+            list[str]: Names of the fields that changed while consuming it.
+        """
+        changed: List[str] = []
+        for ch in text:
+            field = self._step(ch)
+            if field and field not in changed:
+                changed.append(field)
+        return changed
+
+    def _read_string_char(self, ch: str) -> str | None:
+        """Handles one character inside a string; returns decoded text or None at the closing quote."""
+        if self._escape:
+            self._escape += ch
+            if self._escape.startswith("\\u") and len(self._escape) < 6:
+                return ""
+            try:
+                decoded = json.loads(f'"{self._escape}"')
+            except json.JSONDecodeError:
+                decoded = ""
+            self._escape = ""
+            return decoded
+        if ch == "\\":
+            self._escape = ch
+            return ""
+        if ch == '"':
+            return None
+        return ch
+
+    def _step(self, ch: str) -> str | None:
+        state = self._state
+        if state == "done":
+            return None
+        if state == "start":
+            if ch == "{":
+                self._state = "key_or_end"
+            return None
+        if state in ("key_or_end", "after_value"):
+            if ch == '"' and state == "key_or_end":
+                self._key, self._state = "", "key"
+            elif ch == ",":
+                self._state = "key_or_end"
+            elif ch == "}":
+                self._state, self.done = "done", True
+            return None
+        if state == "key":
+            piece = self._read_string_char(ch)
+            if piece is None:
+                self._state = "colon"
+            else:
+                self._key += piece
+            return None
+        if state == "colon":
+            if ch == ":":
+                self._state = "value_start"
+            return None
+        if state == "value_start":
+            if ch.isspace():
+                return None
+            if ch == '"':
+                self.fields[self._key] = ""
+                self._state = "string_value"
+                return self._key
+            if ch in "{[":
+                self._buffer, self._depth, self._state = ch, 1, "nested"
+                return None
+            self._buffer, self._state = ch, "scalar_value"
+            return None
+        if state == "string_value":
+            piece = self._read_string_char(ch)
+            if piece is None:
+                self.completed.add(self._key)
+                self._state = "after_value"
+            elif piece:
+                self.fields[self._key] += piece
+            return self._key
+        if state == "scalar_value":
+            if ch in ",}" or ch.isspace():
+                self._finish_value()
+                self._state = "after_value"
+                if not ch.isspace():
+                    self._step(ch)
+                return self._key
+            self._buffer += ch
+            return None
+        if state == "nested":
+            self._buffer += ch
+            if self._in_nested_string:
+                if self._escape:
+                    self._escape = ""
+                elif ch == "\\":
+                    self._escape = ch
+                elif ch == '"':
+                    self._in_nested_string = False
+            elif ch == '"':
+                self._in_nested_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_value()
+                    self._state = "after_value"
+                    return self._key
+            return None
+        return None
+
+    def _finish_value(self) -> None:
+        try:
+            self.fields[self._key] = json.loads(self._buffer)
+        except json.JSONDecodeError:
+            self.fields[self._key] = self._buffer
+        self.completed.add(self._key)
+        self._buffer = ""
@@ -1,62 +1,218 @@
-from openai import OpenAI
 from dotenv import load_dotenv
+import argparse
+import copy
 import json
 import os, utils
+import time
+import budget
+import cancellation
+import cassette
+import debrief
+import engine
+import forks
+import moves
+import perf
+import providers
+import retrieval
+import routing
+import scheduler
 '''
 DASE Client for interacting with OpenAI's API using a predefined prompt. 
+
+Each request re-sends the transcript with the profile sections relevant to
+the turn. Forks instead chain on previous_response_id: they continue from the
+stored response at the fork point and send only the new turn with its
+relevant profile sections (or the adversary's position in the attack graph
+when retrieval is off). DASE_OPENAI_CHAIN=1 chains every session from its
+first request, which then carries the session settings and the full profile.
 '''
 load_dotenv()
 
+CHAIN = os.getenv("DASE_OPENAI_CHAIN", "0").strip().lower() in ("1", "true", "yes", "on")
+
+def _usage(usage):
+    """Token counts from a Responses API usage object."""
+    if usage is None:
+        return {}
+    details = getattr(usage, "output_tokens_details", None)
+    counts = {
+        "input_tokens": getattr(usage, "input_tokens", None),
+        "output_tokens": getattr(usage, "output_tokens", None),
+        "reasoning_tokens": getattr(details, "reasoning_tokens", None),
+    }
+    return {key: value for key, value in counts.items() if value}
+
 class DASEClient:
-    def __init__(self, prompt_id, difficulty="low", reactions="2", company_profile="", company_name=""):
-        self.client = OpenAI()
+    def __init__(self, prompt_id, difficulty="low", reactions="2", company_profile="", company_name="", model=None):
+        self.client = providers.openai_client()
         self.prompt_id = prompt_id
+        self.model = model or routing.MODEL_TIERS["openai"]["full"]
         self.difficulty = difficulty
         self.reactions = reactions
         self.company_profile = company_profile
         self.company_name = company_name
-        self.history = []  # list of {"role": "user"|"dase", "text": str}
+        self.history = forks.History()  # {"role": "user"|"dase", "text": str, "response_id": str}
+        self.chain = CHAIN  # forks always chain, see fork()
+        self.last_error = None  # set when the most recent send_message call failed
+        self.last_wait_s = 0.0  # time the most recent call spent in the request scheduler
+        self.last_usage = {}  # token usage of the most recent call
+        self.last_retrieval = None  # profile sections sent with the most recent call
+        self.last_response_id = None  # id of the most recent stored response
         self._base_context = (
             f"The user desires this level of technical difficulty: {self.difficulty}. "
             f"The number of requested reactions is {self.reactions}. "
             f"The company to perform the exercise on is {self.company_name}.\n"
-            f"Company profile:\n{self.company_profile}\n"
         )
 
-    def _conversation_text(self) -> str:
+    def _conversation_text(self, user_input="") -> str:
         """
         Build a plain-text transcript to give the model memory across turns,
-        anchored with the company context.
+        anchored with the company context relevant to this turn.
         """
-        lines = [self._base_context, "Conversation so far:"]
+        self.last_retrieval = retrieval.profile_context(
+            self.company_profile,
+            user_input,
+            [turn["text"] for turn in self.history if turn["role"] == "dase"],
+        )
+        lines = [f"{self._base_context}Company profile:\n{self.last_retrieval.text}\n", "Conversation so far:"]
         for turn in self.history:
             speaker = "User" if turn["role"] == "user" else "DASE"
             lines.append(f"{speaker}: {turn['text']}")
         return "\n".join(lines)
 
-    def send_message(self, user_input):
+    def _previous_response_id(self):
+        """The latest stored response; failed turns have none and are left out of the chain."""
+        for turn in reversed(list(self.history)):
+            if turn.get("response_id"):
+                return turn["response_id"]
+        return None
+
+    def _chain_text(self, user_input, previous_response_id) -> str:
+        """
+        Context for a chained request: the full static profile first, then the
+        sections relevant to each turn (only the graph state with retrieval off).
+        """
+        self.last_retrieval = None
+        index = retrieval.index_for(self.company_profile)
+        graph = index.graph if index else None
+        if previous_response_id is None:
+            profile_text = index.static_text() if graph else self.company_profile
+            return f"{self._base_context}Company profile:\n{profile_text}\n"
+        replies = [turn["text"] for turn in self.history if turn["role"] == "dase"]
+        if retrieval.RETRIEVAL:
+            self.last_retrieval = retrieval.profile_context(self.company_profile, user_input, replies)
+            return f"Company profile sections for this turn:\n{self.last_retrieval.text}\n"
+        if graph is None:
+            return ""
+        return f"{graph.state(graph.footholds(replies))}\n"
+
+    def fork(self, length):
+        """
+        A client continuing this conversation from its first `length` history
+        entries, sharing them and chaining on the stored responses behind them.
+        """
+        child = copy.copy(self)
+        child.history = self.history.fork(length)
+        child.chain = True
+        child.last_error = None
+        child.last_wait_s = 0.0
+        child.last_usage = {}
+        child.last_retrieval = None
+        child.last_response_id = None
+        return child
+
+    def send_message(
+        self,
+        user_input,
+        model=None,
+        reasoning_effort=None,
+        max_output_tokens=None,
+        instructions=None,
+        text_format=None,
+        on_delta=None,
+        session_id="",
+        priority=scheduler.INTERACTIVE,
+        cancel=None,
+    ):
         # Include company context and prior turns so the model stays anchored.
-        prompt_text = f"{self._conversation_text()}\nUser: {user_input}\nDASE:"
+        turn_instructions = f"{instructions}\n" if instructions else ""
+        request = {}
+        previous_response_id = self._previous_response_id() if self.chain else None
+        if self.chain:
+            prompt_text = f"{self._chain_text(user_input, previous_response_id)}\n{turn_instructions}User: {user_input}\nDASE:"
+            if previous_response_id:
+                request["previous_response_id"] = previous_response_id
+        else:
+            prompt_text = f"{self._conversation_text(user_input)}\n{turn_instructions}User: {user_input}\nDASE:"
 
-        try:
-            response = self.client.responses.create(
-                model="gpt-5.1",
-                prompt={
-                    "id": self.prompt_id,
-                    "version": "7",
-                    "variables": {
-                        "reactions": self.reactions,
-                        "difficulty": self.difficulty,
-                    },
+        if reasoning_effort:
+            request["reasoning"] = {"effort": reasoning_effort}
+        if max_output_tokens:
+            request["max_output_tokens"] = max_output_tokens
+        if text_format:
+            request["text"] = {"format": text_format}
+
+        request.update(
+            model=model or self.model,
+            prompt={
+                "id": self.prompt_id,
+                "version": "7",
+                "variables": {
+                    "reactions": self.reactions,
+                    "difficulty": self.difficulty,
                 },
-                input=prompt_text
-            )
+            },
+            input=prompt_text,
+        )
+
+        self.last_error = None
+        self.last_usage = {}
+        self.last_response_id = None
+        self.last_wait_s = scheduler.acquire(
+            "openai",
+            request["model"],
+            scheduler.estimate_tokens(prompt_text) + (max_output_tokens or 0),
+            session_id,
+            priority,
+        )
+        perf.mark(perf.WAITING)
+        partial = []
+        try:
+            if cancel:
+                cancel.raise_if_cancelled()
+            if on_delta or cancel:
+                # Stream so callers can render the reply while it arrives, and
+                # so a cancel can close the connection mid-response.
+                response = None
+                stream = self.client.responses.create(stream=True, **request)
+                if cancel:
+                    cancel.on_cancel(getattr(stream, "close", None))
+                for event in stream:
+                    if cancel:
+                        cancel.raise_if_cancelled()
+                    if event.type == "response.output_text.delta":
+                        perf.mark(perf.STREAMING)
+                        partial.append(event.delta)
+                        if on_delta:
+                            on_delta(event.delta)
+                    elif event.type in ("response.completed", "response.incomplete"):
+                        response = event.response
+            else:
+                response = self.client.responses.create(**request)
+            perf.mark(perf.FINISHING)
         except Exception as e:
+            if cancel and cancel.cancelled:
+                # Nothing was added to the history yet, so there is nothing to roll back.
+                raise cancellation.GenerationCancelled("".join(partial)) from None
+            if scheduler.is_rate_limit_error(e):
+                scheduler.penalize("openai", request["model"])
             error_msg = f"API call failed: {e}"
+            self.last_error = str(e)
             self.history.append({"role": "user", "text": user_input})
             self.history.append({"role": "dase", "text": error_msg})
             return error_msg
 
+        self.last_usage = _usage(getattr(response, "usage", None))
         output_text = getattr(response, "output_text", None)
         if output_text:
             output_text = output_text.strip()
@@ -66,23 +222,169 @@ class DASEClient:
             except Exception:
                 output_text = "[No text output returned]"
 
+        self.last_response_id = getattr(response, "id", None)
         self.history.append({"role": "user", "text": user_input})
-        self.history.append({"role": "dase", "text": output_text})
+        self.history.append({"role": "dase", "text": output_text, "response_id": self.last_response_id})
 
         return output_text
+
+    def replace_last_reply(self, text):
+        """Replace the text of the most recent DASE reply in the history."""
+        # Entries may be shared with forks, so the entry is replaced, not edited.
+        if self.history and self.history[-1]["role"] == "dase":
+            self.history[-1] = {**self.history[-1], "text": text}
            
-def save_history_and_exit(dase_client):
+def run_turn(dase_client, user_input, log, normalize=None, structured=None, on_update=None, cancel=None):
+    """
+    Route, budget and send one turn, recording both sides in the session log.
+
+    Args:
+        dase_client (DASEClient): The client holding the conversation.
+        user_input (str): The trainee's message.
+        log (SessionLog): Session log receiving the turns.
+        normalize (Callable[[str], str] | None): Optional clean-up applied to the reply.
+        structured (bool | None): Overrides moves.STRUCTURED_MOVES; only adversary moves are structured.
+        on_update (Callable[[str], None] | None): Called with the reply rendered so far while streaming.
+        cancel (CancelToken | None): Aborts the request when cancelled.
+
+    Returns:
+        str: The model's reply.
+
+    Raises:
+        GenerationCancelled: When `cancel` fired; the partial turn is logged as cancelled.
+    """
+    normalize = normalize or (lambda text: text)
+    decision = routing.route_turn(log, "openai", user_input)
+    if structured is None:
+        structured = moves.STRUCTURED_MOVES
+    structured = structured and decision.turn_type == routing.ADVERSARY_MOVE
+    controller = budget.controller_for("openai")
+    plan = debrief.prepare(log, decision.turn_type)
+    turn_budget = controller.decide(
+        decision.turn_type, dase_client.difficulty, decision.model, drafted=bool(plan and plan.complete)
+    )
+
+    parser = None
+    structured_request = {}
+    if structured:
+        parser = moves.IncrementalJSONParser()
+        try:
+            profile = json.loads(dase_client.company_profile)
+        except json.JSONDecodeError:
+            profile = {}
+        structured_request = {
+            "instructions": moves.STRUCTURED_INSTRUCTION,
+            "text_format": {
+                "type": "json_schema",
+                "name": moves.SCHEMA_NAME,
+                "schema": moves.json_schema(profile),
+                "strict": True,
+            },
+        }
+    elif plan:
+        structured_request = {"instructions": plan.instruction}
+
+    streamed = []
+
+    def render_delta(delta):
+        streamed.append(delta)
+        if parser:
+            parser.feed(delta)
+            on_update(normalize(moves.render(parser.fields)))
+        else:
+            on_update(normalize("".join(streamed)))
+
+    on_delta = render_delta if on_update else None
+
+    log.add_turn("user", user_input)
+    started = time.perf_counter()
+    try:
+        output_text = dase_client.send_message(
+            user_input,
+            model=decision.model,
+            reasoning_effort=turn_budget.reasoning_effort,
+            max_output_tokens=turn_budget.max_output_tokens,
+            on_delta=on_delta,
+            session_id=log.session_id,
+            cancel=cancel,
+            **structured_request,
+        )
+    except cancellation.GenerationCancelled as e:
+        log.add_turn("model", normalize(e.partial_text), [], {
+            "cancelled": True,
+            "routing": decision.model_dump(),
+            "budget": turn_budget.model_dump(),
+            "latency_s": round(time.perf_counter() - started, 3),
+            "scheduler_wait_s": round(dase_client.last_wait_s, 3),
+        })
+        raise
+    latency_s = time.perf_counter() - started
+    if not dase_client.last_error:
+        # Failed calls return quickly and would make the budget look too generous.
+        controller.observe(latency_s, decision.turn_type, decision.model)
+
+    turn_metadata = {}
+    if parser:
+        move = moves.parse_move(output_text)
+        if move:
+            output_text = moves.render(move.model_dump())
+            dase_client.replace_last_reply(output_text)
+            turn_metadata["move_check"] = moves.check_move(move, profile, log.moves)
+            turn_metadata["move_index"] = log.add_move(move)
+        else:
+            turn_metadata["structured_error"] = "Reply did not match the adversary move schema."
+    if dase_client.last_error:
+        turn_metadata["error"] = dase_client.last_error
+    elif plan:
+        output_text = debrief.stitch(output_text, plan)
+        dase_client.replace_last_reply(output_text)
+        turn_metadata["debrief"] = debrief.summary(plan)
+    output_text = normalize(output_text)
+    log.add_turn("model", output_text, [], {
+        **turn_metadata,
+        "routing": decision.model_dump(),
+        "budget": turn_budget.model_dump(),
+        "latency_s": round(latency_s, 3),
+        "scheduler_wait_s": round(dase_client.last_wait_s, 3),
+        "usage": dase_client.last_usage,
+        **({"response_id": dase_client.last_response_id} if dase_client.last_response_id else {}),
+        "retrieval": dase_client.last_retrieval.model_dump(exclude={"text"}) if dase_client.last_retrieval else {},
+    })
+    if decision.turn_type == routing.ADVERSARY_MOVE and not dase_client.last_error:
+        debrief.draft_in_background(log, "openai", dase_client.company_profile)
+    return output_text
+
+def save_history_and_exit(dase_client, log=None):
     """Handles saving session history and exiting the application."""
     print("Session ended.")
     print("Would you like to save session history?")
     save_choice = input("Type 'yes' to save, or anything else to exit without saving: ").strip().lower()
     if save_choice == "yes" and hasattr(dase_client, 'history'):
-        log = utils.SessionLog()
-        log.turns = [utils.Turn(role="user", text=t["user"]) for t in dase_client.history] # Simplified conversion
+        if log is None:
+            log = utils.SessionLog()
+            log.turns = [
+                utils.Turn(role="user" if t["role"] == "user" else "model", text=t["text"])
+                for t in dase_client.history
+            ]
         file_path = utils.save_session(log)
         print(f"History saved to {file_path}")
 
 def main():
+    parser = argparse.ArgumentParser(description="DASE OpenAI command-line interface.")
+    cassette.add_cli_arguments(parser)
+    engine.add_cli_arguments(parser)
+    args = parser.parse_args()
+    cassette.configure_from_args(args)
+    if args.attach:
+        try:
+            remote, session_log = engine.attach(args.attach)
+        except engine.EngineError as e:
+            print(e)
+            return
+        engine.print_transcript(session_log)
+        engine.chat(remote, session_log)
+        return
+
     prompt_id = "pmpt_68ed9669d8f88195ab599ab84c53870f0ec675ea9d29fd46"
     
     print("--------DASE Client Interface--------")
@@ -97,8 +399,21 @@ def main():
         return
     
     company_name = company_profile.get("company_name", "Unknown Company")
+    if args.engine:
+        try:
+            remote, session_log = engine.start_remote(engine.OPENAI, company_name, difficulty, reactions)
+        except engine.EngineError as e:
+            print(e)
+            return
+        engine.chat(remote, session_log)
+        return
 
     dase = DASEClient(prompt_id, difficulty, reactions, company_profile_str, company_name)
+    session_log = utils.SessionLog()
+    session_log.add_metadata("company_name", company_name)
+    session_log.add_metadata("difficulty", difficulty)
+    session_log.add_metadata("reactions", reactions)
+    session_log.add_metadata("model", "OpenAI ChatGPT")
     
     user_input = input("Start scenario: ")
     print()
@@ -106,18 +421,20 @@ def main():
     while True:
         try:
             if user_input.lower() in ("exit", "quit", "q", "stop", "end"):
-                save_history_and_exit(dase)
+                save_history_and_exit(dase, session_log)
                 break
     
-            with utils.loading_indicator():
-                model_output = dase.send_message(user_input)
-            
-            print("\nDASE:\n", model_output, "\n")
+            try:
+                with utils.loading_indicator("Generating response (Ctrl+C to cancel)"):
+                    model_output = cancellation.run_interruptible(run_turn, dase, user_input, session_log)
+                print("\nDASE:\n", model_output, "\n")
+            except cancellation.GenerationCancelled:
+                print("\n[Response cancelled. Enter a new action.]\n")
 
             user_input = input("Your next action: ")
             print()
         except (KeyboardInterrupt, EOFError):
-            save_history_and_exit(dase)
+            save_history_and_exit(dase, session_log)
             break
 
 if __name__ == "__main__":
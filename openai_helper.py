@@ -4,7 +4,7 @@ from typing import List, Dict, Any, Tuple
 from dotenv import load_dotenv
 
 import utils
-from openai_cli import DASEClient
+from openai_cli import DASEClient, run_turn
 
 load_dotenv()
 
@@ -81,17 +81,28 @@ def generate(
     user_input: str,
     company_profile: str,
     log: utils.SessionLog,
+    structured: bool | None = None,
+    on_update=None,
+    cancel=None,
+    client: DASEClient | None = None,
 ) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Send a prompt to the OpenAI client and capture the response.
     Returns the text response and an empty list for compatibility with
     the Gemini interface (which streams raw chunks).
+    `client` selects a conversation other than the module's current session.
     """
-    if dase_client is None:
+    client = client or dase_client
+    if client is None:
         raise RuntimeError("OpenAI session is not initialized.")
 
-    log.add_turn("user", user_input)
-    response_text = dase_client.send_message(user_input)
-    response_text = _normalize_punctuation(_decode_unicode(response_text))
-    log.add_turn("model", response_text, [])
+    response_text = run_turn(
+        client,
+        user_input,
+        log,
+        normalize=lambda text: _normalize_punctuation(_decode_unicode(text)),
+        structured=structured,
+        on_update=on_update,
+        cancel=cancel,
+    )
     return response_text, []
@@ -0,0 +1,186 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+import budget
+"""
+Performance instrumentation for the DASE GUI.
+
+A RequestTimeline follows one turn through its stages (queued in the request
+scheduler, waiting for the first token, streaming, post-processing). The
+backends call mark() at stage boundaries; it is a no-op unless the calling
+thread is inside track(). FrameStats keeps a rolling window of frame times for
+the HUD, and SessionProfiler collects cProfile data from the GUI thread and
+every generation thread and dumps it to disk as one .prof file.
+
+DASE_PERF_HUD=1 shows the HUD at startup; profiles go to DASE_PROFILE_DIR.
+"""
+load_dotenv()
+
+PERF_HUD = os.getenv("DASE_PERF_HUD", "0").strip().lower() in ("1", "true", "yes", "on")
+PROFILE_DIR = os.getenv("DASE_PROFILE_DIR", "profiles")
+
+IDLE = "idle"
+QUEUED = "queued"
+WAITING = "waiting for first token"
+STREAMING = "streaming"
+FINISHING = "post-processing"
+DONE = "done"
+CANCELLED = "cancelled"
+
+FRAME_WINDOW = 240
+
+# From Python 3.12 cProfile is built on sys.monitoring: one profile sees every
+# thread, and enabling a second one while it runs raises ValueError.
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+class RequestTimeline:
+    """Stage timestamps and Python-side costs of one turn."""
+
+    def __init__(self):
+        self.state = QUEUED
+        self.marks: Dict[str, float] = {QUEUED: time.perf_counter()}
+        self.chunks = 0
+        self.callback_s = 0.0  # time spent rendering streamed updates in the UI
+
+    def mark(self, state: str) -> None:
+        """Moves to `state`; the first time a state is reached is kept."""
+        if state == STREAMING:
+            self.chunks += 1
+        if state not in self.marks:
+            self.marks[state] = time.perf_counter()
+            self.state = state
+
+    def add_callback_time(self, seconds: float) -> None:
+        self.callback_s += seconds
+
+    def finish(self, cancelled: bool = False) -> None:
+        self.mark(CANCELLED if cancelled else DONE)
+
+    def _span(self, start: str, end_states: List[str]) -> float | None:
+        if start not in self.marks:
+            return None
+        end = next((self.marks[state] for state in end_states if state in self.marks), time.perf_counter())
+        return end - self.marks[start]
+
+    def stages(self) -> Dict[str, float | None]:
+        """Seconds per stage; a stage still in progress is measured up to now."""
+        finished = [DONE, CANCELLED]
+        return {
+            "queued_s": self._span(QUEUED, [WAITING, STREAMING, FINISHING] + finished),
+            "first_token_s": self._span(WAITING, [STREAMING, FINISHING] + finished),
+            "streaming_s": self._span(STREAMING, [FINISHING] + finished),
+            "post_processing_s": self._span(FINISHING, finished),
+            "ui_callbacks_s": self.callback_s,
+            "total_s": self._span(QUEUED, finished),
+        }
+
+
+_local = threading.local()
+
+
+@contextmanager
+def track(timeline: RequestTimeline):
+    """Makes mark() calls on this thread update `timeline`."""
+    _local.timeline = timeline
+    try:
+        yield timeline
+    finally:
+        _local.timeline = None
+
+
+def mark(state: str) -> None:
+    """Records a stage boundary for the turn tracked on this thread, if any."""
+    timeline = getattr(_local, "timeline", None)
+    if timeline is not None:
+        timeline.mark(state)
+
+
+class FrameStats:
+    """Rolling window of frame times in seconds."""
+
+    def __init__(self, size: int = FRAME_WINDOW):
+        self._frames = deque(maxlen=size)
+
+    def add(self, frame_s: float) -> None:
+        self._frames.append(frame_s)
+
+    def summary(self) -> Dict[str, float | None]:
+        frames = list(self._frames)
+        return {
+            "mean_ms": 1000 * sum(frames) / len(frames) if frames else None,
+            "p95_ms": 1000 * budget.percentile(frames, 0.95) if frames else None,
+            "max_ms": 1000 * max(frames) if frames else None,
+        }
+
+
+class SessionProfiler:
+    """
+    cProfile across the GUI thread and the generation threads of a session.
+
+    One profile is recorded. Before Python 3.12 a profile only sees the thread
+    that enabled it, so generation threads record their own through run() and
+    dump() merges them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._main: cProfile.Profile | None = None
+        self._profiles: List[cProfile.Profile] = []
+
+    @property
+    def active(self) -> bool:
+        return self._main is not None
+
+    def start(self) -> None:
+        """Starts profiling the calling (GUI) thread; worker calls go through run()."""
+        with self._lock:
+            if self._main is not None:
+                return
+            self._profiles = []
+            self._main = cProfile.Profile()
+        self._main.enable()
+
+    def run(self, fn, *args, **kwargs):
+        """Calls fn, profiled when a profile is being recorded."""
+        if not self.active or PROFILES_ALL_THREADS:
+            return fn(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiles.append(profile)
+
+    def dump(self, directory: str = PROFILE_DIR) -> str | None:
+        """
+        Stops profiling and writes the merged stats.
+
+        Returns:
+            str | None: Path of the .prof file (open with pstats or snakeviz), or None when not profiling.
+        """
+        with self._lock:
+            main, self._main = self._main, None
+            profiles, self._profiles = self._profiles, []
+        if main is None:
+            return None
+        main.disable()
+        stats = pstats.Stats(main)
+        for profile in profiles:
+            stats.add(profile)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"dase_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        stats.dump_stats(path)
+        return path
@@ -0,0 +1,126 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import cassette
+"""
+Client factories for the LLM providers used by DASE.
+
+Backends build their SDK clients through these functions so the provider can
+be swapped without touching the generate code paths. Set DASE_PROVIDER=mock
+to use the local mock provider (see mock_provider.py) instead of the real APIs.
+When a cassette is active (see cassette.py) the client is wrapped to record
+every call, or replaced entirely so calls are answered from the recording.
+
+One live client per provider is built on first use and shared by every
+session and thread of the process, so connections (and their TLS sessions)
+are reused across turns; only the cheap cassette wrapper is created per call.
+Shared clients are never closed to cancel a turn. Instead, HTTP responses the
+Gemini client opens inside closing_streams(cancel) are registered with the
+turn's CancelToken, which closes just that stream.
+"""
+load_dotenv()
+
+REAL = "real"
+MOCK = "mock"
+
+_clients = {}
+_clients_lock = threading.Lock()
+_streams = threading.local()  # CancelToken of the turn running on this thread
+
+
+def provider_mode() -> str:
+    """Returns the active provider mode, read at call time so workers can change it."""
+    return os.getenv("DASE_PROVIDER", REAL).strip().lower() or REAL
+
+
+@contextmanager
+def closing_streams(cancel):
+    """
+    Registers every HTTP response a shared Gemini client opens on this thread
+    with `cancel`, so cancelling the turn closes its stream.
+    """
+    previous = getattr(_streams, "cancel", None)
+    _streams.cancel = cancel
+    try:
+        yield
+    finally:
+        _streams.cancel = previous
+
+
+def _register_response(response) -> None:
+    cancel = getattr(_streams, "cancel", None)
+    if cancel is not None:
+        cancel.on_cancel(response.close)
+
+
+def _shared(name: str, build):
+    """Returns the process-wide live client for `name`, building it on first use."""
+    key = (name, provider_mode())
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = build()
+        return _clients[key]
+
+
+def _live_gemini_client():
+    if provider_mode() == MOCK:
+        import mock_provider
+        return mock_provider.MockGeminiClient()
+    from google import genai
+    from google.genai import types
+    return genai.Client(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(client_args={"event_hooks": {"response": [_register_response]}}),
+    )
+
+
+def _live_openai_client():
+    if provider_mode() == MOCK:
+        import mock_provider
+        return mock_provider.MockOpenAIClient()
+    from openai import OpenAI
+    return OpenAI()
+
+
+def _live_local_client():
+    if provider_mode() == MOCK:
+        import mock_provider
+        return mock_provider.MockOpenAIClient()
+    from openai import OpenAI
+    return OpenAI(
+        base_url=os.getenv("DASE_LOCAL_BASE_URL", "http://127.0.0.1:8080/v1"),
+        api_key=os.getenv("DASE_LOCAL_API_KEY", "local"),
+    )
+
+
+def gemini_client():
+    """Returns the shared google-genai client, or the mock client when DASE_PROVIDER=mock."""
+    active = cassette.active()
+    if active is None:
+        return _shared("gemini", _live_gemini_client)
+    if active.mode == cassette.REPLAY:
+        return cassette.GeminiClient(active)
+    return cassette.GeminiClient(active, _shared("gemini", _live_gemini_client))
+
+
+def openai_client():
+    """Returns the shared OpenAI client, or the mock client when DASE_PROVIDER=mock."""
+    active = cassette.active()
+    if active is None:
+        return _shared("openai", _live_openai_client)
+    if active.mode == cassette.REPLAY:
+        return cassette.OpenAIClient(active)
+    return cassette.OpenAIClient(active, _shared("openai", _live_openai_client))
+
+
+def local_client():
+    """Returns the shared OpenAI client for the local OpenAI-compatible server, or the mock client."""
+    active = cassette.active()
+    if active is None:
+        return _shared("local", _live_local_client)
+    if active.mode == cassette.REPLAY:
+        return cassette.OpenAIClient(active)
+    return cassette.OpenAIClient(active, _shared("local", _live_local_client))
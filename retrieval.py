@@ -0,0 +1,264 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+import attack_graph
+import scheduler
+import utils
+"""
+Relevance-based retrieval of company profile sections.
+
+Instead of sending the whole company JSON with every turn, each profile is
+split into passages: every person, asset, technology, posture and brief entry,
+plus the bullet lines of the matching company in text/Company_Profiles.txt.
+The passages are indexed with BM25. A turn gets the profile header (name,
+industry, mission, ...) plus the passages most relevant to the defender's
+action and the recent adversary moves, up to a token cap, rendered as a
+trimmed profile JSON.
+
+With the attack graph on (attack_graph.py), the adversary_training_brief is
+left out of the passages and replaced by the graph digest: the graph by stage
+plus the adversary's current footholds, the objectives they reach and the
+detection opportunities on the way.
+
+DASE_RETRIEVAL=0 restores full-profile prompts; DASE_RETRIEVAL_MAX_TOKENS caps
+the retrieved passages.
+"""
+load_dotenv()
+
+RETRIEVAL = os.getenv("DASE_RETRIEVAL", "1").strip().lower() in ("1", "true", "yes", "on")
+MAX_TOKENS = int(os.getenv("DASE_RETRIEVAL_MAX_TOKENS", "800"))
+NARRATIVE_PATH = os.path.join(utils.DATA_DIR, "text", "Company_Profiles.txt")
+
+# Profile sections split into passages; every other key is part of the header.
+LIST_SECTIONS = ("key_personnel", "key_digital_assets")
+DICT_SECTIONS = ("technology_stack", "security_posture", "adversary_training_brief")
+NARRATIVE = "profile_notes"
+# Sections that always contribute their best passage when the cap allows.
+REQUIRED_SECTIONS = ("key_personnel", "key_digital_assets", "technology_stack", "security_posture")
+
+# Narrative headings in Company_Profiles.txt and the section they describe.
+NARRATIVE_HEADINGS = {
+    "key personnel": "key_personnel",
+    "key digital": "key_digital_assets",
+    "technology stack": "technology_stack",
+    "security posture": "security_posture",
+    "adversary-training brief": "adversary_training_brief",
+}
+
+RECENT_MOVES = 2
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it", "its",
+    "of", "on", "or", "that", "the", "this", "to", "we", "with", "our", "their", "they", "will",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+class Passage(BaseModel):
+    section: str
+    key: str = ""  # entry name for dict sections
+    value: Any
+    text: str
+    tokens: int
+
+
+class Retrieval(BaseModel):
+    text: str
+    passages: int
+    tokens: int
+    full_tokens: int
+
+
+def _narrative_lines(company_name: str) -> List[tuple[str, str]]:
+    """(section, bullet line) pairs for one company from Company_Profiles.txt."""
+    if not os.path.exists(NARRATIVE_PATH):
+        return []
+    with open(NARRATIVE_PATH, "r", encoding="utf-8-sig") as f:
+        lines = [line.strip() for line in f]
+    lines_out, in_company, section = [], False, "overview"
+    for line in lines:
+        heading = re.match(r"^\d+\.\s+(.*)$", line)
+        if heading:
+            in_company = heading.group(1).lower().startswith(company_name.lower())
+            section = "overview"
+            continue
+        if not in_company or not line:
+            continue
+        if not line.startswith("•"):
+            section = next((name for prefix, name in NARRATIVE_HEADINGS.items() if line.lower().startswith(prefix)), "overview")
+            continue
+        if section != "overview":  # the overview repeats the JSON header
+            lines_out.append((section, line.lstrip("• ").strip()))
+    return lines_out
+
+
+class ProfileIndex:
+    """BM25 index over the passages of one company profile."""
+
+    def __init__(self, profile: Dict[str, Any]):
+        sections = set(LIST_SECTIONS) | set(DICT_SECTIONS)
+        self.profile = profile
+        self.header = {key: value for key, value in profile.items() if key not in sections}
+        self.full_tokens = scheduler.estimate_tokens(json.dumps(profile, indent=2))
+        self.graph = None
+        if attack_graph.ATTACK_GRAPH:
+            self.graph = utils.ATTACK_GRAPHS.get(profile.get("company_name", "")) or attack_graph.compile_profile(profile)
+        self.passages: List[Passage] = []
+        for section in LIST_SECTIONS:
+            for item in profile.get(section, []):
+                self._add(section, "", item)
+        for section in DICT_SECTIONS:
+            if self.graph and section == attack_graph.BRIEF:
+                continue
+            for key, value in (profile.get(section) or {}).items():
+                self._add(section, key, value)
+        for section, line in _narrative_lines(profile.get("company_name", "")):
+            self.full_tokens += scheduler.estimate_tokens(line)
+            if not (self.graph and section == attack_graph.BRIEF):
+                self._add(NARRATIVE, section, line)
+
+        self._terms = [Counter(tokenize(passage.text)) for passage in self.passages]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        document_frequency = Counter(term for terms in self._terms for term in terms)
+        count = len(self.passages)
+        self._idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def _add(self, section: str, key: str, value: Any) -> None:
+        body = value if isinstance(value, str) else json.dumps(value)
+        label = f"{section.replace('_', ' ')} {key.replace('_', ' ')}"
+        self.passages.append(Passage(
+            section=section, key=key, value=value, text=f"{label} {body}", tokens=scheduler.estimate_tokens(body),
+        ))
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every passage for the query."""
+        query_terms = set(tokenize(query))
+        results = []
+        for terms, length in zip(self._terms, self._lengths):
+            score = 0.0
+            for term in query_terms:
+                frequency = terms.get(term, 0)
+                if frequency:
+                    norm = K1 * (1 - B + B * length / (self._avg_length or 1))
+                    score += self._idf[term] * frequency * (K1 + 1) / (frequency + norm)
+            results.append(score)
+        return results
+
+    def select(self, query: str, max_tokens: int = MAX_TOKENS) -> Retrieval:
+        """
+        Picks the header plus the most relevant passages within `max_tokens`.
+
+        Args:
+            query (str): Defender action and recent adversary moves.
+            max_tokens (int): Budget for the retrieved passages (the header is always sent).
+
+        Returns:
+            Retrieval: The trimmed profile JSON and its size against the full profile.
+        """
+        scores = self.scores(query)
+        ranked = sorted(range(len(self.passages)), key=lambda index: -scores[index])
+        chosen, used = [], 0
+
+        def take(index: int) -> None:
+            nonlocal used
+            if index not in chosen and used + self.passages[index].tokens <= max_tokens:
+                chosen.append(index)
+                used += self.passages[index].tokens
+
+        for section in REQUIRED_SECTIONS:
+            best = next((index for index in ranked if self.passages[index].section == section), None)
+            if best is not None:
+                take(best)
+        for index in ranked:
+            if scores[index] > 0:
+                take(index)
+
+        trimmed = dict(self.header)
+        for index in sorted(chosen):
+            passage = self.passages[index]
+            if passage.section in LIST_SECTIONS:
+                trimmed.setdefault(passage.section, []).append(passage.value)
+            elif passage.section in DICT_SECTIONS:
+                trimmed.setdefault(passage.section, {})[passage.key] = passage.value
+            else:
+                trimmed.setdefault(NARRATIVE, []).append(passage.value)
+        text = json.dumps(trimmed, indent=2)
+        return Retrieval(
+            text=text,
+            passages=len(chosen),
+            tokens=scheduler.estimate_tokens(text),
+            full_tokens=self.full_tokens,
+        )
+
+    def static_text(self) -> str:
+        """The whole profile, with the brief replaced by the graph summary when the graph is on."""
+        if self.graph is None:
+            return json.dumps(self.profile, indent=2)
+        return f"{json.dumps(attack_graph.without_brief(self.profile), indent=2)}\n{self.graph.summary()}"
+
+
+_indexes: Dict[str, ProfileIndex] = {}
+_lock = threading.Lock()
+
+
+def index_for(company_profile: str) -> ProfileIndex | None:
+    """Returns the (cached) index of a profile JSON string, or None when it is not JSON."""
+    key = hashlib.sha256(company_profile.encode("utf-8")).hexdigest()
+    with _lock:
+        if key not in _indexes:
+            try:
+                profile = json.loads(company_profile)
+            except json.JSONDecodeError:
+                return None
+            if not isinstance(profile, dict):
+                return None
+            _indexes[key] = ProfileIndex(profile)
+        return _indexes[key]
+
+
+def profile_context(company_profile: str, user_input: str, recent_replies: List[str]) -> Retrieval:
+    """
+    Profile text for one turn: the relevant sections when retrieval is on,
+    otherwise (or for a profile that is not JSON) the full profile. With the
+    attack graph on, the adversary_training_brief is replaced by the graph digest.
+
+    Args:
+        company_profile (str): The company profile as a JSON string.
+        user_input (str): The defender's message for this turn.
+        recent_replies (list[str]): Previous model replies; the last RECENT_MOVES are used.
+    """
+    index = index_for(company_profile) if RETRIEVAL or attack_graph.ATTACK_GRAPH else None
+    if index is None:
+        tokens = scheduler.estimate_tokens(company_profile)
+        return Retrieval(text=company_profile, passages=0, tokens=tokens, full_tokens=tokens)
+    if RETRIEVAL:
+        query = " ".join([user_input, *recent_replies[-RECENT_MOVES:]])
+        result = index.select(query)
+        if index.graph is None:
+            return result
+        text = f"{result.text}\n{index.graph.digest(index.graph.footholds(recent_replies))}"
+    else:
+        if index.graph is None:
+            tokens = scheduler.estimate_tokens(company_profile)
+            return Retrieval(text=company_profile, passages=0, tokens=tokens, full_tokens=tokens)
+        result = Retrieval(text="", passages=0, tokens=0, full_tokens=index.full_tokens)
+        text = f"{index.static_text()}\n{index.graph.state(index.graph.footholds(recent_replies))}"
+    return result.model_copy(update={"text": text, "tokens": scheduler.estimate_tokens(text)})
@@ -0,0 +1,126 @@
+import os
+from typing import Dict
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+import utils
+"""
+Per-turn model routing for DASE sessions.
+
+Every turn is classified as setup/clarification, an adversary move or the
+final debrief, and each class is sent to a configurable model tier for the
+active backend. Short adversary moves go to the fast tier while the closing
+debrief required by prompt.txt keeps the full model.
+"""
+load_dotenv()
+
+SETUP = "setup"                    # session start or clarifying question
+ADVERSARY_MOVE = "adversary_move"  # one reaction spent by the adversary
+DEBRIEF = "debrief"                # final reaction plus rationale/advice
+
+TURN_TYPES = (SETUP, ADVERSARY_MOVE, DEBRIEF)
+
+# Which tier each turn type is routed to. Override with e.g.
+# DASE_ROUTE_ADVERSARY_MOVE=full in .env.
+TURN_TIERS: Dict[str, str] = {
+    SETUP: os.getenv("DASE_ROUTE_SETUP", "fast"),
+    ADVERSARY_MOVE: os.getenv("DASE_ROUTE_ADVERSARY_MOVE", "fast"),
+    DEBRIEF: os.getenv("DASE_ROUTE_DEBRIEF", "full"),
+}
+
+# Model names per backend and tier.
+MODEL_TIERS: Dict[str, Dict[str, str]] = {
+    "gemini": {
+        "fast": os.getenv("DASE_GEMINI_FAST_MODEL", "gemini-2.5-flash"),
+        "full": os.getenv("DASE_GEMINI_FULL_MODEL", "gemini-2.5-pro"),
+    },
+    "openai": {
+        "fast": os.getenv("DASE_OPENAI_FAST_MODEL", "gpt-5-mini"),
+        "full": os.getenv("DASE_OPENAI_FULL_MODEL", "gpt-5.1"),
+    },
+    # A single quantized model usually serves both tiers on a CPU host.
+    "local": {
+        "fast": os.getenv("DASE_LOCAL_FAST_MODEL", os.getenv("DASE_LOCAL_MODEL", "qwen2.5-7b-instruct-q4_k_m")),
+        "full": os.getenv("DASE_LOCAL_MODEL", "qwen2.5-7b-instruct-q4_k_m"),
+    },
+}
+
+
+class RouteDecision(BaseModel):
+    turn_type: str
+    tier: str
+    model: str
+    reactions_remaining: int
+
+
+def reaction_budget(log: utils.SessionLog) -> int:
+    """Returns the number of reactions requested for the session (at least 1)."""
+    try:
+        return max(1, int(log.metadata.get("reactions", 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def moves_made(log: utils.SessionLog) -> int:
+    """
+    Counts the model turns that spent a reaction (adversary moves and the debrief).
+    Cancelled turns and failed API calls (logged with an error) do not count.
+    """
+    count = 0
+    for turn in log.turns:
+        if turn.role != "model" or turn.metadata.get("cancelled") or turn.metadata.get("error"):
+            continue
+        turn_type = turn.metadata.get("routing", {}).get("turn_type")
+        if turn_type in (ADVERSARY_MOVE, DEBRIEF):
+            count += 1
+    return count
+
+
+def classify_turn(log: utils.SessionLog, user_input: str) -> str:
+    """
+    Classifies the next turn from the reaction counter.
+
+    The first turn sets up the scenario, every following defender action
+    triggers one adversary move, and the action that spends the last reaction
+    produces the debrief. Questions from the trainee, and anything after the
+    debrief, are treated as clarification and do not consume a reaction.
+    """
+    if not any(
+        turn.role == "model" and not turn.metadata.get("cancelled") and not turn.metadata.get("error")
+        for turn in log.turns
+    ):
+        return SETUP
+    remaining = reaction_budget(log) - moves_made(log)
+    if remaining <= 0 or user_input.strip().endswith("?"):
+        return SETUP
+    if remaining == 1:
+        return DEBRIEF
+    return ADVERSARY_MOVE
+
+
+def route_turn(log: utils.SessionLog, backend: str, user_input: str) -> RouteDecision:
+    """
+    Picks the model for the next turn of a session.
+
+    Args:
+        log (SessionLog): The session being played; its turns carry previous decisions.
+        backend (str): Key into MODEL_TIERS ("gemini" or "openai").
+        user_input (str): The trainee's message for this turn.
+
+    Returns:
+        RouteDecision: The turn type, tier and model to use.
+    """
+    turn_type = classify_turn(log, user_input)
+    tier = TURN_TIERS.get(turn_type, "full")
+    tiers = MODEL_TIERS[backend]
+    model = tiers.get(tier, tiers["full"])
+    remaining = reaction_budget(log) - moves_made(log)
+    if turn_type != SETUP:
+        remaining -= 1
+    return RouteDecision(
+        turn_type=turn_type,
+        tier=tier,
+        model=model,
+        reactions_remaining=max(0, remaining),
+    )
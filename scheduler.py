@@ -0,0 +1,235 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from statistics import mean
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+import budget
+"""
+Shared, rate-limit-aware scheduler for outbound LLM requests.
+
+Every call to a provider first acquires a slot here. Each (provider, model)
+pair has token buckets for requests and tokens per minute, charged with the
+pre-call token estimate. Waiting requests are ordered by priority (an
+in-progress trainee turn before background work), then by how many requests
+their session has already been served (fairness), then by arrival.
+
+The scheduler lives in the process that makes the calls, so limits are shared
+by every session of one process. The GUI and the CLIs each run their own
+scheduler; sessions run in the engine daemon (DASE_ENGINE=1, or --engine)
+share the daemon's, which `python engine.py status` reports. The perf HUD and
+loadtest.py show metrics() for the scheduler the session actually uses.
+
+Limits default per provider and can be overridden in .env:
+    DASE_GEMINI_RPM / DASE_GEMINI_TPM / DASE_OPENAI_RPM / DASE_OPENAI_TPM
+    DASE_RATE_LIMITS='{"gemini/gemini-2.5-pro": {"rpm": 150, "tpm": 2000000}}'
+"""
+load_dotenv()
+
+INTERACTIVE = 0   # a trainee is waiting on this turn
+BACKGROUND = 10   # summarisation, pre-generation and other deferred work
+
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 150, "tpm": 2_000_000},
+    "openai": {"rpm": 500, "tpm": 500_000},
+    "local": {"rpm": 600, "tpm": 10_000_000},
+}
+
+WAIT_WINDOW = 200
+
+
+def _configured_limits() -> Dict[str, Dict[str, int]]:
+    limits = {provider: dict(values) for provider, values in DEFAULT_LIMITS.items()}
+    for provider, values in limits.items():
+        for kind in ("rpm", "tpm"):
+            override = os.getenv(f"DASE_{provider.upper()}_{kind.upper()}")
+            if override:
+                values[kind] = int(override)
+    try:
+        limits.update(json.loads(os.getenv("DASE_RATE_LIMITS", "{}")))
+    except json.JSONDecodeError:
+        print("Warning: DASE_RATE_LIMITS is not valid JSON; ignoring it.")
+    return limits
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough pre-call token estimate (about four characters per token)."""
+    return sum(len(text or "") for text in texts) // 4 + 1
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` per minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(1, per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 when available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self, seconds: float) -> None:
+        """Empties the bucket so nothing is admitted for roughly `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class _Ticket:
+    def __init__(self, key: Tuple[str, str], tokens: int, session_id: str, priority: int, seq: int):
+        self.key = key
+        self.tokens = tokens
+        self.session_id = session_id
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+
+
+class RequestScheduler:
+    """Admits outbound LLM requests under shared per-model rate limits."""
+
+    def __init__(self, limits: Dict[str, Dict[str, int]] | None = None):
+        self.limits = limits or _configured_limits()
+        self._cond = threading.Condition()
+        self._buckets: Dict[Tuple[str, str], Tuple[TokenBucket, TokenBucket]] = {}
+        self._waiting: List[_Ticket] = []
+        self._served: Dict[str, int] = defaultdict(int)
+        self._seq = itertools.count()
+        self._waits: Dict[int, deque] = defaultdict(lambda: deque(maxlen=WAIT_WINDOW))
+        self._admitted = 0
+        self._throttled = 0
+        self._penalties = 0
+
+    def _limits_for(self, provider: str, model: str) -> Dict[str, int]:
+        return self.limits.get(f"{provider}/{model}") or self.limits.get(provider) or {"rpm": 60, "tpm": 100_000}
+
+    def _buckets_for(self, key: Tuple[str, str]) -> Tuple[TokenBucket, TokenBucket]:
+        if key not in self._buckets:
+            limits = self._limits_for(*key)
+            self._buckets[key] = (TokenBucket(limits["rpm"]), TokenBucket(limits["tpm"]))
+        return self._buckets[key]
+
+    def _next_for(self, key: Tuple[str, str]) -> _Ticket:
+        return min(
+            (ticket for ticket in self._waiting if ticket.key == key),
+            key=lambda ticket: (ticket.priority, self._served[ticket.session_id], ticket.seq),
+        )
+
+    def acquire(
+        self,
+        provider: str,
+        model: str,
+        est_tokens: int,
+        session_id: str = "",
+        priority: int = INTERACTIVE,
+    ) -> float:
+        """
+        Blocks until the request may be sent.
+
+        Args:
+            provider (str): "gemini", "openai", ...
+            model (str): Model the request goes to.
+            est_tokens (int): Pre-call estimate of prompt plus output tokens.
+            session_id (str): Session issuing the request, for fairness.
+            priority (int): INTERACTIVE or BACKGROUND (lower is served first).
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        key = (provider, model)
+        with self._cond:
+            ticket = _Ticket(key, est_tokens, session_id, priority, next(self._seq))
+            self._waiting.append(ticket)
+            throttled = False
+            while True:
+                requests, tokens = self._buckets_for(key)
+                if self._next_for(key) is ticket:
+                    delay = max(requests.wait_time(1), tokens.wait_time(ticket.tokens))
+                    if delay <= 0:
+                        break
+                    throttled = True
+                    self._cond.wait(timeout=delay)
+                else:
+                    self._cond.wait(timeout=1.0)
+            requests.take(1)
+            tokens.take(ticket.tokens)
+            self._waiting.remove(ticket)
+            self._served[session_id] += 1
+            waited = time.monotonic() - ticket.enqueued
+            self._waits[priority].append(waited)
+            self._admitted += 1
+            self._throttled += 1 if throttled else 0
+            self._cond.notify_all()
+        return waited
+
+    def penalize(self, provider: str, model: str, retry_after_s: float = 10.0) -> None:
+        """Backs off a model after the provider answered 429 / RESOURCE_EXHAUSTED."""
+        with self._cond:
+            requests, _ = self._buckets_for((provider, model))
+            requests.drain(retry_after_s)
+            self._penalties += 1
+            self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Returns queue depth and wait-time statistics."""
+        with self._cond:
+            depth: Dict[str, int] = defaultdict(int)
+            for ticket in self._waiting:
+                depth[f"{ticket.key[0]}/{ticket.key[1]}"] += 1
+            waits = {priority: list(values) for priority, values in self._waits.items()}
+            return {
+                "queue_depth": len(self._waiting),
+                "queue_depth_by_model": dict(depth),
+                "admitted": self._admitted,
+                "throttled": self._throttled,
+                "penalties": self._penalties,
+                "wait_s": {
+                    ("interactive" if priority == INTERACTIVE else "background" if priority == BACKGROUND else str(priority)): {
+                        "mean": mean(values) if values else None,
+                        "p90": budget.percentile(values, 0.9),
+                        "max": max(values) if values else None,
+                    }
+                    for priority, values in waits.items()
+                },
+            }
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True when an SDK exception looks like a provider rate-limit response."""
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "RateLimit" in text
+
+
+_shared = RequestScheduler()
+
+
+def acquire(provider: str, model: str, est_tokens: int, session_id: str = "", priority: int = INTERACTIVE) -> float:
+    """Acquires a slot on the process-wide scheduler; see RequestScheduler.acquire."""
+    return _shared.acquire(provider, model, est_tokens, session_id, priority)
+
+
+def penalize(provider: str, model: str, retry_after_s: float = 10.0) -> None:
+    """Backs off a model on the process-wide scheduler."""
+    _shared.penalize(provider, model, retry_after_s)
+
+
+def metrics() -> Dict[str, Any]:
+    """Queue-depth and wait-time metrics of the process-wide scheduler."""
+    return _shared.metrics()
@@ -1,9 +1,11 @@
 import json
 import os
+import re
 import shlex
 import sys
 import time
 import threading
+import uuid
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 from rich import print_json
@@ -11,24 +13,98 @@ from pydantic import BaseModel, Field
 from itertools import cycle
 from contextlib import contextmanager
 
+import attack_graph
+
 
 class Turn(BaseModel):
     role: str
     text: str
     raw_chunks: List[Dict[str, Any]] = Field(default_factory=list)
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class AdversaryMove(BaseModel):
+    move_number: int
+    attack_technique: str
+    target_asset: str
+    narrative: str
+    reactions_remaining: int
+
+
+class DebriefNote(BaseModel):
+    move_number: int
+    turn_index: int
+    defender_action: str
+    text: str = ""
+    model: str = ""
+    latency_s: float | None = None
+    error: str | None = None
+
+
+class ForkPoint(BaseModel):
+    session_id: str  # the forked session
+    turn_index: int  # turns it inherited from this one
 
 
 class SessionLog(BaseModel):
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     turns: List[Turn] = Field(default_factory=list)
+    moves: List[AdversaryMove] = Field(default_factory=list)
+    debrief_notes: List[DebriefNote] = Field(default_factory=list)
     metadata: Dict[str, Any] = Field(default_factory=dict)
-
-    def add_turn(self, role: str, text: str, raw_chunks: Optional[List[Dict[str, Any]]] = None) -> None:
+    parent_session_id: str | None = None  # set on forks
+    fork_turn: int | None = None  # turns inherited from the parent
+    forks: List[ForkPoint] = Field(default_factory=list)
+
+    def add_turn(
+        self,
+        role: str,
+        text: str,
+        raw_chunks: Optional[List[Dict[str, Any]]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
         """Append a turn to the log."""
-        self.turns.append(Turn(role=role, text=text, raw_chunks=raw_chunks or []))
+        self.turns.append(Turn(role=role, text=text, raw_chunks=raw_chunks or [], metadata=metadata or {}))
+
+    def add_move(self, move: AdversaryMove) -> int:
+        """Append a structured adversary move and return its index in the log."""
+        self.moves.append(move)
+        return len(self.moves) - 1
+
+    def add_debrief_note(self, note: DebriefNote) -> None:
+        """Store a drafted debrief note, replacing an earlier draft for the same move."""
+        self.debrief_notes = [item for item in self.debrief_notes if item.move_number != note.move_number] + [note]
 
     def add_metadata(self, key: str, value: Any) -> None:
         self.metadata[key] = value
 
+    def fork(self, turn_index: int) -> "SessionLog":
+        """
+        Start a new session that shares this one's turns before `turn_index`.
+
+        The Turn records are shared rather than copied, and both logs record the fork.
+
+        Args:
+            turn_index (int): Index of the user turn to replay, or len(turns) to continue from the end.
+
+        Raises:
+            ValueError: When `turn_index` is not a user turn.
+        """
+        if turn_index != len(self.turns) and not (0 <= turn_index < len(self.turns) and self.turns[turn_index].role == "user"):
+            raise ValueError(f"Turn {turn_index} is not a defender action.")
+        inherited = self.turns[:turn_index]
+        moves = sum(1 for turn in inherited if "move_index" in turn.metadata)
+        child = SessionLog(
+            turns=inherited,
+            moves=self.moves[:moves],
+            debrief_notes=[note for note in self.debrief_notes if note.turn_index < turn_index],
+            metadata=dict(self.metadata),
+            parent_session_id=self.session_id,
+            fork_turn=turn_index,
+        )
+        self.forks.append(ForkPoint(session_id=child.session_id, turn_index=turn_index))
+        return child
+
 # --- Constants and Profile Loading ---
 DATA_DIR = os.path.dirname(__file__)
 JSON_DIR = os.path.join(DATA_DIR, "json")
@@ -86,6 +162,8 @@ def load_all_profiles(data_dir: str = DATA_DIR) -> List[Dict[str, Any]]:
 
 
 PROFILES = load_all_profiles()
+# Compiled once at load; see attack_graph.py.
+ATTACK_GRAPHS = {p.get("company_name", ""): attack_graph.compile_profile(p) for p in PROFILES}
 
 
 def get_company(name: str) -> Dict[str, Any] | None:
@@ -168,6 +246,37 @@ def get_security_posture(company_name: str) -> Dict[str, Any] | None:
     return comp.get("security_posture")
 
 
+def get_attack_graph(company_name: str) -> attack_graph.AttackGraph | None:
+    """Returns the compiled attack graph for a given company."""
+    comp = get_company(company_name) if company_name else None
+    if comp:
+        return ATTACK_GRAPHS.get(comp.get("company_name", ""))
+    # COMPANY_MAP names such as "Well Connect" differ from the profile's name in punctuation.
+    key = re.sub(r"[^a-z0-9]", "", company_name.lower())
+    for name, graph in ATTACK_GRAPHS.items():
+        if key and key in re.sub(r"[^a-z0-9]", "", name.lower()):
+            return graph
+    return None
+
+def get_reachable_objectives(company_name: str, foothold: str) -> List[str]:
+    """Returns the objectives reachable from a foothold (node id, asset or technique) in a company's attack graph."""
+    graph = get_attack_graph(company_name)
+    if not graph:
+        return []
+    return [node.label for node in graph.reachable_objectives(foothold)]
+
+def get_attack_path(company_name: str, source: str, target: str) -> Dict[str, Any] | None:
+    """Returns the shortest attack path between two nodes and the detection opportunities on it."""
+    graph = get_attack_graph(company_name)
+    if not graph:
+        return None
+    report = graph.path(source, target)
+    return {
+        "path": [f"[{node.id}] {node.label}" for node in report.path],
+        "detections": report.detections,
+    }
+
+
 def pretty_print(obj):
     if isinstance(obj, (dict, list)):
         print_json(data=obj)
@@ -175,13 +284,14 @@ def pretty_print(obj):
         print(obj)
 
 
-def save_session(session: SessionLog, directory: str = "session_logs") -> str:
+def save_session(session: SessionLog, directory: str = "session_logs", suffix: str = "") -> str:
     """
     Persist a SessionLog to disk as JSON.
 
     Args:
         session (SessionLog): The session to persist.
         directory (str): Directory for storing logs.
+        suffix (str): Appended to the file name, to tell apart logs saved in the same second.
 
     Returns:
         str: Absolute path to the saved session file.
@@ -191,7 +301,7 @@ def save_session(session: SessionLog, directory: str = "session_logs") -> str:
 
     os.makedirs(directory, exist_ok=True)
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    file_name = f"Session_log({timestamp}).json"
+    file_name = f"Session_log({timestamp}){suffix}.json"
     path = os.path.join(directory, file_name)
 
     with open(path, "w", encoding="utf-8") as f:
@@ -199,6 +309,19 @@ def save_session(session: SessionLog, directory: str = "session_logs") -> str:
 
     return os.path.abspath(path)
 
+def load_session(path: str) -> SessionLog:
+    """
+    Load a SessionLog previously written by save_session.
+
+    Args:
+        path (str): Path to a Session_log(...).json file.
+
+    Returns:
+        SessionLog: The parsed session.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return SessionLog.model_validate(json.load(f))
+
 def _animate(stop_event: threading.Event, message: str):
     """Displays a simple loading animation in the console."""
     animation = cycle(['.  ', '.. ', '...', ' ..', '  .'])
@@ -221,9 +344,11 @@ def loading_indicator(message: str = "Generating response"):
     stop_event = threading.Event()
     loading_thread = threading.Thread(target=_animate, args=(stop_event, message))
     loading_thread.start()
-    yield
-    stop_event.set()
-    loading_thread.join()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        loading_thread.join()
 
 def select_company_from_cli() -> Tuple[Dict | None, str | None]:
     """
@@ -263,6 +388,10 @@ Simple company JSON REPL. Commands:
   - list-personnel <company_name>             List all personnel for a company.
   - list-assets <company_name>                List all digital assets for a company.
   - security-posture <company_name>           Get the security posture for a company.
+  - graph <company_name>                      Show the compiled attack graph for a company.
+  - reachable <company_name> <foothold>       Objectives reachable from a foothold (node id, asset or technique).
+  - path <company_name> <from> <to>           Shortest attack path and the detection opportunities on it.
+  - digest <company_name> [asset]             The attack-graph digest sent to the models.
   - help                                      Show this help message.
   - exit / quit                               Exit the REPL.
 
@@ -316,6 +445,26 @@ Note: Wrap arguments with spaces in quotes (e.g., tech "Well Connect").
         elif cmd == "security-posture" and len(args) == 1:
             posture = get_security_posture(args[0])
             pretty_print(posture or f"No security posture found for {args[0]}")
+        elif cmd == "graph" and len(args) == 1:
+            graph = get_attack_graph(args[0])
+            print(graph.summary() if graph else f"Company not found: {args[0]}")
+        elif cmd == "reachable" and len(args) >= 2:
+            company_name, foothold = args[0], " ".join(args[1:])
+            objectives = get_reachable_objectives(company_name, foothold)
+            pretty_print(objectives or f"No objectives reachable from '{foothold}' in {company_name}")
+        elif cmd == "path" and len(args) == 3:
+            report = get_attack_path(*args)
+            if report is None:
+                print(f"Company not found: {args[0]}")
+            else:
+                pretty_print(report if report["path"] else f"No path from '{args[1]}' to '{args[2]}' in {args[0]}")
+        elif cmd == "digest" and len(args) in (1, 2):
+            graph = get_attack_graph(args[0])
+            if graph is None:
+                print(f"Company not found: {args[0]}")
+            else:
+                foothold = graph.resolve(args[1], [attack_graph.ASSET]) if len(args) == 2 else None
+                print(graph.digest([foothold] if foothold else []))
         elif cmd == "list":
             print([p.get("company_name") for p in PROFILES])
         elif cmd == "help":